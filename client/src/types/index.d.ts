@@ -32,6 +32,7 @@ declare global {
 
     interface PatientHealthIndicators {
         Time: number;
+        label?: string; // x-axis label, Time is used when missing
         "Wound Temperature": number;
         "Wound pH": number;
         "Moisture Level": number;
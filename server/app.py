@@ -4,29 +4,32 @@ from flask_jwt_extended import JWTManager
 from dotenv import load_dotenv
 from flask_cors import CORS
 import os
-import google.generativeai as genai
-from utils.init_models import initialize_models
+
+# load env variables (before the app modules below read their settings)
+load_dotenv()
+
+from utils.init_models import initialize_models, models_ready
+from utils.commands import register_commands
+from utils.db import ensure_indexes
+from utils.utils import ANALYSIS_CACHE_TTL
+from utils.history import READINGS_TTL
 
 from routes.auth_routes import auth_bp
 from routes.user_routes import user_bp
 from routes.patient_routes import patient_bp
 from routes.prediction_routes import prediction_bp
 
-# load env variables
-load_dotenv()
-
 # init & config flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
 app.config["MONGO_URI"] = os.environ.get("MONGO_URI")
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = False
 app.config['JWT_REFRESH_TOKEN_EXPIRES'] = False
+# Tokens in query strings end up in access logs, only the SSE routes also accept ?jwt=<token>
+app.config['JWT_TOKEN_LOCATION'] = ['headers']
 PORT = int(os.environ.get('PORT')) or 5000
 
-# Configure Google Generative AI
-genai.configure(api_key=os.environ.get('GENAI_API_KEY'))
-
-# manage uploads
+# manage uploads, routes reading large bodies set their own request.max_content_length
 app.config['UPLOAD_FOLDER'] = "uploads"
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
@@ -45,13 +48,20 @@ app.register_blueprint(user_bp, url_prefix="/user")
 app.register_blueprint(patient_bp, url_prefix="/patient")
 app.register_blueprint(prediction_bp, url_prefix="/predict")
 
+# register maintenance commands
+register_commands(app)
+
+# Readiness probe: not ready until the models are loaded and warmed up
 @app.route('/health', methods=['GET'])
 def health_check():
+    if not models_ready.is_set():
+        return jsonify({"status": "starting"}), 503
     return jsonify({"status": "healthy"}), 200
 
 # init ai models and start flask server
 if __name__ == '__main__':
-    initialize_models()
+    ensure_indexes(app.db, analysis_ttl=ANALYSIS_CACHE_TTL, readings_ttl=READINGS_TTL)
+    initialize_models(background=True)
     
     print("Starting Flask server...")
     app.run(debug=True, host='0.0.0.0', port=PORT)
\ No newline at end of file
@@ -0,0 +1,79 @@
+# Benchmark for single-row infection predictions
+# Compares the old two-pass classification (predict + predict_proba) with BasePredictor.predict,
+# through the sklearn pipeline, the compiled fast-path encoder and the array-backed tree ensemble
+#
+# Usage (from the server directory): python -m benchmarks.bench_predict [iterations]
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from predictors.wound_monitoring import get_wound_monitoring_predictor
+
+EXAMPLE = {
+    'Wound Temperature': 37.8,
+    'Wound pH': 6.8,
+    'Moisture Level': 75,
+    'Drug Release': 15
+}
+
+
+def two_pass_predict(predictor, features):
+    """The previous classification path: the pipeline is evaluated twice per reading"""
+    input_features = pd.DataFrame([features])[predictor.prediction_features]
+    prediction = predictor.model.predict(input_features)[0]
+    probability = predictor.model.predict_proba(input_features)[0][1]
+    return prediction, probability
+
+
+def time_per_call(fn, iterations):
+    """Return the mean latency of fn() in milliseconds"""
+    # Warm up
+    for _ in range(10):
+        fn()
+    
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    
+    predictor = get_wound_monitoring_predictor()
+    if predictor is None or predictor.model is None:
+        print("Infection model not available")
+        return
+    
+    # Both paths must agree before timing them
+    expected_prediction, expected_probability = two_pass_predict(predictor, EXAMPLE)
+    prediction, probability = predictor.predict(EXAMPLE)
+    assert prediction == expected_prediction and np.isclose(probability, expected_probability)
+    
+    encoder, estimator = predictor.encoder, predictor.estimator
+    
+    two_pass = time_per_call(lambda: two_pass_predict(predictor, EXAMPLE), iterations)
+    fast_path = time_per_call(lambda: predictor.predict(EXAMPLE), iterations)
+    
+    # Fast-path encoder feeding the sklearn estimator instead of the tree ensemble
+    predictor.estimator = predictor.model.steps[-1][1]
+    sklearn_estimator = time_per_call(lambda: predictor.predict(EXAMPLE), iterations)
+    
+    # Same call with the fast path disabled
+    predictor.encoder = None
+    single_pass = time_per_call(lambda: predictor.predict(EXAMPLE), iterations)
+    predictor.encoder, predictor.estimator = encoder, estimator
+    
+    print(f"\nSingle-row infection prediction ({iterations} iterations):")
+    print(f"Two-pass (predict + predict_proba): {two_pass:.3f} ms/call")
+    print(f"Single-pass pipeline: {single_pass:.3f} ms/call ({two_pass / single_pass:.2f}x)")
+    if encoder is not None:
+        print(f"Fast-path encoder + sklearn estimator: {sklearn_estimator:.3f} ms/call ({two_pass / sklearn_estimator:.2f}x)")
+    if predictor.tree_ensemble is not None:
+        print(f"Fast-path encoder + tree ensemble: {fast_path:.3f} ms/call ({two_pass / fast_path:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Benchmark for patient name search at 100k patients
+# Times the in-process typo-tolerant NameIndex and, when BENCH_MONGO_URI is set, compares the old
+# unanchored $regex query with the indexed name-token prefix query on a scratch database
+#
+# Usage (from the server directory): python -m benchmarks.bench_search [patients]
+
+import os
+import random
+import re
+import sys
+import time
+from datetime import datetime, UTC
+
+from utils.name_index import NameIndex, tokenize_name, name_token_query
+
+FIRST_NAMES = ["John", "Anna", "Mohammad", "Hassan", "Maria", "Omar", "Lina", "Ahmad", "Sara", "Yusuf",
+               "Emma", "Noah", "Layla", "Karim", "Nour", "Ali", "Hana", "Samir", "Rania", "Tariq"]
+QUERIES = ["joh", "anna sm", "mohamad", "hasan", "zzz"]
+
+
+def synthetic_names(count):
+    """Names with random surnames so the vocabulary grows with the collection"""
+    rng = random.Random(42)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    names = []
+    for _ in range(count):
+        surname = "".join(rng.choice(letters) for _ in range(rng.randint(4, 9))).capitalize()
+        names.append(f"{rng.choice(FIRST_NAMES)} {surname}")
+    # A few names the queries are about
+    names[:3] = ["Anna Smith", "Mohammad Bakour", "Hassan Hatab"]
+    return names
+
+
+def time_ms(fn, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def bench_name_index(names):
+    index = NameIndex()
+    start = time.perf_counter()
+    for i, name in enumerate(names):
+        index.add(i, name)
+    print(f"NameIndex build: {(time.perf_counter() - start) * 1000:.0f} ms for {len(names)} patients")
+
+    for query in QUERIES:
+        elapsed, result = time_ms(lambda: index.search(query, limit=len(names)))
+        print(f"  fuzzy '{query}': {elapsed:.2f} ms, {len(result)} matches")
+
+
+def bench_mongo(uri, names):
+    from pymongo import MongoClient, ASCENDING
+
+    db = MongoClient(uri)["smartcare_bench"]
+    db.patients.drop()
+    supervisor = "bench"
+    now = datetime.now(UTC)
+    db.patients.insert_many([
+        {"supervisor": supervisor, "name": name, "name_tokens": tokenize_name(name), "created_at": now}
+        for name in names
+    ])
+    db.patients.create_index([("supervisor", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)])
+    db.patients.create_index([("supervisor", ASCENDING), ("name_tokens", ASCENDING)])
+
+    for query in QUERIES:
+        regex = {"supervisor": supervisor, "name": {"$regex": re.escape(query), "$options": "i"}}
+        tokens = {"supervisor": supervisor, **name_token_query(query)}
+        for label, mongo_query in [("$regex", regex), ("tokens", tokens)]:
+            elapsed, result = time_ms(lambda: list(db.patients.find(mongo_query, {"name": 1})), repeat=5)
+            stats = db.patients.find(mongo_query).explain()["executionStats"]
+            print(f"  {label:7} '{query}': {elapsed:.2f} ms, {len(result)} matches, {stats['totalDocsExamined']} docs examined")
+
+    db.patients.drop()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    names = synthetic_names(count)
+
+    bench_name_index(names)
+
+    uri = os.environ.get("BENCH_MONGO_URI")
+    if uri:
+        print("MongoDB:")
+        bench_mongo(uri, names)
+    else:
+        print("Set BENCH_MONGO_URI to also benchmark the Mongo queries")
+
+
+if __name__ == "__main__":
+    main()
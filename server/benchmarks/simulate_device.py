@@ -0,0 +1,104 @@
+# Simulated bedside device for the live ingestion endpoint
+# Posts synthetic readings to POST /patient/ingest/<id> in batches while following the patient's
+# monitor stream, then reports how long readings took from upload to SSE delivery
+#
+# Usage (from the server directory, against a running server):
+#   SMARTCARE_TOKEN=<jwt> python -m benchmarks.simulate_device <patient_id> [readings] [batch_size]
+# SMARTCARE_URL defaults to http://localhost:5000, SMARTCARE_FRAMING is ndjson (default) or binary
+
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+import requests
+
+from utils.recordings import READING_DTYPE
+from utils.utils import HEALTH_DATA_FIELDS
+
+# Seconds between two device uploads
+SEND_INTERVAL = 0.1
+
+
+def synthetic_readings(count, seed=7):
+    """Readings drifting around typical wound values, Time counts up in steps of 2 from the
+    current epoch millisecond so every run's readings can be told apart from logged ones"""
+    rng = np.random.default_rng(seed)
+    readings = np.column_stack([
+        time.time_ns() // 1_000_000 + np.arange(count) * 2.0,
+        37 + np.cumsum(rng.normal(0, 0.05, count)),
+        7 + np.cumsum(rng.normal(0, 0.01, count)),
+        np.clip(60 + np.cumsum(rng.normal(0, 0.5, count)), 0, 100),
+        np.clip(10 + np.cumsum(rng.normal(0, 0.2, count)), 0, None),
+    ])
+    return readings.round(3)
+
+
+def encode(batch, framing):
+    if framing == "binary":
+        return batch.astype(READING_DTYPE).tobytes(), "application/octet-stream"
+    lines = (json.dumps(dict(zip(HEALTH_DATA_FIELDS, row.tolist()))) for row in batch)
+    return ("\n".join(lines) + "\n").encode(), "application/x-ndjson"
+
+
+def follow_monitor(url, patient_id, expected, received, ready):
+    """Record the arrival time of the readings in `expected` (a set of Time values) streamed
+    by /patient/monitor/<id>, the logged readings of earlier runs are ignored"""
+    with requests.get(f"{url}/patient/monitor/{patient_id}", stream=True, timeout=60) as response:
+        ready.set()
+        for line in response.iter_lines(decode_unicode=True):
+            if line and line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if data.get("Time") in expected:
+                    received[data["Time"]] = time.perf_counter()
+                    if len(received) >= len(expected):
+                        return
+
+
+def main():
+    url = os.environ.get("SMARTCARE_URL", "http://localhost:5000")
+    token = os.environ["SMARTCARE_TOKEN"]
+    framing = os.environ.get("SMARTCARE_FRAMING", "ndjson")
+    patient_id = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    readings = synthetic_readings(count)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # The live channel exists once the first batch is accepted, open the monitor right after it
+    sent = {}
+    received = {}
+    ready = threading.Event()
+    listener = None
+
+    for start in range(0, count, batch_size):
+        batch = readings[start:start + batch_size]
+        body, content_type = encode(batch, framing)
+
+        now = time.perf_counter()
+        for row in batch:
+            sent[row[0]] = now
+        response = requests.post(f"{url}/patient/ingest/{patient_id}", data=body,
+                                 headers={**headers, "Content-Type": content_type}, timeout=10)
+        response.raise_for_status()
+
+        if listener is None:
+            listener = threading.Thread(target=follow_monitor, args=(url, patient_id, set(readings[:, 0].tolist()), received, ready), daemon=True)
+            listener.start()
+            ready.wait(10)
+        time.sleep(SEND_INTERVAL)
+
+    listener.join(timeout=30)
+
+    # The first batch may have been logged before the monitor connected, skip it
+    latencies = np.array([received[t] - sent[t] for t in readings[batch_size:, 0] if t in received]) * 1000
+    print(f"Sent {count} readings in batches of {batch_size} ({framing}), {len(received)} streamed back")
+    if len(latencies):
+        print(f"Upload to SSE latency: p50 {np.percentile(latencies, 50):.1f} ms, "
+              f"p95 {np.percentile(latencies, 95):.1f} ms, max {latencies.max():.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+import os
+
+# gunicorn -c gunicorn.conf.py wsgi:app
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Cooperative workers: every open SSE connection is a greenlet, not an OS thread
+worker_class = "gevent"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_connections = int(os.environ.get("WORKER_CONNECTIONS", 1000))
+
+# Worker liveness timeout, open streams do not count against it with gevent workers
+timeout = int(os.environ.get("WORKER_TIMEOUT", 60))
+keepalive = 75
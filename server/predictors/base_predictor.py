@@ -2,16 +2,55 @@
 # This abstract base class provides common functionality for all predictors
 
 import os
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split, GridSearchCV
-from sklearn.metrics import accuracy_score, mean_squared_error, mean_squared_error, mean_absolute_error, r2_score, accuracy_score, classification_report, confusion_matrix, root_mean_squared_error
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
-from sklearn.compose import ColumnTransformer
-from sklearn.pipeline import Pipeline
 import joblib
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+
+from predictors.feature_encoder import FeatureEncoder
+from predictors.tree_ensemble import TreeEnsemble
+from predictors.model_search import CandidateSearch, N_SAMPLES
+from predictors.incremental_training import StreamingMetrics, holdout_mask
+
+# sklearn is imported by the training and evaluation methods, serving only needs it once a
+# pickle is loaded, so importing this module (and the app) stays fast
+
+# Parallel fits during training, -1 for one per core
+TRAINING_JOBS = int(os.environ.get("TRAINING_JOBS", -1))
+
+# Hyperparameter search: strategy ('grid', 'random' or 'halving'), candidates sampled by
+# random search, and wall-clock seconds each model's search may take (unlimited if unset)
+TRAINING_SEARCH = os.environ.get("TRAINING_SEARCH", "halving")
+TRAINING_SEARCH_ITER = int(os.environ.get("TRAINING_SEARCH_ITER", 10))
+TRAINING_BUDGET = float(os.environ["TRAINING_BUDGET"]) if os.environ.get("TRAINING_BUDGET") else None
+
+# Incremental training: rows read from the CSV at a time, and passes over the data
+TRAINING_CHUNK_SIZE = int(os.environ.get("TRAINING_CHUNK_SIZE", 100_000))
+TRAINING_EPOCHS = int(os.environ.get("TRAINING_EPOCHS", 5))
+
+class DeferredPipeline:
+    """Stands in for the sklearn pipeline of a predictor serving from its exported encoder and
+    tree ensemble, the pickle is only loaded the first time one of its attributes is used"""
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.pipeline = None
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        with self.lock:
+            if self.pipeline is None:
+                self.pipeline = joblib.load(self.model_path)
+                print(f"Model loaded from {self.model_path}")
+        return getattr(self.pipeline, name)
+
 
 class BasePredictor:
-    def __init__(self, dataset_name, model_name, numerical_features, categorical_features, target_feature, is_classification=True):
+    def __init__(self, dataset_name, model_name, numerical_features, categorical_features, target_feature, is_classification=True, models_dir=None):
         """Initialize the base predictor with common attributes
         
         Parameters:
@@ -21,6 +60,7 @@ class BasePredictor:
         categorical_features (list): List of categorical feature column names
         target_feature (str): Name of target column for prediction
         is_classification (bool): True if the task is classification, False for regression
+        models_dir (str): Directory of the model files, the server's models directory by default
         """
         # Dataset info
         self.dataset_name = dataset_name
@@ -37,10 +77,38 @@ class BasePredictor:
         # Model info
         self.model = None
         self.preprocessor = None
-        self.model_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
-                                       'models', f'{model_name}_model.pkl')
-        self.preprocessor_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 
-                                             'models', f'{model_name}_preprocessor.pkl')
+        
+        # Fast-path inference: NumPy feature encoder and the estimator (or exported tree ensemble) behind it
+        self.encoder = None
+        self.estimator = None
+        self.tree_ensemble = None
+        if models_dir is None:
+            models_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models')
+        self.model_name = model_name
+        self.model_path = os.path.join(models_dir, f'{model_name}_model.pkl')
+        self.preprocessor_path = os.path.join(models_dir, f'{model_name}_preprocessor.pkl')
+        self.tree_ensemble_path = os.path.join(models_dir, f'{model_name}_model.trees.npz')
+        self.encoder_path = os.path.join(models_dir, f'{model_name}_model.encoder.npz')
+        self.model_checksum = None
+        
+        # Test-set metrics of the last evaluate_model call, published with the model
+        self.metrics = {}
+        
+        # Per candidate model timing breakdown of the last train_model call
+        self.training_times = {}
+    
+    def column_dtypes(self):
+        """Declared dtypes of the dataset columns, pandas doesn't have to infer them and
+        categorical values are stored once per chunk instead of once per row
+        
+        Returns:
+        dict: Column names mapped to their dtype
+        """
+        dtypes = {feature: 'float64' for feature in self.numerical_features}
+        dtypes.update({feature: 'category' for feature in self.categorical_features})
+        if not self.is_classification:
+            dtypes[self.target_feature] = 'float64'
+        return dtypes
     
     def load_data(self, dataset_path, nrows=None):
         """Load the dataset from CSV file
@@ -53,40 +121,72 @@ class BasePredictor:
         pandas.DataFrame: The loaded data, or None if error occurs
         """
         try:
-            data = pd.read_csv(dataset_path, nrows=nrows)
-            print(f"Data loaded successfully. Shape: {data.shape}")
-            print(f"Data columns: {data.columns.tolist()}")
-            print(data.head())
+            data = pd.read_csv(dataset_path, nrows=nrows, dtype=self.column_dtypes())
             return data
         except Exception as e:
             print(f"Error loading data: {e}")
             return None
     
-    def preprocess_data(self, data):
-        """Preprocess data
+    def iter_data(self, dataset_path, chunksize=None, columns=None, prepare=None):
+        """Stream the dataset from CSV file, one chunk in memory at a time
         
         Parameters:
-        data: (pandas.DataFrame) The input data
+        dataset_path (str): Path to the CSV file
+        chunksize (int): Rows per chunk, TRAINING_CHUNK_SIZE by default
+        columns (list): Columns to read, the prediction features and target by default
+        prepare (callable): Custom preprocessing applied to every chunk, returns the chunk
+        
+        Yields:
+        pandas.DataFrame: The chunks, in file order
+        """
+        columns = columns or self.prediction_features + [self.target_feature]
+        dtypes = {column: dtype for column, dtype in self.column_dtypes().items() if column in columns}
+        
+        with pd.read_csv(dataset_path, usecols=columns, dtype=dtypes, chunksize=chunksize or TRAINING_CHUNK_SIZE) as reader:
+            for chunk in reader:
+                yield prepare(chunk) if prepare else chunk
+    
+    def build_preprocessor(self, categories=None):
+        """Create the unfitted preprocessing pipeline
+        
+        Parameters:
+        categories (list): Known values of each categorical feature, learned when fitting if None
         
         Returns:
-        ColumnTransformer: The preprocessing pipeline
+        ColumnTransformer: StandardScaler for the numerical features, OneHotEncoder for the categorical ones
         """
-
-        # Create preprocessing pipeline
+        from sklearn.preprocessing import StandardScaler, OneHotEncoder
+        from sklearn.compose import ColumnTransformer
+        from sklearn.pipeline import Pipeline
+        
         numerical_transformer = Pipeline(steps=[
             ('scaler', StandardScaler())
         ])
         
         categorical_transformer = Pipeline(steps=[
-            ('onehot', OneHotEncoder(handle_unknown='ignore'))
+            ('onehot', OneHotEncoder(categories=categories or 'auto', handle_unknown='ignore'))
         ])
         
         # Combine preprocessing steps
-        self.preprocessor = ColumnTransformer(
+        return ColumnTransformer(
             transformers=[
                 ('num', numerical_transformer, self.numerical_features),
                 ('cat', categorical_transformer, self.categorical_features)
             ])
+    
+    def preprocess_data(self, data):
+        """Preprocess data
+        
+        Parameters:
+        data: (pandas.DataFrame) The input data
+        
+        Returns:
+        ColumnTransformer: The preprocessing pipeline
+        """
+        from sklearn.model_selection import train_test_split
+        
+        # Create preprocessing pipeline
+        self.preprocessor = self.build_preprocessor()
         
         # Select features and target
         X = data[self.prediction_features]
@@ -97,19 +197,32 @@ class BasePredictor:
 
         return X_train, X_test, y_train, y_test
     
-    def train_model(self, X_train, y_train, models=None, param_grids=None, scoring_metric=None):
-        """Train model with grid search for best parameters
+    def train_model(self, X_train, y_train, models=None, param_grids=None, scoring_metric=None, n_jobs=None,
+                    search=None, budget=None, n_iter=None, resource=N_SAMPLES):
+        """Train model with a hyperparameter search for best parameters
+        
+        Every candidate and CV fold of a model is fitted in parallel, and the preprocessor
+        fitted on a fold is cached and reused by every candidate and model fitting that fold.
         
         Parameters:
         X_train: Features training data
         y_train: Target training data
         models: Dictionary of model names and their instances
-        param_grids: Dictionary of model names and their parameter grids for GridSearchCV
+        param_grids: Dictionary of model names and their parameter grids (lists, or distributions for random search)
         scoring_metric: Metric to use for model selection ('accuracy' for classification, 'neg_mean_squared_error' for regression)
+        n_jobs: Number of parallel fits (-1 for one per core), TRAINING_JOBS by default
+        search: 'grid', 'random' or 'halving' (successive halving), TRAINING_SEARCH by default
+        budget: Wall-clock seconds each model's search may take, TRAINING_BUDGET by default
+        n_iter: Candidates sampled per model by random search, TRAINING_SEARCH_ITER by default
+        resource: What halving grows each round, 'n_samples' or a parameter such as 'model__n_estimators'
+                  (models without that parameter use 'n_samples')
         
         Returns:
         The trained model pipeline
         """
+        from sklearn.metrics import accuracy_score, mean_squared_error
+        from sklearn.pipeline import Pipeline
+        
         if models is None or len(models) == 0:
             raise ValueError("No models provided for training")
             
@@ -119,53 +232,93 @@ class BasePredictor:
         if scoring_metric is None:
             scoring_metric = 'accuracy' if self.is_classification else 'neg_mean_squared_error'
         
+        if n_jobs is None:
+            n_jobs = TRAINING_JOBS
+        search = search or TRAINING_SEARCH
+        budget = budget or TRAINING_BUDGET
+        n_iter = n_iter or TRAINING_SEARCH_ITER
+        
         best_model = None
         best_score = float('-inf')
         best_model_name = None
+        self.training_times = {}
         
-        print("Training models...")
+        # Fitted preprocessors are cached on disk, where the parallel workers can share them
+        cache_dir = tempfile.mkdtemp(prefix=f'{self.model_name}-training-')
+        memory = joblib.Memory(cache_dir, verbose=0)
         
-        # Train and evaluate each model
-        for name, model in models.items():
-            pipeline = Pipeline(steps=[
-                ('preprocessor', self.preprocessor),
-                ('model', model)
-            ])
-            
-            # Get parameter grid for this model if available
-            param_grid = param_grids.get(name, {})
-            
-            # Use GridSearchCV to find best parameters if a param grid is provided
-            if param_grid:
-                grid_search = GridSearchCV(pipeline, param_grid, cv=5, scoring=scoring_metric)
-                grid_search.fit(X_train, y_train)
-                pipeline = grid_search.best_estimator_
-                best_params = grid_search.best_params_
-                score = grid_search.best_score_
-                print(f"{name} best parameters: {best_params}")
-            else:
-                pipeline.fit(X_train, y_train)
-                # For classification models
-                if hasattr(pipeline, 'predict_proba') and self.is_classification:
-                    score = accuracy_score(y_train, pipeline.predict(X_train))
-                # For regression models
+        print(f"Training models ({search} search, n_jobs={n_jobs}, budget={budget or 'unlimited'})...")
+        
+        try:
+            # Train and evaluate each model
+            for name, model in models.items():
+                started = time.perf_counter()
+                pipeline = Pipeline(steps=[
+                    ('preprocessor', self.preprocessor),
+                    ('model', model)
+                ], memory=memory)
+                
+                # Get parameter grid for this model if available
+                param_grid = param_grids.get(name, {})
+                
+                # Search the best parameters if a param grid is provided
+                if param_grid:
+                    candidate_search = CandidateSearch(pipeline, param_grid, scoring_metric, strategy=search, cv=5,
+                                                       n_jobs=n_jobs, budget=budget, n_iter=n_iter, resource=resource,
+                                                       is_classification=self.is_classification)
+                    candidate_search.fit(X_train, y_train)
+                    pipeline = candidate_search.best_estimator_
+                    best_params = candidate_search.best_params_
+                    score = candidate_search.best_score_
+                    print(f"{name} best parameters: {best_params}")
+                    
+                    times = dict(candidate_search.times)
+                    if times['stopped']:
+                        print(f"{name} search stopped early ({times['stopped']}) after {times['rounds']} rounds")
                 else:
-                    predictions = pipeline.predict(X_train)
-                    score = -mean_squared_error(y_train, predictions)
-            
-            # Print appropriate metrics based on model type
-            if self.is_classification:
-                print(f"{name} training accuracy: {score if score <= 1.0 else -score:.4f}")
-            else:
-                # For regression, we want to minimize error
-                mse = -score if score < 0 else score
-                print(f"{name} training MSE: {mse:.4f}")
-            
-            # For classification, higher score is better; for regression with neg_mse, higher (less negative) is better
-            if best_model is None or score > best_score:
-                best_model = pipeline
-                best_score = score
-                best_model_name = name
+                    fit_started = time.perf_counter()
+                    pipeline.fit(X_train, y_train)
+                    score_started = time.perf_counter()
+                    # For classification models
+                    if hasattr(pipeline, 'predict_proba') and self.is_classification:
+                        score = accuracy_score(y_train, pipeline.predict(X_train))
+                    # For regression models
+                    else:
+                        predictions = pipeline.predict(X_train)
+                        score = -mean_squared_error(y_train, predictions)
+                    
+                    times = {
+                        'fits': 1,
+                        'fit_seconds': score_started - fit_started,
+                        'score_seconds': time.perf_counter() - score_started,
+                        'refit_seconds': 0.0
+                    }
+                
+                # Wall time against the summed fit and score times shows what parallelism gained
+                times['wall_seconds'] = time.perf_counter() - started
+                self.training_times[name] = times
+                print(f"{name} trained in {times['wall_seconds']:.2f}s: {times['fits']} fits, "
+                      f"{times['fit_seconds']:.2f}s fitting, {times['score_seconds']:.2f}s scoring, "
+                      f"{times['refit_seconds']:.2f}s refitting the best")
+                
+                # Print appropriate metrics based on model type
+                if self.is_classification:
+                    print(f"{name} training accuracy: {score if score <= 1.0 else -score:.4f}")
+                else:
+                    # For regression, we want to minimize error
+                    mse = -score if score < 0 else score
+                    print(f"{name} training MSE: {mse:.4f}")
+                
+                # For classification, higher score is better; for regression with neg_mse, higher (less negative) is better
+                if best_model is None or score > best_score:
+                    best_model = pipeline
+                    best_score = score
+                    best_model_name = name
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        
+        # The saved pipeline must not point at the removed cache
+        best_model.set_params(memory=None)
         
         # Report results depending on task type
         if self.is_classification:
@@ -175,8 +328,290 @@ class BasePredictor:
             print(f"\nBest model: {best_model_name} with MSE: {mse:.4f}")
             
         self.model = best_model
+        self.compile_encoder()
+        return self.model
+
+    def train_incremental(self, models, dataset_path=None, chunksize=None, epochs=None, columns=None, prepare=None,
+                          holdout=0.2, random_state=42):
+        """Train models supporting partial_fit on the dataset streamed in chunks, out of memory
+
+        The scaler statistics and category values are accumulated over a first pass on the
+        training rows, then every model learns from every chunk for `epochs` passes and is
+        scored on the held-out rows of a last pass. Only one chunk is in memory at a time.
+
+        Parameters:
+        models: Dictionary of model names and their instances, every one supporting partial_fit
+        dataset_path: Path to the CSV file, the predictor's dataset by default
+        chunksize: Rows per chunk, TRAINING_CHUNK_SIZE by default
+        epochs: Passes over the training rows, TRAINING_EPOCHS by default
+        columns: Columns to read, the prediction features and target by default
+        prepare: Custom preprocessing applied to every chunk, must add the target if it's derived
+        holdout: Fraction of the rows held out for evaluation, spread evenly over the file
+        random_state: Seed of the shuffling of every chunk's rows
+
+        Returns:
+        The trained model pipeline, or None if the data couldn't be read
+        """
+        from sklearn.pipeline import Pipeline
+        from sklearn.preprocessing import StandardScaler
+
+        if models is None or len(models) == 0:
+            raise ValueError("No models provided for training")
+        for name, model in models.items():
+            if not hasattr(model, 'partial_fit'):
+                raise ValueError(f"{name} doesn't support partial_fit, it can't be trained incrementally")
+
+        dataset_path = dataset_path or self.dataset_path
+        epochs = epochs or TRAINING_EPOCHS
+        chunks = lambda: self.iter_data(dataset_path, chunksize, columns, prepare)
+
+        def split(chunk, start):
+            held_out = holdout_mask(start, len(chunk), holdout)
+            return chunk[~held_out], chunk[held_out]
+
+        # Pass 1: preprocessing statistics of the training rows
+        scaler = StandardScaler()
+        categories = [set() for _ in self.categorical_features]
+        classes = set()
+        sample = None
+        n_rows = n_train = 0
+        started = time.perf_counter()
+
+        try:
+            for chunk in chunks():
+                train, _ = split(chunk, n_rows)
+                n_rows += len(chunk)
+                n_train += len(train)
+                if train.empty:
+                    continue
+
+                if self.numerical_features:
+                    scaler.partial_fit(train[self.numerical_features])
+                for values, feature in zip(categories, self.categorical_features):
+                    values.update(train[feature].dropna().unique())
+                if self.is_classification:
+                    classes.update(train[self.target_feature].unique())
+                if sample is None:
+                    sample = train
+        except Exception as e:
+            print(f"Error loading data: {e}")
+            return None
+
+        if sample is None:
+            print("Error loading data: no training rows")
+            return None
+
+        print(f"Data streamed in chunks: {n_rows} rows, {n_train} for training, {n_rows - n_train} held out "
+              f"({time.perf_counter() - started:.2f}s)")
+
+        # The preprocessor is fitted on a sample for its structure, then given the statistics of all the rows
+        self.preprocessor = self.build_preprocessor([sorted(values) for values in categories])
+        self.preprocessor.fit(sample[self.prediction_features])
+        if self.numerical_features:
+            self.preprocessor.named_transformers_['num'].steps[0] = ('scaler', scaler)
+        classes = np.array(sorted(classes))
+
+        self.training_times = {name: {'fits': 0, 'fit_seconds': 0.0, 'score_seconds': 0.0, 'refit_seconds': 0.0}
+                               for name in models}
+
+        print(f"Training models incrementally ({epochs} epochs, {len(models)} models)...")
+
+        # Every chunk is transformed once and learned by all the models
+        for epoch in range(epochs):
+            epoch_started = time.perf_counter()
+            start = 0
+            for i, chunk in enumerate(chunks()):
+                train, _ = split(chunk, start)
+                start += len(chunk)
+                if train.empty:
+                    continue
+
+                # File order isn't random, shuffle within the chunk
+                train = train.sample(frac=1, random_state=random_state + epoch * 7919 + i)
+                X = self.preprocessor.transform(train[self.prediction_features])
+                y = train[self.target_feature].to_numpy()
+
+                for name, model in models.items():
+                    fit_started = time.perf_counter()
+                    if self.is_classification:
+                        model.partial_fit(X, y, classes=classes)
+                    else:
+                        model.partial_fit(X, y)
+                    self.training_times[name]['fits'] += 1
+                    self.training_times[name]['fit_seconds'] += time.perf_counter() - fit_started
+
+            print(f"Epoch {epoch + 1}/{epochs} done in {time.perf_counter() - epoch_started:.2f}s")
+
+        # Last pass: score the held-out rows
+        metrics = {name: StreamingMetrics(self.is_classification) for name in models}
+        start = 0
+        for chunk in chunks():
+            _, test = split(chunk, start)
+            start += len(chunk)
+            if test.empty:
+                continue
+
+            X = self.preprocessor.transform(test[self.prediction_features])
+            y = test[self.target_feature].to_numpy()
+            for name, model in models.items():
+                score_started = time.perf_counter()
+                metrics[name].update(y, model.predict(X))
+                self.training_times[name]['score_seconds'] += time.perf_counter() - score_started
+
+        best_model_name = max(models, key=lambda name: metrics[name].score())
+        for name in models:
+            times = self.training_times[name]
+            times['wall_seconds'] = times['fit_seconds'] + times['score_seconds']
+            times['rows'] = n_train
+            print(f"{name} trained in {times['wall_seconds']:.2f}s: {times['fits']} partial fits, "
+                  f"held-out metrics: {metrics[name].result()}")
+
+        self.metrics = {key: float(value) for key, value in metrics[best_model_name].result().items()}
+        print(f"\nBest model: {best_model_name} with held-out metrics: {self.metrics}")
+
+        self.model = Pipeline(steps=[
+            ('preprocessor', self.preprocessor),
+            ('model', models[best_model_name])
+        ])
+        self.compile_encoder()
         return self.model
 
+    def compile_encoder(self):
+        """Compile the fitted preprocessor into a NumPy FeatureEncoder for fast predictions
+        
+        The encoder is only enabled if it reproduces the sklearn preprocessor output,
+        otherwise predictions keep going through the full pipeline.
+        
+        Returns:
+        bool - True if the fast path is enabled, False otherwise
+        """
+        self.encoder = None
+        self.estimator = None
+        
+        try:
+            # The fitted preprocessor lives inside the pipeline, the saved one may be unfitted
+            preprocessor = self.model.named_steps['preprocessor']
+            encoder = FeatureEncoder.from_column_transformer(preprocessor, self.numerical_features, self.categorical_features)
+            
+            if not encoder.check_parity(preprocessor):
+                print("Fast-path encoder does not match the sklearn preprocessor, using the pipeline instead")
+                return False
+            
+            self.encoder = encoder
+            self.estimator = self.model.steps[-1][1]
+            print("Fast-path feature encoder compiled")
+            return True
+        except Exception as e:
+            print(f"Fast-path encoder unavailable, using the pipeline instead: {e}")
+            return False
+    
+    def update_model_checksum(self):
+        """Hash the saved model file, the checksum identifies the model artifact version
+        
+        Returns:
+        str - The SHA-256 checksum, or None if the model file doesn't exist
+        """
+        if os.path.exists(self.model_path):
+            with open(self.model_path, 'rb') as f:
+                self.model_checksum = hashlib.sha256(f.read()).hexdigest()
+        return self.model_checksum
+    
+    def load_export(self, cls, path):
+        """Load a FeatureEncoder or TreeEnsemble exported beside the model pickle
+        
+        Returns:
+        The export, or None if it's missing or wasn't made from the current model file
+        """
+        if not os.path.exists(path):
+            return None
+        export = cls.load(path)
+        if export is None or not self.model_checksum or export.checksum != self.model_checksum:
+            return None
+        return export
+    
+    def load_tree_ensemble(self):
+        """Load the array-backed tree ensemble saved beside the model pickle, exporting it if needed
+        
+        The export is reused only if it was made from the current model file, and the
+        engine is only enabled if it matches the sklearn estimator on the encoder's sample rows.
+        The encoder is exported beside it too, so load_exports can serve without the pickle.
+        
+        Returns:
+        bool - True if predictions go through the tree ensemble engine, False otherwise
+        """
+        self.tree_ensemble = None
+        
+        # The engine consumes encoded matrices, so it needs the fast-path encoder
+        if self.encoder is None:
+            return False
+        
+        estimator = self.model.steps[-1][1]
+        
+        try:
+            self.update_model_checksum()
+            
+            ensemble = self.load_export(TreeEnsemble, self.tree_ensemble_path)
+            if ensemble is None:
+                ensemble = TreeEnsemble.from_estimator(estimator, checksum=self.model_checksum or "")
+                if self.model_checksum:
+                    ensemble.save(self.tree_ensemble_path)
+                    print(f"Tree ensemble exported to {self.tree_ensemble_path}")
+            
+            # Parity check against sklearn before switching over
+            X = self.encoder.encode(self.encoder.sample_inputs())
+            if self.is_classification:
+                matches = np.allclose(ensemble.predict_proba(X), estimator.predict_proba(X))
+            else:
+                matches = np.allclose(ensemble.predict(X), estimator.predict(X))
+            
+            if not matches:
+                print("Tree ensemble does not match the sklearn model, using the estimator instead")
+                return False
+            
+            self.tree_ensemble = ensemble
+            self.estimator = ensemble
+            print(f"Tree ensemble engine enabled ({len(ensemble.roots)} trees)")
+        except Exception as e:
+            print(f"Tree ensemble engine unavailable, using the estimator instead: {e}")
+            return False
+        
+        try:
+            if self.model_checksum and self.load_export(FeatureEncoder, self.encoder_path) is None:
+                self.encoder.checksum = self.model_checksum
+                self.encoder.save(self.encoder_path)
+                print(f"Feature encoder exported to {self.encoder_path}")
+        except Exception as e:
+            print(f"Feature encoder not exported, the model will be unpickled to serve it: {e}")
+        return True
+    
+    def load_exports(self):
+        """Serve from the feature encoder and tree ensemble exported beside the model pickle
+        
+        Both must have been exported from the current model file, they passed their parity
+        checks then. The sklearn pipeline is only unpickled once something needs it besides
+        predictions, which keeps loading a model well under a second.
+        
+        Returns:
+        bool - True if the predictor serves from the exports, False otherwise
+        """
+        try:
+            self.update_model_checksum()
+            encoder = self.load_export(FeatureEncoder, self.encoder_path)
+            ensemble = self.load_export(TreeEnsemble, self.tree_ensemble_path)
+        except Exception as e:
+            print(f"Model exports unavailable, loading the pickle instead: {e}")
+            return False
+        
+        if encoder is None or ensemble is None or encoder.features != self.prediction_features:
+            return False
+        
+        self.model = DeferredPipeline(self.model_path)
+        self.encoder = encoder
+        self.tree_ensemble = ensemble
+        self.estimator = ensemble
+        print(f"Model loaded from the exports beside {self.model_path} ({len(ensemble.roots)} trees)")
+        return True
+
     def evaluate_model(self, X_test, y_test):
         """Evaluate the model performance on test data
         
@@ -194,6 +629,8 @@ class BasePredictor:
             mae: float - Mean Absolute Error
             r2: float - R² Score
         """
+        from sklearn.metrics import accuracy_score, mean_squared_error, mean_absolute_error, r2_score, classification_report, confusion_matrix, root_mean_squared_error
+        
         if self.model is None:
             print("Model has not been trained or loaded yet")
             return None
@@ -216,6 +653,8 @@ class BasePredictor:
             print("Confusion Matrix:")
             print(matrix)
             
+            self.metrics = {'accuracy': float(accuracy)}
+            
             # Return metrics
             return accuracy, report, matrix
         else:            
@@ -232,6 +671,8 @@ class BasePredictor:
             print(f"Root Mean Squared Error: {rmse:.4f}")
             print(f"R² Score: {r2:.4f}")
             
+            self.metrics = {'mae': float(mae), 'mse': float(mse), 'rmse': float(rmse), 'r2': float(r2)}
+            
             # Return metrics
             return mae, mse, rmse, r2
 
@@ -247,15 +688,21 @@ class BasePredictor:
         
         # Check if model exists
         if os.path.exists(self.model_path) and os.path.exists(self.preprocessor_path):
+            if self.load_exports():
+                return True
+            
             try:
                 self.model = joblib.load(self.model_path)
                 self.preprocessor = joblib.load(self.preprocessor_path)
                 print(f"Model loaded from {self.model_path}")
                 print(f"Preprocessor loaded from {self.preprocessor_path}")
+                self.update_model_checksum()
+                self.compile_encoder()
+                self.load_tree_ensemble()
                 return True
             except Exception as e:
                 print(f"Error loading model: {e}")
-                print("Will train a new model instead.")
+                print("Build the model again with: flask --app app build-models")
                 return False
         
         return False
@@ -278,40 +725,42 @@ class BasePredictor:
             return None if not self.is_classification else (None, None)
         
         try:
-            # Convert input dictionary to DataFrame
-            input_df = pd.DataFrame([features])
-            
-            # Validate input features
-            if not self.validate_input_features(input_df):
-                return None if not self.is_classification else (None, None)
-            
-            # Extract only the relevant features in the correct order
-            input_features = input_df[self.prediction_features]
-            
-            # Make prediction using the pipeline
-            prediction = self.model.predict(input_features)[0]
+            if self.encoder is not None:
+                # Fast path: encode the dict straight into the model's input matrix
+                for feature in self.prediction_features:
+                    if feature not in features:
+                        print(f"Missing feature: {feature}")
+                        return None if not self.is_classification else (None, None)
+                
+                model = self.estimator
+                input_features = self.encoder.encode(features)
+            else:
+                # Convert input dictionary to DataFrame
+                input_df = pd.DataFrame([features])
+                
+                # Validate input features
+                if not self.validate_input_features(input_df):
+                    return None if not self.is_classification else (None, None)
+                
+                # Extract only the relevant features in the correct order
+                model = self.model
+                input_features = input_df[self.prediction_features]
             
             # For classification models, return both prediction and probability
             if self.is_classification:
                 # Check if model has predict_proba method (most classifiers do)
-                if hasattr(self.model, 'predict_proba'):
-                    # Get probability of positive class (index 1 for binary classification)
-                    # For multiclass, this would be the probability of the predicted class
-                    probabilities = self.model.predict_proba(input_features)[0]
-                    
-                    # For binary classification, return probability of class 1
-                    if len(probabilities) == 2:
-                        probability = probabilities[1]
-                    else:
-                        # For multiclass, get probability of predicted class
-                        predicted_class_idx = int(prediction) if isinstance(prediction, (int, float)) else list(self.model.classes_).index(prediction)
-                        probability = probabilities[predicted_class_idx]
-                        
-                    return prediction, probability
+                if hasattr(model, 'predict_proba'):
+                    # Evaluate the model once and derive the label from the probabilities
+                    probabilities = model.predict_proba(input_features)
+                    predictions, positive_probabilities = self.classify_probabilities(probabilities)
+                    return predictions[0], positive_probabilities[0]
                 else:
                     # If model doesn't have predict_proba (e.g., SVM without probability=True)
                     # Just return prediction and None for probability
-                    return prediction, None
+                    return model.predict(input_features)[0], None
+            
+            # Make prediction using the pipeline
+            prediction = model.predict(input_features)[0]
             
             # For regression models, just return the prediction
             return prediction
@@ -320,6 +769,112 @@ class BasePredictor:
             print(f"Error making prediction: {e}")
             return None if not self.is_classification else (None, None)
     
+    def predict_batch(self, features):
+        """Make predictions for a batch of inputs with a single pipeline pass
+        
+        Parameters:
+        features: list of dicts with keys matching self.prediction_features,
+                  or a dict mapping each feature to a list of values (columnar)
+        
+        Returns:
+        results: list - One entry per input row, in input order. For classification each
+                 entry is a (prediction, probability) tuple, for regression the predicted value.
+                 Rows that failed validation get None (or (None, None) for classification)
+        errors: dict - Maps the index of every rejected row to its error message
+        """
+        empty = None if not self.is_classification else (None, None)
+        
+        if self.model is None:
+            raise Exception("Model has not been trained or loaded yet")
+        
+        # Build one DataFrame for the whole batch
+        if isinstance(features, dict):
+            columns = features.values()
+            if not all(isinstance(values, (list, tuple)) for values in columns) or len({len(values) for values in columns}) != 1:
+                raise ValueError("Columnar input must map every feature to a list of the same length")
+            input_df = pd.DataFrame(features)
+        elif isinstance(features, (list, tuple)):
+            input_df = pd.DataFrame([row if isinstance(row, dict) else {} for row in features])
+        else:
+            raise ValueError("Batch input must be a list of records or a dict of columns")
+        
+        n_rows = len(input_df)
+        results = [empty] * n_rows
+        errors = {}
+        
+        if isinstance(features, (list, tuple)):
+            for i, row in enumerate(features):
+                if not isinstance(row, dict):
+                    errors[i] = "Row must be an object"
+        
+        # Validate every row, collecting one error message per rejected row
+        for feature in self.prediction_features:
+            if feature not in input_df.columns:
+                input_df[feature] = None
+            missing = input_df[feature].isna()
+            for i in missing[missing].index:
+                errors.setdefault(i, f"Missing feature: {feature}")
+        
+        for feature in self.numerical_features:
+            numeric = pd.to_numeric(input_df[feature], errors='coerce')
+            invalid = numeric.isna() & input_df[feature].notna()
+            for i in invalid[invalid].index:
+                errors.setdefault(i, f"Invalid numeric value for feature: {feature}")
+            input_df[feature] = numeric
+        
+        valid_rows = [i for i in range(n_rows) if i not in errors]
+        if not valid_rows:
+            return results, errors
+        
+        # Extract only the relevant features in the correct order
+        input_features = input_df.loc[valid_rows, self.prediction_features]
+        
+        # Encode the whole batch at once, through the fast path when available
+        if self.encoder is not None:
+            model = self.estimator
+            input_features = self.encoder.encode(input_features.to_numpy(dtype=object))
+        else:
+            model = self.model
+        
+        # Single transform + model evaluation over the whole batch
+        if self.is_classification:
+            if hasattr(model, 'predict_proba'):
+                probabilities = model.predict_proba(input_features)
+                predictions, positive_probabilities = self.classify_probabilities(probabilities)
+                for i, prediction, probability in zip(valid_rows, predictions, positive_probabilities):
+                    results[i] = (prediction, probability)
+            else:
+                for i, prediction in zip(valid_rows, model.predict(input_features)):
+                    results[i] = (prediction, None)
+        else:
+            for i, prediction in zip(valid_rows, model.predict(input_features)):
+                results[i] = prediction
+        
+        return results, errors
+    
+    def classify_probabilities(self, probabilities):
+        """Derive class labels from predict_proba output without re-running the model
+        
+        Parameters:
+        probabilities (numpy.ndarray): Class probabilities, shape (n_rows, n_classes)
+        
+        Returns:
+        predictions: numpy.ndarray - The most probable class of each row, taken from model.classes_
+        probability: numpy.ndarray - Probability of class 1 for binary models, otherwise of the predicted class
+        """
+        predicted_class_idx = probabilities.argmax(axis=1)
+        
+        # The fast-path estimator carries the classes too, without loading a deferred pipeline
+        classes = self.estimator.classes_ if self.estimator is not None else self.model.classes_
+        predictions = classes[predicted_class_idx]
+        
+        # For binary classification, return probability of class 1
+        if probabilities.shape[1] == 2:
+            return predictions, probabilities[:, 1]
+        
+        # For multiclass, get probability of predicted class
+        return predictions, probabilities[np.arange(len(probabilities)), predicted_class_idx]
+    
     def validate_input_features(self, input_df):
         """Validate that all required features are present
         
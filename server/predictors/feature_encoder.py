@@ -0,0 +1,208 @@
+# Fast-path feature encoder for SmartCare predictors
+# Compiles a fitted ColumnTransformer (StandardScaler + OneHotEncoder) into plain NumPy
+# lookups so single predictions don't pay for DataFrame construction and pandas overhead
+
+import os
+import numpy as np
+import pandas as pd
+
+# Bump when the exported layout changes so stale files get re-exported
+FORMAT_VERSION = 1
+
+
+class FeatureEncoder:
+    def __init__(self, numerical_features, categorical_features, means, scales, categories, checksum=""):
+        """Initialize the encoder from already extracted preprocessing statistics
+
+        Parameters:
+        numerical_features (list): Numerical feature names, in model input order
+        categorical_features (list): Categorical feature names, in model input order
+        means (numpy.ndarray): StandardScaler mean_ for each numerical feature
+        scales (numpy.ndarray): StandardScaler scale_ for each numerical feature
+        categories (list): OneHotEncoder categories_ for each categorical feature
+        checksum (str): Checksum of the model file the encoder was compiled from
+        """
+        self.numerical_features = list(numerical_features)
+        self.categorical_features = list(categorical_features)
+        self.features = self.numerical_features + self.categorical_features
+        self.means = np.asarray(means, dtype=np.float64)
+        self.scales = np.asarray(scales, dtype=np.float64)
+        self.categories = [list(feature_categories) for feature_categories in categories]
+        self.checksum = checksum
+
+        # Map every known category to its absolute column in the output matrix
+        self.category_columns = []
+        offset = len(self.numerical_features)
+        for feature_categories in categories:
+            self.category_columns.append({value: offset + i for i, value in enumerate(feature_categories)})
+            offset += len(feature_categories)
+
+        self.n_outputs = offset
+
+    @classmethod
+    def from_column_transformer(cls, column_transformer, numerical_features, categorical_features):
+        """Compile the encoder from a fitted ColumnTransformer built by BasePredictor.preprocess_data
+
+        Parameters:
+        column_transformer (ColumnTransformer): The fitted preprocessor
+        numerical_features (list): Numerical feature names
+        categorical_features (list): Categorical feature names
+
+        Returns:
+        FeatureEncoder: The compiled encoder
+
+        Raises:
+        ValueError: If the preprocessor uses steps the encoder can't reproduce
+        """
+        if not hasattr(column_transformer, 'transformers_'):
+            raise ValueError("Preprocessor is not fitted")
+
+        means = np.zeros(len(numerical_features))
+        scales = np.ones(len(numerical_features))
+        categories = []
+
+        for name, transformer, columns in column_transformer.transformers_:
+            if name == 'remainder' or len(columns) == 0:
+                continue
+
+            steps = transformer.steps if hasattr(transformer, 'steps') else [(name, transformer)]
+            if len(steps) != 1:
+                raise ValueError(f"Unsupported preprocessing pipeline for '{name}'")
+            step = steps[0][1]
+
+            if name == 'num' and list(columns) == list(numerical_features) and type(step).__name__ == 'StandardScaler':
+                if step.mean_ is not None:
+                    means = step.mean_
+                if step.scale_ is not None:
+                    scales = step.scale_
+            elif name == 'cat' and list(columns) == list(categorical_features) and type(step).__name__ == 'OneHotEncoder':
+                if step.drop_idx_ is not None or getattr(step, 'infrequent_categories_', None):
+                    raise ValueError("OneHotEncoder with dropped or infrequent categories is not supported")
+                categories = list(step.categories_)
+            else:
+                raise ValueError(f"Unsupported transformer '{name}': {type(step).__name__}")
+
+        if categorical_features and len(categories) != len(categorical_features):
+            raise ValueError("Categorical encoder is missing from the preprocessor")
+
+        return cls(numerical_features, categorical_features, means, scales, categories)
+
+    def encode(self, features):
+        """Encode input features into the model's input matrix
+
+        Parameters:
+        features: dict with keys matching self.features, or a 2-D array with one
+                  column per feature in self.features order
+
+        Returns:
+        numpy.ndarray: The encoded matrix, shape (n_rows, n_outputs)
+        """
+        n_numerical = len(self.numerical_features)
+
+        # Single record: fill one row directly
+        if isinstance(features, dict):
+            row = np.zeros((1, self.n_outputs))
+            numerical = np.array([float(features[feature]) for feature in self.numerical_features])
+            row[0, :n_numerical] = (numerical - self.means) / self.scales
+            for feature, columns in zip(self.categorical_features, self.category_columns):
+                column = columns.get(features[feature])
+                if column is not None:
+                    row[0, column] = 1.0
+            return row
+
+        # 2-D input: columns in self.features order
+        X = np.asarray(features, dtype=object)
+        if X.ndim != 2 or X.shape[1] != len(self.features):
+            raise ValueError(f"Expected a 2-D array with {len(self.features)} columns")
+
+        matrix = np.zeros((X.shape[0], self.n_outputs))
+        matrix[:, :n_numerical] = (X[:, :n_numerical].astype(np.float64) - self.means) / self.scales
+        rows = np.arange(X.shape[0])
+        for j, columns in enumerate(self.category_columns):
+            indices = np.fromiter((columns.get(value, -1) for value in X[:, n_numerical + j]), dtype=np.intp, count=X.shape[0])
+            known = indices >= 0
+            matrix[rows[known], indices[known]] = 1.0
+        return matrix
+
+    def sample_inputs(self):
+        """Build synthetic rows that exercise every category plus an unknown one
+
+        Returns:
+        numpy.ndarray: 2-D object array with columns in self.features order
+        """
+        n_rows = max([len(columns) for columns in self.category_columns] + [1]) + 1
+        X = np.empty((n_rows, len(self.features)), dtype=object)
+        offsets = np.linspace(-2, 2, n_rows)
+        for i in range(len(self.numerical_features)):
+            X[:, i] = self.means[i] + offsets * self.scales[i]
+        for j, columns in enumerate(self.category_columns):
+            known = list(columns)
+            # Last row always carries a value the encoder has never seen
+            X[:, len(self.numerical_features) + j] = [known[i % len(known)] for i in range(n_rows - 1)] + ['__unknown__']
+        return X
+
+    def check_parity(self, column_transformer, X=None):
+        """Check that the encoder reproduces the sklearn preprocessor output
+
+        Parameters:
+        column_transformer (ColumnTransformer): The fitted preprocessor to compare against
+        X: Optional 2-D input with columns in self.features order, synthetic rows by default
+
+        Returns:
+        bool: True if both paths produce the same matrix
+        """
+        if X is None:
+            X = self.sample_inputs()
+
+        input_df = pd.DataFrame(X, columns=self.features)
+        for feature in self.numerical_features:
+            input_df[feature] = input_df[feature].astype(np.float64)
+
+        expected = column_transformer.transform(input_df)
+        if hasattr(expected, 'toarray'):
+            expected = expected.toarray()
+
+        actual = self.encode(X)
+        return expected.shape == actual.shape and np.allclose(expected, actual)
+
+    def save(self, path):
+        """Save the preprocessing statistics to an .npz file
+
+        Raises:
+        ValueError: If a categorical feature has non-string categories
+        """
+        arrays = {
+            'format_version': np.array(FORMAT_VERSION),
+            'numerical_features': np.array(self.numerical_features, dtype=str),
+            'categorical_features': np.array(self.categorical_features, dtype=str),
+            'means': self.means,
+            'scales': self.scales,
+            'checksum': np.array(self.checksum),
+        }
+        for i, feature_categories in enumerate(self.categories):
+            if not all(isinstance(value, str) for value in feature_categories):
+                raise ValueError(f"Categories of '{self.categorical_features[i]}' are not strings")
+            arrays[f'categories_{i}'] = np.array(feature_categories, dtype=str)
+
+        # Write to a temporary file first so readers never see a partial export
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load preprocessing statistics saved by save()
+
+        Returns:
+        FeatureEncoder: The loaded encoder, or None if the file uses an older format
+        """
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['format_version']) != FORMAT_VERSION:
+                return None
+
+            categorical_features = data['categorical_features'].tolist()
+            return cls(
+                data['numerical_features'].tolist(), categorical_features, data['means'], data['scales'],
+                [data[f'categories_{i}'].tolist() for i in range(len(categorical_features))],
+                str(data['checksum'])
+            )
@@ -0,0 +1,71 @@
+# Helpers of BasePredictor.train_incremental, which trains models with partial_fit on a CSV
+# streamed in chunks, so the dataset never has to fit in memory:
+#   pass 1: scaler statistics, category values and target classes accumulated chunk by chunk
+#   passes 2..epochs+1: every model's partial_fit on every chunk, transformed once for all models
+#   last pass: held-out rows scored with running sums instead of collected predictions
+
+import numpy as np
+
+
+def holdout_mask(start, n, holdout):
+    """Rows of a chunk held out for evaluation, one in every round(1 / holdout) of the whole file
+
+    Parameters:
+    start (int): Position of the chunk's first row in the file
+    n (int): Number of rows of the chunk
+    holdout (float): Fraction of the rows to hold out
+
+    Returns:
+    numpy.ndarray: Boolean mask, True for held-out rows
+    """
+    every = max(2, int(round(1 / holdout)))
+    return (start + np.arange(n)) % every == 0
+
+
+class StreamingMetrics:
+    def __init__(self, is_classification=True):
+        """Test-set metrics of BasePredictor.evaluate_model, accumulated chunk by chunk"""
+        self.is_classification = is_classification
+        self.count = 0
+        self.correct = 0
+        self.abs_error = 0.0
+        self.squared_error = 0.0
+        self.target_sum = 0.0
+        self.target_squares = 0.0
+
+    def update(self, y_true, y_pred):
+        y_true = np.asarray(y_true, dtype=np.float64)
+        y_pred = np.asarray(y_pred, dtype=np.float64)
+        self.count += len(y_true)
+
+        if self.is_classification:
+            self.correct += int(np.sum(y_true == y_pred))
+        else:
+            errors = y_true - y_pred
+            self.abs_error += float(np.abs(errors).sum())
+            self.squared_error += float(np.square(errors).sum())
+            self.target_sum += float(y_true.sum())
+            self.target_squares += float(np.square(y_true).sum())
+
+    def result(self):
+        """{'accuracy'} for classification, {'mae', 'mse', 'rmse', 'r2'} for regression"""
+        if not self.count:
+            return {}
+        if self.is_classification:
+            return {'accuracy': self.correct / self.count}
+
+        mse = self.squared_error / self.count
+        total_squares = self.target_squares - self.target_sum ** 2 / self.count
+        return {
+            'mae': self.abs_error / self.count,
+            'mse': mse,
+            'rmse': float(np.sqrt(mse)),
+            'r2': 1 - self.squared_error / total_squares if total_squares > 0 else 0.0
+        }
+
+    def score(self):
+        """Higher is better: accuracy, or negated MSE like the neg_mean_squared_error scoring"""
+        metrics = self.result()
+        if not metrics:
+            return float('-inf')
+        return metrics['accuracy'] if self.is_classification else -metrics['mse']
@@ -0,0 +1,203 @@
+# Versioned model registry for SmartCare
+# Every published model version lives in its own directory with a manifest:
+#   <registry>/<model name>/<version>/manifest.json, the model, preprocessor and tree ensemble files
+#   <registry>/<model name>/active.json, the version being served and the ones served before it
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import numpy as np
+from datetime import datetime, UTC
+
+from predictors.base_predictor import BasePredictor
+
+MODEL_REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models', 'registry')
+
+MANIFEST_FILE = "manifest.json"
+ACTIVE_FILE = "active.json"
+
+# Previously active versions remembered for rollback
+ROLLBACK_DEPTH = 10
+
+VERSION_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]*$')
+
+
+class RegistryError(Exception):
+    """Registry operation that can't be carried out, status_code is the HTTP status to answer with"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def file_checksum(path):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def version_dir(name, version):
+    for value in (name, version):
+        if not VERSION_PATTERN.match(value or ''):
+            raise RegistryError(f"Invalid model name or version: {value!r}")
+    return os.path.join(MODEL_REGISTRY_DIR, name, version)
+
+
+def write_json(path, data):
+    """Write a JSON file atomically, readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(name, version):
+    """Manifest of a published version
+
+    Raises:
+    RegistryError: If the version doesn't exist (404)
+    """
+    path = os.path.join(version_dir(name, version), MANIFEST_FILE)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise RegistryError(f"Model {name} has no version {version}", status_code=404)
+
+
+def list_versions(name):
+    """Manifests of every published version of a model, oldest first"""
+    directory = os.path.join(MODEL_REGISTRY_DIR, name)
+    if not os.path.isdir(directory):
+        return []
+
+    manifests = []
+    for version in os.listdir(directory):
+        if os.path.exists(os.path.join(directory, version, MANIFEST_FILE)):
+            manifests.append(read_manifest(name, version))
+    return sorted(manifests, key=lambda manifest: manifest['created_at'])
+
+
+def read_active(name):
+    """Active pointer of a model: {"version", "history", "activated_at"}, None if nothing was activated"""
+    try:
+        with open(os.path.join(MODEL_REGISTRY_DIR, name, ACTIVE_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_active(name, version, history):
+    """Point a model at a version, `history` lists the versions a rollback goes back to, latest last"""
+    write_json(os.path.join(MODEL_REGISTRY_DIR, name, ACTIVE_FILE), {
+        'version': version,
+        'history': history[-ROLLBACK_DEPTH:],
+        'activated_at': datetime.now(UTC).isoformat()
+    })
+
+
+def publish_model(predictor, version=None):
+    """Copy a predictor's saved model files into a new registry version
+
+    Parameters:
+    predictor (BasePredictor): A loaded predictor whose model files are on disk
+    version (str): Version name, the UTC time and model checksum by default
+
+    Returns:
+    dict: The manifest of the new version
+    """
+    if not os.path.exists(predictor.model_path) or not os.path.exists(predictor.preprocessor_path):
+        raise RegistryError(f"Model {predictor.model_name} has no saved model files to publish")
+
+    checksum = file_checksum(predictor.model_path)
+    version = version or f"{datetime.now(UTC).strftime('%Y%m%d%H%M%S')}-{checksum[:8]}"
+    directory = version_dir(predictor.model_name, version)
+    if os.path.exists(directory):
+        raise RegistryError(f"Model {predictor.model_name} already has a version {version}", status_code=409)
+
+    manifest = {
+        'name': predictor.model_name,
+        'version': version,
+        'created_at': datetime.now(UTC).isoformat(),
+        'checksum': checksum,
+        'dataset': predictor.dataset_name,
+        'is_classification': predictor.is_classification,
+        'features': {
+            'numerical': predictor.numerical_features,
+            'categorical': predictor.categorical_features,
+            'target': predictor.target_feature
+        },
+        'metrics': predictor.metrics,
+        'training': predictor.training_times
+    }
+
+    # Assemble the version beside its final place, then rename it in one step
+    tmp_directory = f"{directory}.tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    for path in (predictor.model_path, predictor.preprocessor_path, predictor.tree_ensemble_path, predictor.encoder_path):
+        if os.path.exists(path):
+            shutil.copy2(path, tmp_directory)
+    write_json(os.path.join(tmp_directory, MANIFEST_FILE), manifest)
+    os.replace(tmp_directory, directory)
+
+    return manifest
+
+
+def warm_up(predictor):
+    """Run synthetic predictions through every inference path so the first real request isn't the slow one
+
+    Raises:
+    RegistryError: If the model can't predict the synthetic rows
+    """
+    if predictor.encoder is not None:
+        rows = [dict(zip(predictor.encoder.features, row)) for row in predictor.encoder.sample_inputs()]
+    else:
+        rows = [{feature: 0.0 for feature in predictor.numerical_features}]
+        rows[0].update({feature: '__unknown__' for feature in predictor.categorical_features})
+
+    results, errors = predictor.predict_batch(rows)
+    single = predictor.predict(rows[0])
+    values = [result[1] if predictor.is_classification else result for result in results]
+    values.append(single[1] if predictor.is_classification else single)
+
+    if errors or any(value is None or not np.isfinite(value) for value in values):
+        raise RegistryError(f"Model {predictor.model_name} failed its warm-up predictions", status_code=422)
+
+
+def load_version(name, version):
+    """Load a registry version into a new predictor, verified against its manifest and warmed up
+
+    Returns:
+    tuple: (predictor, manifest)
+
+    Raises:
+    RegistryError: If the version is missing, its checksum doesn't match or it can't predict
+    """
+    manifest = read_manifest(name, version)
+    features = manifest['features']
+    predictor = BasePredictor(
+        dataset_name=manifest['dataset'],
+        model_name=name,
+        numerical_features=features['numerical'],
+        categorical_features=features['categorical'],
+        target_feature=features['target'],
+        is_classification=manifest['is_classification'],
+        models_dir=version_dir(name, version)
+    )
+
+    if not os.path.exists(predictor.model_path) or file_checksum(predictor.model_path) != manifest['checksum']:
+        raise RegistryError(f"Model {name} version {version} doesn't match its manifest checksum", status_code=422)
+
+    if not predictor.load_model():
+        raise RegistryError(f"Model {name} version {version} could not be loaded", status_code=422)
+    predictor.metrics = manifest['metrics']
+
+    warm_up(predictor)
+    return predictor, manifest
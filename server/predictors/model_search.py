@@ -0,0 +1,252 @@
+# Hyperparameter search strategies for BasePredictor.train_model
+#   grid: every point of the parameter grid
+#   random: n_iter points sampled from the grid (lists or scipy distributions)
+#   halving: successive halving over the grid, every round fits the best 1/factor of the
+#            candidates on factor times more of a resource (training rows or a parameter like
+#            model__n_estimators) and stops early once one candidate clearly wins
+# Every strategy accepts a wall-clock budget, candidates are then fitted in batches of one per
+# worker and the search keeps the best one found when the budget runs out
+
+import math
+import time
+import numpy as np
+
+SEARCH_STRATEGIES = ('grid', 'random', 'halving')
+
+# Training rows are the default halving resource
+N_SAMPLES = 'n_samples'
+
+
+def evaluate_candidates(pipeline, candidates, X, y, scoring, cv, n_jobs):
+    """Cross-validate each candidate, all their fits run in parallel
+
+    Returns:
+    tuple: (mean scores, score standard deviations, fit seconds, score seconds), one entry per candidate
+    """
+    from sklearn.model_selection import GridSearchCV
+
+    # One single-point grid per candidate keeps cv_results_ in candidate order
+    grid = [{name: [value] for name, value in candidate.items()} for candidate in candidates]
+    search = GridSearchCV(pipeline, grid, cv=cv, scoring=scoring, n_jobs=n_jobs, refit=False)
+    search.fit(X, y)
+
+    results = search.cv_results_
+    return (results['mean_test_score'], results['std_test_score'],
+            results['mean_fit_time'] * search.n_splits_, results['mean_score_time'] * search.n_splits_)
+
+
+def clear_winner(means, stds):
+    """Whether the best candidate leads the runner-up by more than their CV spreads combined"""
+    if len(means) < 2:
+        return False
+    order = np.argsort(means)[::-1]
+    best, second = order[0], order[1]
+    return means[best] - means[second] > stds[best] + stds[second]
+
+
+class CandidateSearch:
+    def __init__(self, pipeline, param_grid, scoring, strategy='grid', cv=5, n_jobs=None,
+                 budget=None, n_iter=10, resource=N_SAMPLES, factor=3, is_classification=True, random_state=42):
+        """Configure a search over one model's parameter grid
+
+        Parameters:
+        pipeline (Pipeline): The preprocessing and model pipeline to tune
+        param_grid (dict): Parameter names mapped to lists of values (or distributions for random)
+        scoring (str): sklearn scoring name, higher is better
+        strategy (str): 'grid', 'random' or 'halving'
+        cv (int): Number of cross-validation folds
+        n_jobs (int): Number of parallel fits
+        budget (float): Wall-clock seconds the search may take, unlimited if None
+        n_iter (int): Candidates sampled by the random strategy
+        resource (str): What halving rounds grow, 'n_samples' or a pipeline parameter name
+        factor (int): Halving keeps 1/factor of the candidates and grows the resource factor times per round
+        is_classification (bool): Subsample training rows stratified by class
+        random_state (int): Seed of the random sampling and subsampling
+        """
+        if strategy not in SEARCH_STRATEGIES:
+            raise ValueError(f"Unknown search strategy: {strategy}, expected one of {', '.join(SEARCH_STRATEGIES)}")
+
+        self.pipeline = pipeline
+        self.param_grid = param_grid
+        self.scoring = scoring
+        self.strategy = strategy
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.budget = budget
+        self.n_iter = n_iter
+        self.factor = factor
+        self.is_classification = is_classification
+        self.random_state = random_state
+
+        # A parameter the model doesn't have can't be a resource, fall back to training rows
+        self.resource = resource if resource == N_SAMPLES or resource in pipeline.get_params() else N_SAMPLES
+
+        self.best_estimator_ = None
+        self.best_params_ = None
+        self.best_score_ = None
+        self.times = {}
+
+        # Progress of the current fit
+        self.deadline = None
+        self.batch_size = None
+        self.fits = 0
+        self.fit_seconds = 0.0
+        self.score_seconds = 0.0
+        self.stopped = None
+        self.rescored = False
+
+    def candidates(self):
+        from sklearn.model_selection import ParameterGrid, ParameterSampler
+
+        if self.strategy == 'random':
+            return list(ParameterSampler(self.param_grid, self.n_iter, random_state=self.random_state))
+        return list(ParameterGrid(self.param_grid))
+
+    def fit(self, X, y):
+        """Search the candidates and refit the best one on all the training data
+
+        Returns:
+        CandidateSearch: self, with best_estimator_, best_params_, best_score_ and times set
+        """
+        from joblib import effective_n_jobs
+        from sklearn.base import clone
+
+        started = time.perf_counter()
+        self.deadline = started + self.budget if self.budget else None
+        self.fits = 0
+        self.fit_seconds = 0.0
+        self.score_seconds = 0.0
+        self.stopped = None
+        self.rescored = False
+
+        # Without a budget every candidate of a round is fitted at once
+        self.batch_size = effective_n_jobs(self.n_jobs) if self.deadline else None
+
+        if self.strategy == 'halving':
+            best_params, best_score, rounds = self.halving(X, y)
+        else:
+            candidates = self.candidates()
+            means, _ = self.evaluate(candidates, X, y)
+            best = int(np.argmax(means))
+            best_params, best_score, rounds = candidates[best], float(means[best]), 1
+
+        # Refit the winner with the full resource
+        refit_started = time.perf_counter()
+        self.best_estimator_ = clone(self.pipeline).set_params(**best_params).fit(X, y)
+        self.best_params_ = best_params
+        self.best_score_ = best_score
+
+        self.times = {
+            'strategy': self.strategy,
+            'resource': self.resource if self.strategy == 'halving' else None,
+            'rounds': rounds,
+            'fits': self.fits,
+            'fit_seconds': float(self.fit_seconds),
+            'score_seconds': float(self.score_seconds),
+            'refit_seconds': time.perf_counter() - refit_started,
+            'stopped': self.stopped,
+            'rescored': self.rescored
+        }
+        return self
+
+    def evaluate(self, candidates, X, y):
+        """Cross-validate candidates in order, in batches while there is budget left
+
+        Returns:
+        tuple: (mean scores, score standard deviations) of the candidates evaluated before the budget ran out
+        """
+        batch_size = self.batch_size or len(candidates)
+        means, stds = [], []
+
+        for start in range(0, len(candidates), batch_size):
+            if start and self.deadline and time.perf_counter() > self.deadline:
+                self.stopped = 'budget'
+                break
+
+            batch = candidates[start:start + batch_size]
+            batch_means, batch_stds, fit_seconds, score_seconds = evaluate_candidates(
+                self.pipeline, batch, X, y, self.scoring, self.cv, self.n_jobs)
+            # Failed fits score NaN, rank them last
+            means.extend(np.nan_to_num(batch_means, nan=-np.inf))
+            stds.extend(batch_stds)
+            self.fits += len(batch) * self.cv
+            self.fit_seconds += fit_seconds.sum()
+            self.score_seconds += score_seconds.sum()
+
+        return np.array(means), np.array(stds)
+
+    def halving(self, X, y):
+        """Successive halving, the candidates of every round are evaluated best first
+
+        Returns:
+        tuple: (best params, best score on the full resource, rounds run)
+        """
+        candidates = self.candidates()
+
+        if self.resource == N_SAMPLES:
+            max_resources = len(X)
+            n_classes = len(np.unique(y)) if self.is_classification else 1
+            min_resources = min(max_resources, 2 * self.cv * n_classes)
+        else:
+            # A resource listed in the grid is driven by the rounds, its largest value is the last round's
+            values = {candidate.pop(self.resource) for candidate in candidates if self.resource in candidate}
+            max_resources = max(values) if values else self.pipeline.get_params()[self.resource]
+            min_resources = 1
+            candidates = [dict(candidate) for candidate in dict.fromkeys(tuple(sorted(candidate.items())) for candidate in candidates)]
+
+        # As many rounds as needed to get down to one candidate, if the resource allows that many
+        rounds_for_candidates = 1 + int(math.floor(math.log(len(candidates), self.factor))) if len(candidates) > 1 else 1
+        rounds_for_resource = 1 + int(math.floor(math.log(max(max_resources // min_resources, 1), self.factor)))
+        n_rounds = min(rounds_for_candidates, rounds_for_resource)
+
+        best_params, best_score = candidates[0], float('-inf')
+        rounds = 0
+        for i in range(n_rounds):
+            if i and self.deadline and time.perf_counter() > self.deadline:
+                self.stopped = 'budget'
+                break
+
+            resources = max(max_resources // self.factor ** (n_rounds - 1 - i), min_resources)
+            X_round, y_round, candidates_round = self.with_resource(X, y, candidates, resources)
+
+            means, stds = self.evaluate(candidates_round, X_round, y_round)
+            rounds += 1
+
+            # Candidates of this round come ranked from the last one, unevaluated ones were behind
+            order = np.argsort(means)[::-1]
+            candidates = [candidates[j] for j in order] + candidates[len(means):]
+            best_params, best_score = candidates_round[order[0]], float(means[order[0]])
+
+            if self.stopped == 'budget':
+                break
+            if clear_winner(means, stds):
+                self.stopped = 'clear winner'
+                break
+
+            # A lone survivor is the winner, no need to fit it on more
+            candidates = candidates[:max(1, math.ceil(len(candidates) / self.factor))]
+            if len(candidates) == 1:
+                break
+
+        # The refit always uses the full resource
+        if self.resource != N_SAMPLES:
+            best_params = {**best_params, self.resource: max_resources}
+
+        # A round stopped short of the full resource scored the winner on less than it's refitted
+        # with, score it again on all of it so it compares fairly with other models' searches
+        if resources < max_resources:
+            means, _ = self.evaluate([best_params], X, y)
+            best_score = float(means[0])
+            self.rescored = True
+        return best_params, best_score, rounds
+
+    def with_resource(self, X, y, candidates, resources):
+        """Training data and candidates of a halving round given `resources` of the resource"""
+        if self.resource == N_SAMPLES:
+            if resources >= len(X):
+                return X, y, candidates
+            from sklearn.utils import resample
+            X_round, y_round = resample(X, y, n_samples=resources, replace=False, random_state=self.random_state,
+                                        stratify=y if self.is_classification else None)
+            return X_round, y_round, candidates
+        return X, y, [{**candidate, self.resource: resources} for candidate in candidates]
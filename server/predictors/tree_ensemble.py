@@ -0,0 +1,243 @@
+# Array-backed tree-ensemble inference engine for SmartCare predictors
+# Flattens fitted sklearn RandomForest / GradientBoosting ensembles into contiguous NumPy
+# node arrays and evaluates every tree for a whole batch at once, without sklearn's per-call validation
+
+import os
+import numpy as np
+
+# Bump when the exported layout changes so stale files get re-exported
+FORMAT_VERSION = 1
+
+# Rows walked through the trees at a time
+PREDICT_CHUNK_SIZE = 8192
+
+
+def boosting_baseline(estimator, n_outputs):
+    """Raw output of a fitted gradient boosting ensemble before its first stage, worked out from
+    its init_ estimator the way sklearn does it
+
+    Returns:
+    numpy.ndarray: The baseline, shape (n_outputs,)
+
+    Raises:
+    ValueError: If the init estimator's output depends on the input
+    """
+    init = estimator.init_
+    if isinstance(init, str) and init == 'zero':
+        return np.zeros(n_outputs)
+    if type(init).__name__ not in ('DummyClassifier', 'DummyRegressor'):
+        raise ValueError(f"Unsupported init estimator for tree export: {type(init).__name__}")
+
+    # Dummy estimators ignore the features, any row gives the baseline
+    X = np.zeros((1, estimator.n_features_in_))
+    if type(init).__name__ == 'DummyRegressor':
+        return np.asarray(init.predict(X), dtype=np.float64).reshape(n_outputs)
+
+    eps = np.finfo(np.float32).eps
+    proba = np.clip(init.predict_proba(X)[0], eps, 1 - eps).astype(np.float64)
+    if n_outputs == 1:
+        logit = np.log(proba[1] / (1 - proba[1]))
+        # The exponential loss links through half the logit
+        return np.array([logit / 2 if estimator.loss == 'exponential' else logit])
+    return np.log(proba) - np.log(proba).mean()
+
+
+class TreeEnsemble:
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth,
+                 baseline, scale, output, classes=None, checksum=""):
+        """Initialize the engine from flattened node arrays
+
+        Parameters:
+        feature (numpy.ndarray): Split feature of every node (0 for leaves)
+        threshold (numpy.ndarray): Split threshold of every node, go left if x <= threshold
+        left (numpy.ndarray): Absolute index of the left child (leaves point to themselves)
+        right (numpy.ndarray): Absolute index of the right child (leaves point to themselves)
+        value (numpy.ndarray): Leaf outputs, shape (n_nodes, n_outputs)
+        roots (numpy.ndarray): Index of the root node of every tree
+        max_depth (int): Depth of the deepest tree
+        baseline (numpy.ndarray): Raw output before any tree is added, shape (n_outputs,)
+        scale (float): Factor applied to the summed leaf values (learning rate or 1 / n_trees)
+        output (str): 'identity', 'sigmoid', 'softmax' or 'proba'
+        classes (numpy.ndarray): Class labels for classifiers, None for regressors
+        checksum (str): Checksum of the model file the ensemble was exported from
+        """
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.baseline = baseline
+        self.scale = float(scale)
+        self.output = output
+        self.classes_ = classes
+        self.checksum = checksum
+
+    @classmethod
+    def from_estimator(cls, estimator, checksum=""):
+        """Export a fitted sklearn ensemble
+
+        Parameters:
+        estimator: Fitted RandomForest or GradientBoosting regressor/classifier
+        checksum (str): Checksum of the model file, stored with the export
+
+        Returns:
+        TreeEnsemble: The exported engine
+
+        Raises:
+        ValueError: If the estimator is not a supported tree ensemble
+        """
+        name = type(estimator).__name__
+        classes = getattr(estimator, 'classes_', None)
+
+        if name in ('GradientBoostingRegressor', 'GradientBoostingClassifier'):
+            # estimators_ has one row per stage and one column per raw output
+            stages = estimator.estimators_
+            trees = [(tree, k) for stage in stages for k, tree in enumerate(stage)]
+            n_outputs = stages.shape[1]
+            baseline = boosting_baseline(estimator, n_outputs)
+            scale = estimator.learning_rate
+            if name == 'GradientBoostingRegressor':
+                output = 'identity'
+            else:
+                output = 'sigmoid' if n_outputs == 1 else 'softmax'
+        elif name in ('RandomForestRegressor', 'RandomForestClassifier'):
+            if getattr(estimator, 'n_outputs_', 1) != 1:
+                raise ValueError("Multi-output forests are not supported")
+            trees = [(tree, None) for tree in estimator.estimators_]
+            n_outputs = 1 if classes is None else len(classes)
+            baseline = np.zeros(n_outputs)
+            scale = 1.0 / len(trees)
+            output = 'identity' if classes is None else 'proba'
+        else:
+            raise ValueError(f"Unsupported estimator for tree export: {name}")
+
+        n_nodes = sum(tree.tree_.node_count for tree, _ in trees)
+        feature = np.zeros(n_nodes, dtype=np.int32)
+        threshold = np.zeros(n_nodes, dtype=np.float64)
+        left = np.zeros(n_nodes, dtype=np.int32)
+        right = np.zeros(n_nodes, dtype=np.int32)
+        value = np.zeros((n_nodes, n_outputs), dtype=np.float64)
+        roots = np.zeros(len(trees), dtype=np.int32)
+        max_depth = 0
+
+        offset = 0
+        for i, (tree, k) in enumerate(trees):
+            t = tree.tree_
+            count = t.node_count
+            nodes = np.arange(offset, offset + count, dtype=np.int32)
+            is_leaf = t.children_left < 0
+
+            feature[nodes] = np.where(is_leaf, 0, t.feature)
+            threshold[nodes] = np.where(is_leaf, np.inf, t.threshold)
+            left[nodes] = np.where(is_leaf, nodes, t.children_left + offset)
+            right[nodes] = np.where(is_leaf, nodes, t.children_right + offset)
+
+            if k is not None:
+                # Gradient boosting: one raw output per tree
+                value[nodes, k] = t.value[:, 0, 0]
+            elif output == 'proba':
+                # Forest classifier: class distribution of the leaf
+                leaf_values = t.value[:, 0, :]
+                totals = leaf_values.sum(axis=1, keepdims=True)
+                value[nodes] = leaf_values / np.where(totals == 0, 1, totals)
+            else:
+                value[nodes, 0] = t.value[:, 0, 0]
+
+            roots[i] = offset
+            max_depth = max(max_depth, t.max_depth)
+            offset += count
+
+        return cls(feature, threshold, left, right, value, roots, max_depth,
+                   np.asarray(baseline, dtype=np.float64), scale, output, classes, checksum)
+
+    def raw_predict(self, X):
+        """Walk every tree for the whole batch and return the scaled sum of leaf values
+
+        Parameters:
+        X (numpy.ndarray): Encoded model input, shape (n_rows, n_features)
+
+        Returns:
+        numpy.ndarray: Raw outputs, shape (n_rows, n_outputs)
+        """
+        # sklearn trees compare float32 inputs against their thresholds
+        X = np.asarray(X, dtype=np.float32)
+        raw = np.empty((X.shape[0], self.value.shape[1]))
+
+        # The node matrix holds one entry per (tree, row), walk the rows in chunks to bound it
+        for start in range(0, X.shape[0], PREDICT_CHUNK_SIZE):
+            chunk = X[start:start + PREDICT_CHUNK_SIZE]
+            rows = np.arange(chunk.shape[0])
+
+            # One current node per (tree, row), all trees advance one level per step
+            node = np.repeat(self.roots[:, None], chunk.shape[0], axis=1)
+            for _ in range(self.max_depth):
+                go_left = chunk[rows, self.feature[node]] <= self.threshold[node]
+                node = np.where(go_left, self.left[node], self.right[node])
+
+            raw[start:start + chunk.shape[0]] = self.baseline + self.scale * self.value[node].sum(axis=0)
+        return raw
+
+    def predict_proba(self, X):
+        """Class probabilities, shape (n_rows, n_classes)"""
+        raw = self.raw_predict(X)
+
+        if self.output == 'sigmoid':
+            positive = 1.0 / (1.0 + np.exp(-raw[:, 0]))
+            return np.column_stack([1.0 - positive, positive])
+        if self.output == 'softmax':
+            exp = np.exp(raw - raw.max(axis=1, keepdims=True))
+            return exp / exp.sum(axis=1, keepdims=True)
+        if self.output == 'proba':
+            return raw
+
+        raise AttributeError("Regression ensembles have no predict_proba")
+
+    def predict(self, X):
+        """Predicted values for regressors, predicted labels for classifiers"""
+        if self.output == 'identity':
+            return self.raw_predict(X)[:, 0]
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def save(self, path):
+        """Save the node arrays to an .npz file"""
+        arrays = {
+            'format_version': np.array(FORMAT_VERSION),
+            'feature': self.feature,
+            'threshold': self.threshold,
+            'left': self.left,
+            'right': self.right,
+            'value': self.value,
+            'roots': self.roots,
+            'max_depth': np.array(self.max_depth),
+            'baseline': self.baseline,
+            'scale': np.array(self.scale),
+            'output': np.array(self.output),
+            'checksum': np.array(self.checksum),
+        }
+        if self.classes_ is not None:
+            arrays['classes'] = np.asarray(self.classes_)
+
+        # Write to a temporary file first so readers never see a partial export
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load node arrays saved by save()
+
+        Returns:
+        TreeEnsemble: The loaded engine, or None if the file uses an older format
+        """
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['format_version']) != FORMAT_VERSION:
+                return None
+
+            return cls(
+                data['feature'], data['threshold'], data['left'], data['right'],
+                data['value'], data['roots'], int(data['max_depth']), data['baseline'],
+                float(data['scale']), str(data['output']),
+                data['classes'] if 'classes' in data else None, str(data['checksum'])
+            )
@@ -2,18 +2,12 @@
 # This model predicts the healing time of wounds based on various features
 
 import joblib
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
-from sklearn.linear_model import LinearRegression
 
 from predictors.base_predictor import BasePredictor
 
-def get_wound_healing_predictor():
-    """Train the model and save it to disk using the BasePredictor
-    with custom preprocessing for the wound healing time data
-    """
-    
-    # Initialize the base predictor
-    predictor = BasePredictor(
+def create_wound_healing_predictor():
+    """Create the BasePredictor of the wound healing time data, without a model"""
+    return BasePredictor(
         dataset_name="Synthetic_Wound_Healing_Time_Data.csv",
         model_name="wound_healing",
         numerical_features=['Patient Age', 'Size'],
@@ -21,61 +15,109 @@ def get_wound_healing_predictor():
         target_feature='Output',
         is_classification=False
     )
+
+def get_wound_healing_predictor():
+    """Load the saved model, serving never trains: build it offline with `flask --app app build-models`"""
+    predictor = create_wound_healing_predictor()
+    
+    if not predictor.load_model():
+        print(f"No wound healing model at {predictor.model_path}, build it with: flask --app app build-models")
+    
+    return predictor
+
+def build_wound_healing_predictor(n_jobs=None, search=None, budget=None, incremental=False, chunksize=None, epochs=None, max_rows=None):
+    """Train the model with n_jobs parallel fits, the `search` strategy and a `budget` in seconds
+    per candidate model, and save it to disk using the BasePredictor
+    with custom preprocessing for the wound healing time data
+    
+    With `incremental`, models supporting partial_fit learn from the whole dataset streamed in
+    chunks of `chunksize` rows for `epochs` passes instead, it never has to fit in memory.
+    Otherwise the first `max_rows` rows are loaded, the whole dataset by default
+    """
+    from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+    from sklearn.linear_model import LinearRegression, SGDRegressor
+    from sklearn.neural_network import MLPRegressor
+    
+    # Initialize the base predictor
+    predictor = create_wound_healing_predictor()
     
-    # Define the models and parameter grids (same as the original class)
+    if incremental:
+        models = {
+            'SGDRegressor': SGDRegressor(random_state=42),
+            'SGDHuber': SGDRegressor(loss='huber', epsilon=5.0, random_state=42),
+            'MLPRegressor': MLPRegressor(hidden_layer_sizes=(64, 32), random_state=42)
+        }
+        if predictor.train_incremental(models, chunksize=chunksize, epochs=epochs) is None:
+            print("Failed to load data.")
+            return
+        return save_wound_healing_predictor(predictor)
+    
+    # Define the models and parameter grids
     models = {
         'RandomForest': RandomForestRegressor(random_state=42),
         'GradientBoosting': GradientBoostingRegressor(random_state=42),
         'LinearRegression': LinearRegression()
     }
     
+    # Successive halving grows n_estimators up to the largest listed value, so the grids
+    # can be wider than an exhaustive search would allow
     param_grids = {
         'RandomForest': {
-            'model__n_estimators': [50, 100],
-            'model__max_depth': [None, 10, 20]
+            'model__n_estimators': [50, 100, 200],
+            'model__max_depth': [None, 5, 10, 20],
+            'model__min_samples_leaf': [1, 2, 4],
+            'model__max_features': [1.0, 0.5]
         },
         'GradientBoosting': {
-            'model__n_estimators': [50, 100],
-            'model__learning_rate': [0.01, 0.1]
+            'model__n_estimators': [50, 100, 200],
+            'model__learning_rate': [0.01, 0.05, 0.1, 0.2],
+            'model__max_depth': [2, 3, 5],
+            'model__subsample': [0.8, 1.0]
         },
         # LinearRegression has no hyperparameters to tune
         'LinearRegression': {}
     }
     
-    # If we couldn't load the model, train a new one
-    if not predictor.load_model():
-        # Load data
-        data = predictor.load_data(predictor.dataset_path, 5000)
-        if data is None:
-            print("Failed to load data.")
-            return
-        
-        # Apply custom preprocessing here if needed
-        print("Applying preprocessing to wound healing data...")
-        # Example of potential custom preprocessing:
-        # data['Custom_Feature'] = data['Feature1'] * data['Feature2']
-        
-        # Standard preprocessing
-        X_train, X_test, y_train, y_test = predictor.preprocess_data(data)
-        
-        # Train model
-        predictor.train_model(X_train, y_train, models, param_grids, scoring_metric='neg_mean_squared_error')
+    # Load data
+    data = predictor.load_data(predictor.dataset_path, max_rows)
+    if data is None:
+        print("Failed to load data.")
+        return
+    
+    # Apply custom preprocessing here if needed
+    print("Applying preprocessing to wound healing data...")
+    # Example of potential custom preprocessing:
+    # data['Custom_Feature'] = data['Feature1'] * data['Feature2']
+    
+    # Standard preprocessing
+    X_train, X_test, y_train, y_test = predictor.preprocess_data(data)
+    
+    # Train model
+    predictor.train_model(X_train, y_train, models, param_grids, scoring_metric='neg_mean_squared_error',
+                          n_jobs=n_jobs, search=search, budget=budget, resource='model__n_estimators')
+    
+    # Evaluate model
+    predictor.evaluate_model(X_test, y_test)
+    
+    return save_wound_healing_predictor(predictor)
+
+def save_wound_healing_predictor(predictor):
+    """Save the trained model to disk and run an example prediction"""
+    # Save model
+    try:
+        joblib.dump(predictor.model, predictor.model_path)
+        joblib.dump(predictor.preprocessor, predictor.preprocessor_path)
         
-        # Evaluate model
-        predictor.evaluate_model(X_test, y_test)
+        print(f"Model saved to {predictor.model_path}")
+        print(f"Preprocessor saved to {predictor.preprocessor_path}")
         
-        # Save model
-        try:
-            joblib.dump(predictor.model, predictor.model_path)
-            joblib.dump(predictor.preprocessor, predictor.preprocessor_path)
-            
-            print(f"Model saved to {predictor.model_path}")
-            print(f"Preprocessor saved to {predictor.preprocessor_path}")
-            print("\nModel loaded successfully.")
-        except Exception as e:
-            print(f"Error saving model: {e}")
-            print("Failed to save the model.")
-            return
+        # Export the array-backed tree ensemble beside the pickle
+        predictor.load_tree_ensemble()
+        print("\nModel loaded successfully.")
+    except Exception as e:
+        print(f"Error saving model: {e}")
+        print("Failed to save the model.")
+        return
     
     # Example prediction
     example = {
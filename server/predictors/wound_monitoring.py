@@ -2,18 +2,12 @@
 # This model predicts whether a wound is infected based on various measurements
 
 import joblib
-from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
-from sklearn.linear_model import LogisticRegression
 
 from predictors.base_predictor import BasePredictor
 
-def get_wound_monitoring_predictor():
-    """Train the model and save it to disk using the BasePredictor
-    with custom preprocessing for the wound monitoring data
-    """
-    
-    # Initialize the base predictor
-    predictor = BasePredictor(
+def create_wound_monitoring_predictor():
+    """Create the BasePredictor of the wound monitoring data, without a model"""
+    return BasePredictor(
         dataset_name="Synthetic_Wound_Healing_Data.csv",
         model_name="wound_monitoring",
         numerical_features=['Wound Temperature', 'Wound pH', 'Moisture Level', 'Drug Release'],
@@ -21,61 +15,117 @@ def get_wound_monitoring_predictor():
         target_feature='Infection_Encoded',
         is_classification=True
     )
+
+def get_wound_monitoring_predictor():
+    """Load the saved model, serving never trains: build it offline with `flask --app app build-models`"""
+    predictor = create_wound_monitoring_predictor()
+    
+    if not predictor.load_model():
+        print(f"No wound monitoring model at {predictor.model_path}, build it with: flask --app app build-models")
+    
+    return predictor
+
+def encode_infection(data):
+    """Custom preprocessing step for infection encoding"""
+    data['Infection_Encoded'] = data['Infection'].map({'No': 0, 'Yes': 1})
+    return data
+
+def build_wound_monitoring_predictor(n_jobs=None, search=None, budget=None, incremental=False, chunksize=None, epochs=None, max_rows=None):
+    """Train the model with n_jobs parallel fits, the `search` strategy and a `budget` in seconds
+    per candidate model, and save it to disk using the BasePredictor
+    with custom preprocessing for the wound monitoring data
+    
+    With `incremental`, models supporting partial_fit learn from the whole dataset streamed in
+    chunks of `chunksize` rows for `epochs` passes instead, it never has to fit in memory.
+    Otherwise the first `max_rows` rows are loaded, the whole dataset by default
+    """
+    from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
+    from sklearn.linear_model import LogisticRegression, SGDClassifier
+    from sklearn.neural_network import MLPClassifier
+    
+    # Initialize the base predictor
+    predictor = create_wound_monitoring_predictor()
     
-    # Define the models and parameter grids (same as the original class)
+    if incremental:
+        # Only learners with predict_proba, the infection probability is served with the prediction
+        models = {
+            'SGDLogistic': SGDClassifier(loss='log_loss', random_state=42),
+            'SGDModifiedHuber': SGDClassifier(loss='modified_huber', random_state=42),
+            'MLPClassifier': MLPClassifier(hidden_layer_sizes=(32, 16), random_state=42)
+        }
+        columns = predictor.prediction_features + ['Infection']
+        if predictor.train_incremental(models, chunksize=chunksize, epochs=epochs, columns=columns,
+                                       prepare=encode_infection) is None:
+            print("Failed to load data.")
+            return
+        return save_wound_monitoring_predictor(predictor)
+    
+    # Define the models and parameter grids
     models = {
         'RandomForest': RandomForestClassifier(random_state=42),
         'GradientBoosting': GradientBoostingClassifier(random_state=42),
         'LogisticRegression': LogisticRegression(random_state=42, max_iter=1000)
     }
     
+    # Successive halving grows n_estimators up to the largest listed value, so the grids
+    # can be wider than an exhaustive search would allow
     param_grids = {
         'RandomForest': {
-            'model__n_estimators': [50, 100],
-            'model__max_depth': [None, 10, 20]
+            'model__n_estimators': [50, 100, 200],
+            'model__max_depth': [None, 5, 10, 20],
+            'model__min_samples_leaf': [1, 2, 4],
+            'model__max_features': ['sqrt', None]
         },
         'GradientBoosting': {
-            'model__n_estimators': [50, 100],
-            'model__learning_rate': [0.01, 0.1]
+            'model__n_estimators': [50, 100, 200],
+            'model__learning_rate': [0.01, 0.05, 0.1, 0.2],
+            'model__max_depth': [2, 3, 5],
+            'model__subsample': [0.8, 1.0]
         },
         'LogisticRegression': {
-            'model__C': [0.1, 1.0, 10.0]
+            'model__C': [0.01, 0.1, 1.0, 10.0, 100.0]
         }
     }
     
-    # If we couldn't load the model, train a new one
-    if not predictor.load_model():
-        # Load data
-        data = predictor.load_data(predictor.dataset_path)
-        if data is None:
-            print("Failed to load data.")
-            return
-        
-        # Custom preprocessing step for infection encoding
-        print("Applying custom preprocessing: encoding Infection feature...")
-        data['Infection_Encoded'] = data['Infection'].map({'No': 0, 'Yes': 1})
-        
-        # Standard preprocessing
-        X_train, X_test, y_train, y_test = predictor.preprocess_data(data)
-        
-        # Train model
-        predictor.train_model(X_train, y_train, models, param_grids, scoring_metric='accuracy')
+    # Load data
+    data = predictor.load_data(predictor.dataset_path, max_rows)
+    if data is None:
+        print("Failed to load data.")
+        return
+    
+    # Custom preprocessing step for infection encoding
+    print("Applying custom preprocessing: encoding Infection feature...")
+    data = encode_infection(data)
+    
+    # Standard preprocessing
+    X_train, X_test, y_train, y_test = predictor.preprocess_data(data)
+    
+    # Train model
+    predictor.train_model(X_train, y_train, models, param_grids, scoring_metric='accuracy',
+                          n_jobs=n_jobs, search=search, budget=budget, resource='model__n_estimators')
+    
+    # Evaluate model
+    predictor.evaluate_model(X_test, y_test)
+    
+    return save_wound_monitoring_predictor(predictor)
+
+def save_wound_monitoring_predictor(predictor):
+    """Save the trained model to disk and run an example prediction"""
+    # Save model
+    try:
+        joblib.dump(predictor.model, predictor.model_path)
+        joblib.dump(predictor.preprocessor, predictor.preprocessor_path)
         
-        # Evaluate model
-        predictor.evaluate_model(X_test, y_test)
+        print(f"Model saved to {predictor.model_path}")
+        print(f"Preprocessor saved to {predictor.preprocessor_path}")
         
-        # Save model
-        try:
-            joblib.dump(predictor.model, predictor.model_path)
-            joblib.dump(predictor.preprocessor, predictor.preprocessor_path)
-            
-            print(f"Model saved to {predictor.model_path}")
-            print(f"Preprocessor saved to {predictor.preprocessor_path}")
-            print("\nModel loaded successfully.")
-        except Exception as e:
-            print(f"Error saving model: {e}")
-            print("Failed to save the model.")
-            return
+        # Export the array-backed tree ensemble beside the pickle
+        predictor.load_tree_ensemble()
+        print("\nModel loaded successfully.")
+    except Exception as e:
+        print(f"Error saving model: {e}")
+        print("Failed to save the model.")
+        return
     
     # Example prediction
     example = {
@@ -92,4 +142,4 @@ def get_wound_monitoring_predictor():
         print(f"Infection prediction: {'Yes' if prediction == 1 else 'No'}")
         print(f"Infection probability: {probability:.2f}")
     
-    return predictor
\ No newline at end of file
+    return predictor
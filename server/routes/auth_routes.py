@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify, current_app as app
 from flask_jwt_extended import create_access_token
 from werkzeug.security import generate_password_hash, check_password_hash
-from pymongo.errors import PyMongoError
+from pymongo.errors import PyMongoError, DuplicateKeyError
 from datetime import datetime, UTC
 from utils.validation import validate_signup, validate_login, ValidationError
 
@@ -15,10 +15,6 @@ def signup():
         if not data or not all(key in data for key in ("username", "email", "password")):
             return jsonify({"error": "Invalid input"}), 400
 
-        # check if user email already exists
-        if app.db.users.find_one({"email": data["email"]}):
-            return jsonify({"error": "Email already exists"}), 400
-
         # validate input data
         validate_signup(data)
 
@@ -34,7 +30,11 @@ def signup():
             "updated_at": str(datetime.now(UTC)),
         }
 
-        user = app.db.users.insert_one(doc)
+        # the unique email index rejects existing emails
+        try:
+            user = app.db.users.insert_one(doc)
+        except DuplicateKeyError:
+            return jsonify({"error": "Email already exists"}), 400
 
         # create JWT token
         token = create_access_token(identity=str(user.inserted_id))
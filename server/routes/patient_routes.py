@@ -3,19 +3,95 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime, UTC
 from bson import ObjectId
 from marshmallow import ValidationError
+from werkzeug.exceptions import RequestEntityTooLarge
 from utils.validation import NewPatientSchema
-from utils.init_models import predict_healing, predict_infection
 from utils.handlers import stream_avatar
-from utils.utils import analyze_patient, format_data, calculate_healing_time, allowed_file
+from utils.analysis_jobs import request_analysis, get_analysis_queue
+from utils.name_index import tokenize_name, name_token_query, get_name_index, index_patient_name, unindex_patient_name, drop_name_index
+from utils.recordings import parse_recording, parse_ndjson_readings, MultipartFileReader, parse_binary_readings, save_recording, RecordingError, MAX_RECORDING_BYTES, MAX_UPLOAD_OVERHEAD, MAX_INGEST_BYTES
+from utils.live import ingest_readings, get_live_bus, LiveBufferFull
+from utils.init_models import models_ready
+from utils.history import parse_history_range, history_buckets, history_lttb, SERIES_FIELDS, DEFAULT_HISTORY_POINTS, MAX_HISTORY_POINTS
+from utils.monitor import get_monitor_hub, start_replay, parse_speed, sse_event, MONITOR_HEARTBEAT_INTERVAL
+from utils.utils import analyze_patient, calculate_healing_time, allowed_file, build_healing_prediction, get_total_healing_time
 import os
 import json
 import uuid
-import csv
-import time
+import base64
 
 ALLOWED_IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif'}
 ALLOWED_SOURCE_EXTENSIONS = {'.csv'}
 
+# EventSource can't send headers, SSE routes also take the token as ?jwt=<token>
+SSE_TOKEN_LOCATIONS = ['headers', 'query_string']
+
+# Seconds between SSE heartbeats while waiting for an analysis
+ANALYSIS_HEARTBEAT_INTERVAL = 15
+
+# Seconds a device waits before posting again when ingest is refused
+INGEST_RETRY_AFTER = 1
+
+# Patient list pages
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Fields returned by list views, the patient page fetches the full document
+SUMMARY_FIELDS = {
+    "name": 1,
+    "avatar": 1,
+    "gender": 1,
+    "age": 1,
+    "bed": 1,
+    "department": 1,
+    "wound.type": 1,
+    "wound.severity": 1,
+    "created_at": 1,
+}
+
+
+# Opaque next-page token holding the (created_at, _id) of the last patient of a page
+def encode_cursor(patient):
+    position = json.dumps({"c": patient["created_at"].isoformat(), "i": str(patient["_id"])})
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(token):
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.fromisoformat(position["c"]), ObjectId(position["i"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+# One keyset page of patients, newest first
+def list_patients(query):
+    limit = min(max(int(request.args.get("limit", DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+
+    cursor = request.args.get("cursor")
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        query = {**query, "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": last_id}},
+        ]}
+
+    # Fetch one extra patient to know whether there is a next page
+    patients = list(
+        app.db.patients.find(query, SUMMARY_FIELDS)
+        .sort([("created_at", -1), ("_id", -1)])
+        .limit(limit + 1)
+    )
+
+    next_cursor = encode_cursor(patients[limit - 1]) if len(patients) > limit else None
+    patients = patients[:limit]
+
+    # Convert ObjectId and dates to strings for JSON serialization
+    for patient in patients:
+        patient["_id"] = str(patient["_id"])
+        patient["created_at"] = str(patient["created_at"])
+
+    return {"patients": patients, "next": next_cursor}
+
 
 patient_bp = Blueprint("patient", __name__)
 
@@ -59,8 +135,20 @@ def add_patient():
         loaded_data["created_at"] = datetime.now(UTC)
         loaded_data["updated_at"] = datetime.now(UTC)
 
+        # Store the total healing time prediction, reads only need to subtract elapsed days
+        try:
+            healing_prediction = build_healing_prediction(loaded_data)
+            if healing_prediction:
+                loaded_data["healing_prediction"] = healing_prediction
+        except Exception as e:
+            app.logger.error(f"Error predicting healing time: {str(e)}")
+
+        # Normalized name tokens for indexed search
+        loaded_data["name_tokens"] = tokenize_name(loaded_data["name"])
+
         # Insert the new patient into the database
         result = app.db.patients.insert_one(loaded_data)
+        index_patient_name(loaded_data["supervisor"], result.inserted_id, loaded_data["name"])
         
         # Return the newly created patient 
         data["_id"] = str(result.inserted_id)
@@ -81,16 +169,9 @@ def add_patient():
 def get_all_patients():
     try:
         current_user = get_jwt_identity()
-        patients = app.db.patients.find({"supervisor": current_user})
-        patients = list(patients)
-
-        # Convert ObjectId to string for JSON serialization
-        for patient in patients:
-            patient["_id"] = str(patient["_id"])
-            patient["created_at"] = str(patient["created_at"])
-            patient["updated_at"] = str(patient["updated_at"])
-
-        return jsonify({"patients": patients}), 200
+        return jsonify(list_patients({"supervisor": current_user})), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -113,21 +194,26 @@ def get_patient(patient_id):
         if not patient:
             return jsonify({"error": "Patient not found"}), 404
 
-        # Predict healing time left
-        patient_data = format_data(patient, "patient_data")
-        total_healing_time = predict_healing(patient_data)
+        # Healing time left from the stored prediction
+        total_healing_time = get_total_healing_time(patient)
         patient["healing_time_left"] = calculate_healing_time(total_healing_time, patient["created_at"])
 
-        # Analyze patient data
-        analysis = analyze_patient(patient)
+        # Analysis from the cache, or the status of the background job generating it
+        analysis = request_analysis(patient)
+        patient["analysis_status"] = analysis["status"]
 
-        if "analysis" in analysis:
+        if analysis["status"] == "done":
             patient["analysis"] = analysis["analysis"]
+            patient["analysis_cached"] = analysis["cached"]
+            patient["analysis_age"] = analysis["age"]
+        else:
+            patient["analysis_job"] = analysis["job_id"]
 
         # Convert ObjectId to string for JSON serialization
         patient["_id"] = str(patient["_id"])
         patient["created_at"] = str(patient["created_at"])
         patient["updated_at"] = str(patient["updated_at"])
+        patient.pop("healing_prediction", None)
 
         return jsonify({"patient": patient}), 200
     
@@ -162,20 +248,80 @@ def connect_patient(patient_id):
         if not patient:
             return jsonify({"error": "Patient not found"}), 404
 
-        # Get the file from the request
-        file = request.files["file"]    
-        if not file:
-            return jsonify({"error": "No file uploaded"}), 400
+        # Refuse oversized uploads before reading them, streamed ones without a Content-Length
+        # are cut off at the same size while they're read
+        request.max_content_length = MAX_RECORDING_BYTES + MAX_UPLOAD_OVERHEAD
+        if request.content_length and request.content_length > request.max_content_length:
+            return jsonify({"error": f"Recording is larger than {MAX_RECORDING_BYTES} bytes"}), 413
+
+        # The recording comes as a form file, or as a raw text/csv body, both are parsed as they're
+        # received (request.files would spool the whole upload before the first byte is validated)
+        try:
+            if request.mimetype == "text/csv":
+                stream = request.stream
+            elif request.mimetype == "multipart/form-data" and request.mimetype_params.get("boundary"):
+                stream = MultipartFileReader(request.stream, request.mimetype_params["boundary"])
+                if not stream.open():
+                    return jsonify({"error": "No file uploaded"}), 400
+                if not allowed_file(stream.filename, ALLOWED_SOURCE_EXTENSIONS):
+                    return jsonify({"error": "Invalid file extension"}), 400
+            else:
+                return jsonify({"error": "No file uploaded"}), 400
+
+            # Validate the CSV while it's read and store it as binary columns for the monitor
+            columns = parse_recording(stream)
+        except RecordingError as e:
+            return jsonify({"error": str(e), "row": e.row}), e.status_code
+        except RequestEntityTooLarge:
+            return jsonify({"error": f"Recording is larger than {MAX_RECORDING_BYTES} bytes"}), 413
+
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{patient_id}.npz")
+        save_recording(columns, filepath)
+
+        # End a running replay so viewers reconnect to the new recording
+        get_monitor_hub().close(patient_id)
+
+        return jsonify({"msg": "Patient connected to data source", "rows": len(columns["Time"])}), 200
 
-        # Process the file if it has an allowed extension
-        if allowed_file(file.filename, ALLOWED_SOURCE_EXTENSIONS):
-            filename = f"{patient_id}.csv"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-        else:
-            return jsonify({"error": "Invalid file extension"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# ingest live readings from a bedside device
+@patient_bp.route("/ingest/<string:patient_id>", methods=["POST"])
+@jwt_required()
+def ingest_health_data(patient_id):
+    try:
+        current_user = get_jwt_identity()
+
+        patient = app.db.patients.find_one({"_id": ObjectId(patient_id), "supervisor": current_user})
+        if not patient:
+            return jsonify({"error": "Patient not found"}), 404
 
-        return jsonify({"msg": "Patient connected to data source"}), 200
+        # Refused before anything is accepted, the device retries once the models are loaded
+        if not models_ready.is_set():
+            return jsonify({"error": "Models are loading"}), 503, {"Retry-After": str(INGEST_RETRY_AFTER)}
+
+        # NDJSON lines, or fixed-size binary records (see utils.recordings.READING_SIZE)
+        request.max_content_length = MAX_INGEST_BYTES
+        try:
+            if request.mimetype == "application/x-ndjson":
+                columns = parse_ndjson_readings(request.stream)
+            elif request.mimetype == "application/octet-stream":
+                columns = parse_binary_readings(request.stream)
+            else:
+                return jsonify({"error": "Content-Type must be application/x-ndjson or application/octet-stream"}), 415
+        except RecordingError as e:
+            return jsonify({"error": str(e), "row": e.row}), e.status_code
+        except RequestEntityTooLarge:
+            return jsonify({"error": f"Batch is larger than {MAX_INGEST_BYTES} bytes"}), 413
+
+        # Scored in the next micro-batch and published to the patient's monitor viewers
+        try:
+            accepted = ingest_readings(patient, columns)
+        except LiveBufferFull as e:
+            return jsonify({"error": f"Too many readings waiting: {str(e)}"}), 429, {"Retry-After": str(INGEST_RETRY_AFTER)}
+        return jsonify({"accepted": accepted}), 202
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -189,38 +335,49 @@ def stream_health_data(patient_id):
         if not patient:
             return jsonify({"error": "Patient not found"}), 404
         
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], patient_id + ".csv")
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{patient_id}.npz")
+
+        # Replay speed factor, 2 plays the recording twice as fast (set by the first viewer)
+        try:
+            speed = parse_speed(request.args.get("speed"))
+        except ValueError:
+            return jsonify({"error": "Invalid speed"}), 400
+
+        # Live readings ingested by any worker reach this one's hub through the live bus
+        get_live_bus(app.db)
+
+        # Viewers join the running replay (the first one starts it) and get the logged
+        # readings they missed, reconnecting EventSources resume after Last-Event-ID
+        flask_app = app._get_current_object()
+        subscriber = get_monitor_hub().subscribe(
+            patient_id, filepath,
+            lambda channel, start_after: start_replay(flask_app, channel, patient, speed, start_after),
+            last_event_id=request.headers.get("Last-Event-ID") or request.args.get("lastEventId")
+        )
+        if subscriber is None:
+            return jsonify({"error": "No data source connected"}), 404
+        if subscriber.closed and not subscriber.events:
+            # Replay over and nothing missed, 204 stops EventSource from reconnecting
+            return "", 204
 
         def generate():
             try:
-                with open(filepath, 'r') as csvfile:
-                    reader = csv.DictReader(csvfile)
-                    for row in reader:
-                        # Format data
-                        health_data = format_data(row, "health_data")
-                        patient_data = format_data(patient, "patient_data")                        
-
-                        # prediction
-                        infection = predict_infection(health_data)
-                        total_healing_time = predict_healing(patient_data) # in days
-                        
-                        # calculate time left based on created_at
-                        healing_time_left = calculate_healing_time(total_healing_time, patient["created_at"])
-
-                        # update numeric row
-                        health_data['Infection'] = infection[0]
-                        health_data['Healing Time'] = healing_time_left
-
-                        # Convert row to JSON and send
-                        yield f"data: {json.dumps(health_data)}\n\n"
-                        time.sleep(1.5)
+                while True:
+                    events, closed = subscriber.get(timeout=MONITOR_HEARTBEAT_INTERVAL)
+                    if not events and not closed:
+                        yield sse_event()
+                        continue
+
+                    for message in events:
+                        yield sse_event(message["data"], message["event"], message["id"])
+
+                    if closed:
+                        if subscriber.overflowed:
+                            # Too slow to keep up, the client reconnects and catches up
+                            yield sse_event(json.dumps({"dropped": True}), "overflow")
+                        break
             finally:
-                # delete the file after streaming is complete
-                try:
-                    os.remove(filepath)
-                    print(f"Cleaned up file: {filepath}")
-                except Exception as e:
-                    print(f"Error cleaning up file: {str(e)}")
+                get_monitor_hub().unsubscribe(subscriber)
 
         return Response(
                 stream_with_context(generate()),
@@ -237,23 +394,69 @@ def stream_health_data(patient_id):
             
 
 
+# downsampled history of a patient's monitor readings
+@patient_bp.route("/history/<string:patient_id>", methods=["GET"])
+@jwt_required()
+def patient_history(patient_id):
+    try:
+        current_user = get_jwt_identity()
+
+        patient = app.db.patients.find_one({"_id": ObjectId(patient_id), "supervisor": current_user}, {"_id": 1})
+        if not patient:
+            return jsonify({"error": "Patient not found"}), 404
+
+        # ?from=&to= (ISO 8601), ?points= per series, ?mode=buckets (min/max/mean) or lttb with ?field=
+        try:
+            start, end = parse_history_range(request.args.get("from"), request.args.get("to"))
+            points = min(max(int(request.args.get("points", DEFAULT_HISTORY_POINTS)), 1), MAX_HISTORY_POINTS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        mode = request.args.get("mode", "buckets")
+        if mode == "buckets":
+            history = history_buckets(app.db, patient_id, start, end, points)
+        elif mode == "lttb":
+            field = request.args.get("field", SERIES_FIELDS[0])
+            if field not in SERIES_FIELDS:
+                return jsonify({"error": f"Unknown field: {field}"}), 400
+            history = history_lttb(app.db, patient_id, start, end, points, field)
+        else:
+            return jsonify({"error": "Mode must be buckets or lttb"}), 400
+
+        return jsonify({"from": start.isoformat(), "to": end.isoformat(), "mode": mode, **history}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 # search patient by name
 @patient_bp.route("/search/<string:patient_name>", methods=["GET"])
 @jwt_required()
 def search_patient(patient_name):
     try:
         current_user = get_jwt_identity()
-        patients = app.db.patients.find({"supervisor": current_user, "name": {"$regex": patient_name, "$options": "i"}})
-        patients = list(patients)
 
-        # Convert ObjectId to string for JSON serialization
-        for patient in patients:
-            patient["_id"] = str(patient["_id"])
-            patient["created_at"] = str(patient["created_at"])
-            patient["updated_at"] = str(patient["updated_at"])
+        # Typo-tolerant matches from the in-process name index, best matches first
+        if request.args.get("fuzzy"):
+            limit = min(max(int(request.args.get("limit", DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+            ids = get_name_index(app.db, current_user).search(patient_name, limit)
+            found = {patient["_id"]: patient for patient in app.db.patients.find({"_id": {"$in": ids}, "supervisor": current_user}, SUMMARY_FIELDS)}
 
-        return jsonify({"patients": patients}), 200
+            patients = []
+            for patient_id in ids:
+                if patient_id in found:
+                    patient = found[patient_id]
+                    patient["_id"] = str(patient["_id"])
+                    patient["created_at"] = str(patient["created_at"])
+                    patients.append(patient)
+
+            return jsonify({"patients": patients, "next": None}), 200
+
+        # Prefix match on the indexed name tokens
+        return jsonify(list_patients({"supervisor": current_user, **name_token_query(patient_name)})), 200
     
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -289,6 +492,7 @@ def delete_patient(patient_id):
         result = app.db.patients.delete_one({"_id": ObjectId(patient_id)})
         if result.deleted_count == 0:
             return jsonify({"error": "Failed to delete patient"}), 500
+        unindex_patient_name(current_user, patient["_id"])
         
         # delete patient avatar from server
         if patient["avatar"]:
@@ -314,6 +518,7 @@ def delete_all_patients():
 
         # Delete all patients supervised by the current user
         app.db.patients.delete_many({"supervisor": current_user})
+        drop_name_index(current_user)
         
         # delete all patient avatars from server
         for patient in patients:
@@ -338,6 +543,10 @@ def analyze_patient_route(patient_id):
         if not patient:
             return jsonify({"error": "Patient not found"}), 404
 
+        # The analysis prompt includes the healing time left
+        total_healing_time = get_total_healing_time(patient)
+        patient["healing_time_left"] = calculate_healing_time(total_healing_time, patient["created_at"])
+
         # Analyze patient data
         response = analyze_patient(patient)
         
@@ -351,6 +560,116 @@ def analyze_patient_route(patient_id):
         return jsonify({"error": str(e)}), 500
 
 
+# poll a background analysis job
+@patient_bp.route("/analyze/job/<string:job_id>", methods=["GET"])
+@jwt_required()
+def analysis_job_status(job_id):
+    # Jobs are only visible to the supervisors whose patients requested them
+    job = get_analysis_queue().get(job_id)
+    if not job or get_jwt_identity() not in job.supervisors:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify(job.to_dict()), 200
+
+
+# stream the analysis text over SSE as the model generates it
+@patient_bp.route("/analyze/<string:patient_id>/stream", methods=["GET"])
+@jwt_required(locations=SSE_TOKEN_LOCATIONS)
+def analysis_stream(patient_id):
+    try:
+        # Get the current user identity
+        current_user = get_jwt_identity()
+
+        # Check if the patient exists
+        patient = app.db.patients.find_one({"_id": ObjectId(patient_id), "supervisor": current_user})
+        if not patient:
+            return jsonify({"error": "Patient not found"}), 404
+
+        # The analysis prompt includes the healing time left
+        total_healing_time = get_total_healing_time(patient)
+        patient["healing_time_left"] = calculate_healing_time(total_healing_time, patient["created_at"])
+
+        # Cached analyses are sent at once, otherwise relay the (possibly already running) job
+        analysis = request_analysis(patient)
+        job = get_analysis_queue().get(analysis["job_id"]) if "job_id" in analysis else None
+
+        def generate():
+            if not job:
+                yield f"data: {json.dumps(analysis)}\n\n"
+                return
+
+            sent = 0
+            while True:
+                chunks, finished = job.wait_for_chunks(sent, ANALYSIS_HEARTBEAT_INTERVAL)
+                if chunks:
+                    sent += len(chunks)
+                    yield f"data: {json.dumps({'status': 'partial', 'text': ''.join(chunks)})}\n\n"
+                elif not finished:
+                    yield ": heartbeat\n\n"
+
+                if finished:
+                    yield f"data: {json.dumps(job.to_dict())}\n\n"
+                    return
+
+        return Response(
+                stream_with_context(generate()),
+                mimetype='text/event-stream',
+                headers={
+                    'Cache-Control': 'no-cache',
+                    'Connection': 'keep-alive',
+                    'X-Accel-Buffering': 'no'
+                }
+            )
+
+    except Exception as e:
+        app.logger.error(f"Error in AI analysis: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+# push the analysis result over SSE once it's ready
+@patient_bp.route("/analyze/<string:patient_id>/events", methods=["GET"])
+@jwt_required(locations=SSE_TOKEN_LOCATIONS)
+def analysis_events(patient_id):
+    try:
+        # Get the current user identity
+        current_user = get_jwt_identity()
+
+        # Check if the patient exists
+        patient = app.db.patients.find_one({"_id": ObjectId(patient_id), "supervisor": current_user})
+        if not patient:
+            return jsonify({"error": "Patient not found"}), 404
+
+        # The analysis prompt includes the healing time left
+        total_healing_time = get_total_healing_time(patient)
+        patient["healing_time_left"] = calculate_healing_time(total_healing_time, patient["created_at"])
+
+        analysis = request_analysis(patient)
+        job = get_analysis_queue().get(analysis["job_id"]) if "job_id" in analysis else None
+
+        def generate():
+            if job:
+                # Heartbeats keep proxies from closing the idle connection
+                while not job.done.wait(ANALYSIS_HEARTBEAT_INTERVAL):
+                    yield ": heartbeat\n\n"
+                yield f"data: {json.dumps(job.to_dict())}\n\n"
+            else:
+                yield f"data: {json.dumps(analysis)}\n\n"
+
+        return Response(
+                stream_with_context(generate()),
+                mimetype='text/event-stream',
+                headers={
+                    'Cache-Control': 'no-cache',
+                    'Connection': 'keep-alive',
+                    'X-Accel-Buffering': 'no'
+                }
+            )
+
+    except Exception as e:
+        app.logger.error(f"Error in AI analysis: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
 
 
 
@@ -377,6 +696,7 @@ def delete_all_patients_globally():
         patients = list(patients)
 
         result = app.db.patients.delete_many({})
+        drop_name_index()
         if result.deleted_count == 0:
             return jsonify({"error": "No patients found for deletion"}), 404
         
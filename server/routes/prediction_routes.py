@@ -1,8 +1,17 @@
 from flask import Blueprint, request, jsonify
-from utils.init_models import predict_infection, predict_healing
+from functools import wraps
+from utils.init_models import predict_infection, predict_healing, predict_infection_batch, predict_healing_batch, get_cache_stats, activate_model, get_model_status
+from predictors.model_registry import RegistryError
+import hmac
+import os
 
 prediction_bp = Blueprint('prediction', __name__)
 
+MAX_BATCH_SIZE = 1000
+
+# Shared secret for the model administration routes, sent as the X-Admin-Token header
+MODEL_ADMIN_TOKEN = os.environ.get('MODEL_ADMIN_TOKEN')
+
 
 @prediction_bp.route('/infection', methods=['POST'])
 def infection_route():
@@ -41,4 +50,124 @@ def healing_route():
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+
+def get_batch_rows():
+    """Read a batch body: a list of records, {"rows": [...]}, or a dict of feature columns"""
+    data = request.get_json()
+    
+    if isinstance(data, dict) and 'rows' in data:
+        data = data['rows']
+    
+    if isinstance(data, list):
+        size = len(data)
+    elif isinstance(data, dict) and data:
+        size = max(len(values) if isinstance(values, list) else 1 for values in data.values())
+    else:
+        raise ValueError('Batch input must be a list of records or a dict of columns')
+    
+    if size > MAX_BATCH_SIZE:
+        raise ValueError(f'Batch too large: maximum is {MAX_BATCH_SIZE} rows')
+    
+    return data
+
+@prediction_bp.route('/infection/batch', methods=['POST'])
+def infection_batch_route():
+    try:
+        rows = get_batch_rows()
+        predictions = predict_infection_batch(rows)
+        
+        # Format response, one entry per input row
+        results = []
+        for i, prediction in enumerate(predictions):
+            if 'error' in prediction:
+                results.append({'index': i, 'error': prediction['error']})
+            else:
+                results.append({
+                    'index': i,
+                    'infection_prediction': prediction['prediction'],
+                    'infection_probability': prediction['probability']
+                })
+        
+        return jsonify({
+            'results': results,
+            'count': len(results),
+            'failed': sum(1 for result in results if 'error' in result)
+        })
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@prediction_bp.route('/healing/batch', methods=['POST'])
+def healing_batch_route():
+    try:
+        rows = get_batch_rows()
+        predictions = predict_healing_batch(rows)
+        
+        # Format response, one entry per input row
+        results = []
+        for i, prediction in enumerate(predictions):
+            if 'error' in prediction:
+                results.append({'index': i, 'error': prediction['error']})
+            else:
+                results.append({'index': i, 'healing_time_days': prediction['days']})
+        
+        return jsonify({
+            'results': results,
+            'count': len(results),
+            'failed': sum(1 for result in results if 'error' in result)
+        })
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@prediction_bp.route('/cache/stats', methods=['GET'])
+def cache_stats_route():
+    return jsonify(get_cache_stats())
+
+
+def admin_required(route):
+    """Only let requests carrying MODEL_ADMIN_TOKEN through, the routes are disabled when it's unset"""
+    @wraps(route)
+    def wrapper(*args, **kwargs):
+        if not MODEL_ADMIN_TOKEN:
+            return jsonify({'error': 'Model administration is disabled'}), 403
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), MODEL_ADMIN_TOKEN):
+            return jsonify({'error': 'Invalid admin token'}), 401
+        return route(*args, **kwargs)
+    return wrapper
+
+@prediction_bp.route('/models', methods=['GET'])
+@admin_required
+def models_route():
+    return jsonify(get_model_status())
+
+@prediction_bp.route('/models/<string:name>/activate', methods=['POST'])
+@admin_required
+def activate_model_route(name):
+    try:
+        data = request.get_json(silent=True) or {}
+        version = activate_model(name, data.get('version'))
+        return jsonify({'model': name, 'loading': version}), 202
+    
+    except RegistryError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@prediction_bp.route('/models/<string:name>/rollback', methods=['POST'])
+@admin_required
+def rollback_model_route(name):
+    try:
+        version = activate_model(name, rollback=True)
+        return jsonify({'model': name, 'loading': version}), 202
+    
+    except RegistryError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify, current_app as app
+from flask import Blueprint, request, jsonify, current_app as app, Response, stream_with_context
 from werkzeug.security import generate_password_hash
 from pymongo import ReturnDocument
 from pymongo.errors import PyMongoError
@@ -8,8 +8,10 @@ from bson import ObjectId
 from utils.handlers import stream_avatar
 from utils.validation import validate_signup, ValidationError
 from utils.utils import allowed_file
+from utils.name_index import drop_name_index
 import os
 import uuid
+from itertools import islice
 
 # initialize blueprint
 user_bp = Blueprint("user", __name__)
@@ -59,6 +61,7 @@ def delete_user():
         patients = app.db.patients.find({"supervisor": current_user})
         patients = list(patients)
         app.db.patients.delete_many({"supervisor": current_user})
+        drop_name_index(current_user)
 
         # delete all patients avatars
         for patient in patients:
@@ -198,20 +201,65 @@ def delete_user_by_email(user_email):
         return jsonify({"error": "An unexpected error occurred"}), 500
 
 
-# list all users
+# Users of /user/list serialized before its response starts streaming
+LIST_USERS_FIRST_BATCH = 100
+
+
+# list all users, with their patients (?patients=count for patient counts only)
 @user_bp.route("/list", methods=["GET"])
 def list_users():
     try:
-        users = app.db.users.find()
-        users = list(users)
-
-        for user in users:
-            user.pop("password", None)
-            patients = app.db.patients.find({"supervisor": str(user["_id"])})
-            patients = list(patients)
-            user["patients"] = patients
-
-        return jsonify({"users": list(users)}), 200
+        counts_only = request.args.get("patients") == "count"
+
+        # One aggregation joins every user with their patients instead of a query per user
+        patients_pipeline = [{"$match": {"$expr": {"$eq": ["$supervisor", "$$user_id"]}}}]
+        if counts_only:
+            patients_pipeline.append({"$count": "count"})
+
+        pipeline = [
+            {"$project": {"password": 0}},
+            {"$lookup": {
+                "from": "patients",
+                "let": {"user_id": {"$toString": "$_id"}},
+                "pipeline": patients_pipeline,
+                "as": "patients",
+            }},
+        ]
+        if counts_only:
+            pipeline += [
+                {"$addFields": {"patient_count": {"$ifNull": [{"$first": "$patients.count"}, 0]}}},
+                {"$project": {"patients": 0}},
+            ]
+
+        cursor = app.db.users.aggregate(pipeline, allowDiskUse=True)
+
+        # Users are written by the app's JSON provider (Flask-PyMongo's, BSON aware) like jsonify does.
+        # The first ones are read before the response starts, so a failing query is still a 500
+        try:
+            first = [app.json.dumps(user) for user in islice(cursor, LIST_USERS_FIRST_BATCH)]
+        except Exception:
+            cursor.close()
+            raise
+
+        # Stream the rest from the cursor instead of building the whole list
+        def generate():
+            try:
+                yield '{"users": [' + ",".join(first)
+                count = len(first)
+                try:
+                    for user in cursor:
+                        yield ("," if count else "") + app.json.dumps(user)
+                        count += 1
+                except Exception as e:
+                    # The status is already sent, end the JSON with an error the client can see
+                    app.logger.error(f"Error streaming users after {count}: {e}")
+                    yield '], "error": "Database error"}'
+                    return
+                yield "]}"
+            finally:
+                cursor.close()
+
+        return Response(stream_with_context(generate()), mimetype="application/json"), 200
     except PyMongoError as e:
         app.logger.error(f"Database error: {e}")
         return jsonify({"error": "Database error"}), 500
@@ -0,0 +1,12 @@
+# Test settings, read when the app modules are imported by the test modules
+
+import os
+import tempfile
+
+os.environ.setdefault("PORT", "5000")
+os.environ.setdefault("SECRET_KEY", "test-secret-key-long-enough-for-hs256")
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/smartcare_test")
+os.environ.setdefault("DB_NAME", "smartcare_test")
+os.environ["LIVE_BUS"] = "local"
+os.environ["ANALYSIS_BACKEND"] = "fake"
+os.environ["MODEL_REGISTRY_DIR"] = tempfile.mkdtemp(prefix="smartcare-registry-")
@@ -0,0 +1,38 @@
+# In-memory stand-ins for the MongoDB collections the tested routes use
+
+from collections import defaultdict
+
+
+class FakeCollection:
+    """The few collection methods the tested routes use, on equality queries"""
+
+    def __init__(self):
+        self.documents = []
+
+    def find_one(self, query):
+        return next((document for document in self.documents
+                     if all(document.get(key) == value for key, value in query.items())), None)
+
+    def update_one(self, query, update, upsert=False):
+        document = self.find_one(query)
+        if document is not None:
+            document.update(update.get("$set", {}))
+        elif upsert:
+            self.documents.append({**query, **update.get("$set", {})})
+
+    def insert_one(self, document):
+        self.documents.append(document)
+
+    def insert_many(self, documents, ordered=True):
+        self.documents.extend(documents)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = defaultdict(FakeCollection)
+
+    def __getattr__(self, name):
+        return self.collections[name]
+
+    def __getitem__(self, name):
+        return self.collections[name]
@@ -0,0 +1,133 @@
+# AI analyses end to end on the offline FakeBackend: requests for the same prompt share one
+# background job, /patient/analyze/<id>/stream relays its text as it's generated and
+# /patient/analyze/<id>/events sends the result, which is then cached in the analyses collection
+#
+# Run from the server directory: python -m unittest tests.test_analysis
+
+import json
+import threading
+import unittest
+from datetime import datetime, UTC
+
+from bson import ObjectId
+from flask_jwt_extended import create_access_token
+
+from app import app
+from tests.fakes import FakeDatabase
+from utils.analysis_jobs import request_analysis, get_analysis_queue
+from utils.init_models import initialize_models
+from utils.llm_backends import FakeBackend, set_backend
+from utils.utils import analysis_key, calculate_healing_time, get_total_healing_time
+
+SUPERVISOR = str(ObjectId())
+TEXT = "* **Summary:** Healing well.\n* **Treatment:** Keep the dressing dry.\n* **Expectations:** Closed in two weeks."
+
+
+def sse_messages(response):
+    """The JSON payloads of the data: lines of an SSE response, in order"""
+    body = response.get_data(as_text=True)
+    return [json.loads(line[len("data: "):]) for line in body.split("\n") if line.startswith("data: ")]
+
+
+class AnalysisTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        initialize_models()
+        app.db = FakeDatabase()
+        cls.client = app.test_client()
+        with app.app_context():
+            cls.token = create_access_token(identity=SUPERVISOR)
+
+    def setUp(self):
+        # Generation spread over a second, so the job is still running when the requests arrive
+        self.backend = FakeBackend(delay=1.0, text=TEXT)
+        set_backend(self.backend)
+
+        # Every test gets its own prompt, hence its own cache key
+        self.patient_id = ObjectId()
+        app.db.patients.insert_one({
+            "_id": self.patient_id,
+            "supervisor": SUPERVISOR,
+            "age": 30 + len(app.db.patients.documents),
+            "gender": "Female",
+            "wound": {"type": "Burn", "location": "Arm", "severity": "Moderate", "infected": "No",
+                      "size": 12.5, "treatment": "Antibiotics (Oral)"},
+            "created_at": datetime.now(UTC),
+        })
+
+    def get(self, route):
+        return self.client.get(f"/patient/analyze/{self.patient_id}/{route}?jwt={self.token}")
+
+    def test_requests_for_the_same_patient_share_one_job(self):
+        with app.test_request_context():
+            patient = app.db.patients.find_one({"_id": self.patient_id})
+            patient["healing_time_left"] = calculate_healing_time(get_total_healing_time(patient), patient["created_at"])
+
+            first = request_analysis(patient)
+            second = request_analysis(patient)
+
+        self.assertEqual(first["status"], "pending")
+        self.assertEqual(first["job_id"], second["job_id"])
+
+        job = get_analysis_queue().get(first["job_id"])
+        self.assertTrue(job.done.wait(10))
+        self.assertEqual(job.status, "done")
+        self.assertEqual(len(self.backend.prompts), 1)
+
+    def test_stream_relays_the_text_in_order_then_caches_it(self):
+        # Two viewers at once, the second joins the running job. A streamed body is read on
+        # the thread that made the request, its request context lives there
+        results = {}
+
+        def view(i):
+            response = self.get("stream")
+            results[i] = (response.status_code, sse_messages(response))
+
+        threads = [threading.Thread(target=view, args=(i,)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(len(results), 2)
+        for status_code, messages in results.values():
+            self.assertEqual(status_code, 200)
+            partials = [message["text"] for message in messages if message["status"] == "partial"]
+
+            self.assertGreater(len(partials), 1)
+            self.assertEqual("".join(partials), TEXT)
+            self.assertEqual(messages[-1]["status"], "done")
+            self.assertEqual(messages[-1]["analysis"], TEXT)
+
+        self.assertEqual(len(self.backend.prompts), 1)
+
+        # Stored in analyses, the next request is served from it without generating again
+        stored = app.db.analyses.find_one({"_id": analysis_key(self.backend.prompts[0])})
+        self.assertEqual(stored["analysis"], TEXT)
+        self.assertEqual(stored["model"], "fake")
+
+        messages = sse_messages(self.get("stream"))
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]["status"], "done")
+        self.assertTrue(messages[0]["cached"])
+        self.assertEqual(len(self.backend.prompts), 1)
+
+    def test_events_sends_the_result_once_done(self):
+        messages = sse_messages(self.get("events"))
+
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]["status"], "done")
+        self.assertEqual(messages[0]["analysis"], TEXT)
+        self.assertFalse(messages[0]["cached"])
+
+    def test_other_supervisors_get_no_analysis(self):
+        with app.app_context():
+            token = create_access_token(identity=str(ObjectId()))
+        response = self.client.get(f"/patient/analyze/{self.patient_id}/stream?jwt={token}")
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.backend.prompts, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,219 @@
+# Live ingestion end to end: the simulated bedside device posts NDJSON and binary batches to
+# POST /patient/ingest/<id> and the scored readings come out of the patient's monitor channel
+#
+# Run from the server directory: python -m unittest tests.test_live
+# The cross-worker relay test needs a MongoDB server, set TEST_MONGO_URI to run it
+
+import json
+import os
+import tempfile
+import time
+import unittest
+import unittest.mock
+import uuid
+from datetime import datetime, UTC
+
+from bson import ObjectId
+from flask_jwt_extended import create_access_token
+
+from app import app
+from benchmarks.simulate_device import synthetic_readings, encode
+from tests.fakes import FakeDatabase
+from utils.history import get_reading_writer
+from utils.init_models import initialize_models, models_ready
+from utils.live import MongoLiveBus, LocalLiveBus, LiveFeed, LiveScorer, LiveBufferFull
+from utils.recordings import parse_binary_readings, READING_DTYPE
+from utils.monitor import MonitorHub, get_monitor_hub
+from utils.utils import HEALTH_DATA_FIELDS
+
+SUPERVISOR = str(ObjectId())
+
+
+def wait_for_events(hub, patient_id, count, timeout=10):
+    """The logged events of a patient's channel once there are `count` of them (or the timeout passed)"""
+    deadline = time.monotonic() + timeout
+    while True:
+        channel = hub.channels.get(patient_id)
+        events = list(channel.log) if channel else []
+        if len(events) >= count or time.monotonic() > deadline:
+            return events
+        time.sleep(0.01)
+
+
+class TrickleStream:
+    """A few bytes per read, like a slow chunked upload"""
+
+    def __init__(self, data, size):
+        self.data = data
+        self.size = size
+
+    def read(self, n=-1):
+        chunk, self.data = self.data[:min(n, self.size)], self.data[min(n, self.size):]
+        return chunk
+
+
+class LiveIngestTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        initialize_models()
+        app.db = FakeDatabase()
+        cls.client = app.test_client()
+        with app.app_context():
+            cls.headers = {"Authorization": f"Bearer {create_access_token(identity=SUPERVISOR)}"}
+
+    def setUp(self):
+        self.patient_id = ObjectId()
+        app.db.patients.insert_one({
+            "_id": self.patient_id,
+            "supervisor": SUPERVISOR,
+            "age": 45,
+            "wound": {"type": "Burn", "location": "Arm", "severity": "Moderate", "infected": "Yes",
+                      "size": 12.5, "treatment": "Antibiotics (Oral)"},
+            "created_at": datetime.now(UTC),
+        })
+
+    def post(self, batch, framing, headers=None):
+        body, content_type = encode(batch, framing)
+        return self.client.post(f"/patient/ingest/{self.patient_id}", data=body,
+                                headers={**(headers or self.headers), "Content-Type": content_type})
+
+    def test_ndjson_and_binary_batches_are_scored_and_published(self):
+        readings = synthetic_readings(30)
+
+        response = self.post(readings[:20], "ndjson")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json, {"accepted": 20})
+
+        response = self.post(readings[20:], "binary")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json, {"accepted": 10})
+
+        events = wait_for_events(get_monitor_hub(), str(self.patient_id), 30)
+        self.assertEqual([event["id"] for event in events], [f"live.{seq}" for seq in range(1, 31)])
+
+        for event, reading in zip(events, readings):
+            data = json.loads(event["data"])
+            self.assertEqual([data[field] for field in HEALTH_DATA_FIELDS], reading.tolist())
+            self.assertIn(data["Infection"], ("Yes", "No"))
+            self.assertIsNotNone(data["Healing Time"])
+
+        # Every published reading is kept for /patient/history
+        get_reading_writer(app.db).flush()
+        stored = [document for document in app.db.readings.documents if document["patient"] == str(self.patient_id)]
+        self.assertEqual(len(stored), 30)
+        self.assertTrue(all(document["source"] == "live" for document in stored))
+
+    def test_viewers_resume_after_last_event_id(self):
+        readings = synthetic_readings(12)
+        self.assertEqual(self.post(readings, "binary").status_code, 202)
+        wait_for_events(get_monitor_hub(), str(self.patient_id), 12)
+
+        subscriber = get_monitor_hub().subscribe(str(self.patient_id), os.path.join(tempfile.gettempdir(), "none.npz"),
+                                                 lambda channel, start_after: None, last_event_id="live.8")
+        events, closed = subscriber.get(timeout=0)
+        get_monitor_hub().unsubscribe(subscriber)
+
+        self.assertFalse(closed)
+        self.assertEqual([event["id"] for event in events], ["live.9", "live.10", "live.11", "live.12"])
+
+    def test_invalid_batches_are_rejected_and_not_published(self):
+        body = json.dumps({field: 1.0 for field in HEALTH_DATA_FIELDS[:-1]}) + "\n"
+        response = self.client.post(f"/patient/ingest/{self.patient_id}", data=body,
+                                    headers={**self.headers, "Content-Type": "application/x-ndjson"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json["row"], 1)
+
+        response = self.client.post(f"/patient/ingest/{self.patient_id}", data=b"\x00" * 7,
+                                    headers={**self.headers, "Content-Type": "application/octet-stream"})
+        self.assertEqual(response.status_code, 400)
+
+        self.assertNotIn(str(self.patient_id), get_monitor_hub().channels)
+
+    def test_batches_are_refused_while_the_models_load(self):
+        models_ready.clear()
+        try:
+            response = self.post(synthetic_readings(3), "ndjson")
+        finally:
+            models_ready.set()
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+        self.assertNotIn(str(self.patient_id), get_monitor_hub().channels)
+
+    def test_a_full_buffer_refuses_the_batch_whole(self):
+        scorer, feed = LiveScorer(), LiveFeed("patient", buffer_size=5)
+        feed.writer, feed.bus = get_reading_writer(app.db), LocalLiveBus(MonitorHub())
+
+        # The scorer can't drain the buffer while its lock is held
+        with scorer.changed:
+            scorer.submit(feed, synthetic_readings(3))
+            with self.assertRaises(LiveBufferFull):
+                scorer.submit(feed, synthetic_readings(3))
+            self.assertEqual(feed.buffered, 3)
+
+    def test_readings_that_cannot_be_scored_are_kept_without_a_prediction(self):
+        hub = MonitorHub()
+        feed = LiveFeed(str(self.patient_id))
+        feed.writer, feed.bus = get_reading_writer(app.db), LocalLiveBus(hub)
+
+        readings = synthetic_readings(4)
+        LiveScorer().score([(feed, readings)])
+
+        with unittest.mock.patch("utils.live.predict_infection_batch", side_effect=Exception("Infection model not initialized")):
+            LiveScorer().score([(feed, readings)])
+
+        events = [json.loads(event["data"]) for event in hub.channels[str(self.patient_id)].log]
+        self.assertEqual(len(events), 8)
+        self.assertTrue(all(event["Infection"] in ("Yes", "No") for event in events[:4]))
+        self.assertTrue(all(event["Infection"] is None and "error" in event for event in events[4:]))
+
+        get_reading_writer(app.db).flush()
+        stored = [document for document in app.db.readings.documents if document["patient"] == str(self.patient_id)]
+        self.assertEqual(len(stored), 8)
+        self.assertEqual(sum(document["Infection Probability"] is None for document in stored), 4)
+
+    def test_binary_batches_are_read_to_the_end(self):
+        readings = synthetic_readings(5)
+        columns = parse_binary_readings(TrickleStream(readings.astype(READING_DTYPE).tobytes(), 7))
+        self.assertEqual([columns[field].tolist() for field in HEALTH_DATA_FIELDS], readings.T.tolist())
+
+    def test_other_supervisors_cannot_ingest(self):
+        with app.app_context():
+            headers = {"Authorization": f"Bearer {create_access_token(identity=str(ObjectId()))}"}
+        self.assertEqual(self.post(synthetic_readings(3), "ndjson", headers).status_code, 404)
+
+
+@unittest.skipUnless(os.environ.get("TEST_MONGO_URI"), "needs a MongoDB server, set TEST_MONGO_URI")
+class MongoLiveBusTest(unittest.TestCase):
+    def setUp(self):
+        from pymongo import MongoClient
+
+        client = MongoClient(os.environ["TEST_MONGO_URI"])
+        self.db = client[f"smartcare_test_{uuid.uuid4().hex[:8]}"]
+        self.addCleanup(client.drop_database, self.db.name)
+
+    def test_readings_published_by_one_worker_reach_the_others(self):
+        # Two workers, each with its own monitor hub
+        hub_a, hub_b = MonitorHub(), MonitorHub()
+        worker_a, worker_b = MongoLiveBus(self.db, hub_a), MongoLiveBus(self.db, hub_b)
+        worker_a.start()
+        worker_b.start()
+
+        first_seq = worker_a.next_seq("patient", 2)
+        worker_a.publish("patient", first_seq, ['{"Time": 0}', '{"Time": 2}'])
+
+        for hub in (hub_a, hub_b):
+            events = wait_for_events(hub, "patient", 2)
+            self.assertEqual([event["id"] for event in events], ["live.1", "live.2"])
+
+        # Sequence numbers are shared, the next worker to publish continues them
+        self.assertEqual(worker_b.next_seq("patient", 1), 3)
+
+        # A worker starting later catches up on the recent readings before its first viewer subscribes
+        hub_c = MonitorHub()
+        MongoLiveBus(self.db, hub_c).start()
+        self.assertEqual([event["id"] for event in hub_c.channels["patient"].log], ["live.1", "live.2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
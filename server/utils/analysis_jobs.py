@@ -0,0 +1,142 @@
+from flask import current_app as app
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from datetime import datetime, UTC
+from utils.utils import build_analysis_prompt, analysis_key, get_cached_analysis, store_analysis, analysis_response
+from utils.llm_backends import get_backend
+import os
+import threading
+import uuid
+
+# Finished jobs kept in the job table for polling
+MAX_FINISHED_JOBS = 1000
+
+
+class AnalysisJob:
+    def __init__(self, key):
+        self.id = str(uuid.uuid4())
+        self.key = key
+        self.supervisors = set() # users allowed to read the job, every one that requested it
+        self.status = "pending"
+        self.entry = None
+        self.error = None
+        self.created_at = datetime.now(UTC)
+        self.finished_at = None
+        self.done = threading.Event()
+
+        # Partial text streamed by the backend, readers wait on the condition for more
+        self.chunks = []
+        self.changed = threading.Condition()
+
+    def add_chunk(self, text):
+        with self.changed:
+            self.chunks.append(text)
+            self.changed.notify_all()
+
+    def finish(self):
+        with self.changed:
+            self.done.set()
+            self.changed.notify_all()
+
+    def wait_for_chunks(self, start, timeout):
+        """Chunks after index `start`, waiting up to `timeout` seconds for new ones.
+        Returns (chunks, finished)."""
+        with self.changed:
+            if len(self.chunks) <= start and not self.done.is_set():
+                self.changed.wait(timeout)
+            return self.chunks[start:], self.done.is_set()
+
+    def to_dict(self):
+        result = {"status": self.status, "job_id": self.id}
+
+        if self.status == "done":
+            result.update(analysis_response(self.entry, cached=False))
+        elif self.status == "error":
+            result["error"] = self.error
+
+        return result
+
+
+# Runs AI analyses on a bounded worker pool, one job per prompt hash
+class AnalysisQueue:
+    def __init__(self, max_workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        self.jobs = OrderedDict()
+        self.active = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, prompt, supervisor=None):
+        with self.lock:
+            # Reuse the in-flight job for the same prompt
+            job = self.active.get(key)
+            if job:
+                job.supervisors.add(supervisor)
+                return job
+
+            job = AnalysisJob(key)
+            job.supervisors.add(supervisor)
+            self.jobs[job.id] = job
+            self.active[key] = job
+
+            # Forget the oldest finished jobs
+            while len(self.jobs) > MAX_FINISHED_JOBS + len(self.active):
+                oldest = next(iter(self.jobs.values()))
+                if not oldest.done.is_set():
+                    break
+                self.jobs.pop(oldest.id)
+
+        self.executor.submit(self.run, app._get_current_object(), job, prompt)
+        return job
+
+    def run(self, flask_app, job, prompt):
+        with flask_app.app_context():
+            try:
+                job.status = "running"
+
+                # Stream the generation so readers can relay partial text
+                for text in get_backend().generate_stream(prompt):
+                    job.add_chunk(text)
+
+                if not job.chunks:
+                    raise Exception("Failed to generate analysis")
+
+                job.entry = store_analysis(job.key, "".join(job.chunks))
+                job.status = "done"
+            except Exception as e:
+                print(f"Error in AI analysis job {job.id}: {str(e)}")
+                job.error = str(e)
+                job.status = "error"
+            finally:
+                job.finished_at = datetime.now(UTC)
+                with self.lock:
+                    self.active.pop(job.key, None)
+                job.finish()
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+
+analysis_queue = None
+
+
+# Queue sized by ANALYSIS_WORKERS, the maximum number of concurrent LLM calls
+def get_analysis_queue():
+    global analysis_queue
+
+    if analysis_queue is None:
+        analysis_queue = AnalysisQueue(max_workers=int(os.environ.get('ANALYSIS_WORKERS', 2)))
+
+    return analysis_queue
+
+
+# Cached analysis if there is one, otherwise the status of a background job producing it
+def request_analysis(patient):
+    prompt = build_analysis_prompt(patient)
+    key = analysis_key(prompt)
+
+    entry = get_cached_analysis(key)
+    if entry:
+        return {"status": "done", **analysis_response(entry, cached=True)}
+
+    return get_analysis_queue().submit(key, prompt, patient.get("supervisor")).to_dict()
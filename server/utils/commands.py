@@ -0,0 +1,154 @@
+import click
+import time
+from pymongo import UpdateOne
+from datetime import datetime, UTC
+from utils.init_models import initialize_models, predict_healing_batch, get_healing_model_version, MODEL_NAMES
+from predictors.wound_monitoring import get_wound_monitoring_predictor, build_wound_monitoring_predictor
+from predictors.wound_healing_prediction import get_wound_healing_predictor, build_wound_healing_predictor
+from predictors.model_registry import RegistryError, publish_model, read_active, write_active
+from predictors.model_search import SEARCH_STRATEGIES
+from utils.utils import format_data, ANALYSIS_CACHE_TTL
+from utils.history import READINGS_TTL
+from utils.db import ensure_indexes, audit_queries
+from utils.name_index import tokenize_name
+
+BACKFILL_BATCH_SIZE = 500
+
+
+def publish_predictor(name, predictor, version=None, activate=False):
+    """Publish a predictor's model files as a registry version, and make it active if asked"""
+    try:
+        manifest = publish_model(predictor, version)
+    except RegistryError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Published {name} version {manifest['version']} (checksum {manifest['checksum'][:16]})")
+
+    if activate:
+        active = read_active(name) or {"version": None, "history": []}
+        history = active["history"] + ([active["version"]] if active["version"] else [])
+        write_active(name, manifest["version"], history)
+        click.echo(f"Activated {name} version {manifest['version']}")
+
+
+def register_commands(app):
+    """Register maintenance commands, run them with: flask --app app <command>"""
+
+    @app.cli.command("create-indexes")
+    def create_indexes():
+        """Create the database indexes"""
+        ensure_indexes(app.db, analysis_ttl=ANALYSIS_CACHE_TTL, readings_ttl=READINGS_TTL)
+
+    @app.cli.command("backfill-name-tokens")
+    def backfill_name_tokens():
+        """Store normalized name tokens on patients created before indexed search"""
+        operations = []
+        updated = 0
+
+        for patient in app.db.patients.find({"name_tokens": {"$exists": False}}, {"name": 1}):
+            operations.append(UpdateOne({"_id": patient["_id"]}, {"$set": {"name_tokens": tokenize_name(patient.get("name", ""))}}))
+            if len(operations) >= BACKFILL_BATCH_SIZE:
+                updated += app.db.patients.bulk_write(operations, ordered=False).modified_count
+                operations = []
+        if operations:
+            updated += app.db.patients.bulk_write(operations, ordered=False).modified_count
+
+        click.echo(f"Name tokens backfilled: {updated} patients updated")
+
+    @app.cli.command("audit-queries")
+    def audit_queries_command():
+        """Explain every route query and fail if any of them scans a whole collection or has no readable plan"""
+        results = audit_queries(app.db)
+
+        for route, collection, stages, problem in results:
+            click.echo(f"[{problem or 'ok'}] {route} on {collection}: {' > '.join(stages)}")
+
+        failed = [f"{route} ({problem})" for route, _, _, problem in results if problem]
+        if failed:
+            raise click.ClickException(f"{len(failed)} route queries scan a whole collection or couldn't be explained: {', '.join(failed)}")
+
+    @app.cli.command("backfill-healing")
+    @click.option("--all", "recompute_all", is_flag=True, help="Recompute every patient, not only stale ones")
+    def backfill_healing(recompute_all):
+        """Store healing time predictions for patients missing one or tagged with an old model version"""
+        initialize_models()
+
+        model_version = get_healing_model_version()
+        if model_version is None:
+            raise click.ClickException("Wound healing model not initialized")
+
+        query = {} if recompute_all else {"healing_prediction.model_version": {"$ne": model_version}}
+        cursor = app.db.patients.find(query, {"age": 1, "wound": 1})
+
+        updated, failed = 0, 0
+        batch = []
+
+        def flush():
+            nonlocal updated, failed
+            results = predict_healing_batch([row for _, row in batch])
+            predicted_at = datetime.now(UTC)
+            operations = []
+            for (patient, _), result in zip(batch, results):
+                if "error" in result:
+                    failed += 1
+                    click.echo(f"Skipping patient {patient['_id']}: {result['error']}")
+                    continue
+                operations.append(UpdateOne({"_id": patient["_id"]}, {"$set": {"healing_prediction": {
+                    "days": result["days"],
+                    "model_version": model_version,
+                    "predicted_at": predicted_at,
+                }}}))
+            if operations:
+                updated += app.db.patients.bulk_write(operations, ordered=False).modified_count
+            batch.clear()
+
+        for patient in cursor:
+            try:
+                batch.append((patient, format_data(patient, "patient_data")))
+            except KeyError as e:
+                failed += 1
+                click.echo(f"Skipping patient {patient['_id']}: missing field {e}")
+            if len(batch) >= BACKFILL_BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+
+        click.echo(f"Healing predictions backfilled: {updated} updated, {failed} failed (model version {model_version})")
+
+    @app.cli.command("publish-models")
+    @click.option("--version", help="Version name, the UTC time and model checksum by default")
+    @click.option("--activate", is_flag=True, help="Make the new versions active, running servers load them on their next registry check")
+    def publish_models(version, activate):
+        """Publish the model files in models/ as new registry versions"""
+        for name, getter in zip(MODEL_NAMES, (get_wound_monitoring_predictor, get_wound_healing_predictor)):
+            predictor = getter()
+            if predictor is None or predictor.model is None:
+                raise click.ClickException(f"Model {name} could not be loaded")
+
+            publish_predictor(name, predictor, version, activate)
+
+    @app.cli.command("build-models")
+    @click.option("--model", "names", multiple=True, type=click.Choice(MODEL_NAMES), help="Only build this model, can be repeated")
+    @click.option("--publish", is_flag=True, help="Publish the trained models as new registry versions")
+    @click.option("--activate", is_flag=True, help="Publish the trained models and make them active")
+    @click.option("--jobs", type=int, help="Parallel fits (-1 for one per core), TRAINING_JOBS by default")
+    @click.option("--search", type=click.Choice(SEARCH_STRATEGIES), help="Hyperparameter search strategy, TRAINING_SEARCH by default")
+    @click.option("--budget", type=float, help="Seconds each candidate model's search may take, TRAINING_BUDGET by default")
+    @click.option("--incremental", is_flag=True, help="Stream the whole dataset in chunks to models supporting partial_fit")
+    @click.option("--chunk-size", type=int, help="Rows read at a time by --incremental, TRAINING_CHUNK_SIZE by default")
+    @click.option("--epochs", type=int, help="Passes over the data of --incremental, TRAINING_EPOCHS by default")
+    @click.option("--max-rows", type=int, help="Rows loaded without --incremental, the whole dataset by default")
+    def build_models(names, publish, activate, jobs, search, budget, incremental, chunk_size, epochs, max_rows):
+        """Train the models offline and save them to models/, the server only loads prebuilt ones"""
+        for name, build in zip(MODEL_NAMES, (build_wound_monitoring_predictor, build_wound_healing_predictor)):
+            if names and name not in names:
+                continue
+
+            started = time.perf_counter()
+            predictor = build(n_jobs=jobs, search=search, budget=budget,
+                              incremental=incremental, chunksize=chunk_size, epochs=epochs, max_rows=max_rows)
+            if predictor is None or predictor.model is None:
+                raise click.ClickException(f"Model {name} could not be built")
+            click.echo(f"Built {name} in {time.perf_counter() - started:.1f}s, metrics: {predictor.metrics}")
+
+            if publish or activate:
+                publish_predictor(name, predictor, activate=activate)
@@ -0,0 +1,138 @@
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, CollectionInvalid
+from bson import ObjectId
+from datetime import datetime, UTC
+from utils.name_index import name_token_query
+
+# Indexes backing the route queries, created at startup by ensure_indexes
+INDEXES = {
+    "patients": [
+        # /patient/all, /patient/search (keyset pages on created_at, _id), /patient/deleteall, /user/delete
+        ([("supervisor", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)], {"name": "supervisor_created_at_id"}),
+        # /patient/search prefix-matches the lower-cased name tokens
+        ([("supervisor", ASCENDING), ("name_tokens", ASCENDING)], {"name": "supervisor_name_tokens"}),
+        # every single-patient route filters on {_id, supervisor}
+        ([("_id", ASCENDING), ("supervisor", ASCENDING)], {"name": "id_supervisor"}),
+    ],
+    "readings": [
+        # /patient/history ranges over one patient's readings (time-series collections on
+        # MongoDB 6.3+ create it themselves, older servers need it)
+        ([("patient", ASCENDING), ("recorded_at", ASCENDING)], {"name": "patient_recorded_at"}),
+    ],
+    "replay_leases": [
+        # leases of replays nobody resumed are dropped a day after they expired
+        ([("expires_at", ASCENDING)], {"name": "expires_at_ttl", "expireAfterSeconds": 24 * 3600}),
+    ],
+    "users": [
+        # signup relies on it to reject duplicate emails in one round trip
+        ([("email", ASCENDING)], {"name": "email_unique", "unique": True}),
+    ],
+}
+
+
+# Monitor readings and their infection predictions, written by utils.history
+READINGS_TIMESERIES = {"timeField": "recorded_at", "metaField": "patient", "granularity": "seconds"}
+
+
+def ensure_indexes(db, analysis_ttl=None, readings_ttl=None):
+    """Create the collection indexes, safe to run on every startup"""
+    # The time-series collection has to exist before indexes would create it as a plain one
+    try:
+        options = {"expireAfterSeconds": readings_ttl} if readings_ttl else {}
+        db.create_collection("readings", timeseries=READINGS_TIMESERIES, **options)
+    except CollectionInvalid:
+        pass # already there
+    except OperationFailure as e:
+        # e.g. MongoDB before 5.0, readings are then stored in a regular collection
+        print(f"Error creating time-series collection readings: {e}")
+
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                # e.g. duplicate emails stored before the unique index existed
+                print(f"Error creating index {options['name']} on {collection}: {e}")
+
+    if analysis_ttl is not None:
+        # Default name created_at_1, the analysis cache used to create the same index lazily
+        try:
+            db.analyses.create_index("created_at", expireAfterSeconds=analysis_ttl)
+        except OperationFailure:
+            # The TTL changed, update it in place whatever the index is named
+            db.command("collMod", "analyses", index={"keyPattern": {"created_at": 1}, "expireAfterSeconds": analysis_ttl})
+
+    print("Database indexes ready")
+
+
+def route_queries():
+    """The query shape and sort of each route, with placeholder values, for explain()"""
+    supervisor = str(ObjectId())
+    patient_id = ObjectId()
+    page_sort = [("created_at", -1), ("_id", -1)]
+    next_page = {"$or": [
+        {"created_at": {"$lt": datetime.now(UTC)}},
+        {"created_at": datetime.now(UTC), "_id": {"$lt": patient_id}},
+    ]}
+
+    return [
+        ("patient.get_all_patients", "patients", {"supervisor": supervisor}, page_sort),
+        ("patient.get_all_patients (next page)", "patients", {"supervisor": supervisor, **next_page}, page_sort),
+        ("patient.get_patient", "patients", {"_id": patient_id, "supervisor": supervisor}, None),
+        ("patient.search_patient", "patients", {"supervisor": supervisor, **name_token_query("ann")}, page_sort),
+        ("patient.stream_health_data", "patients", {"_id": patient_id}, None),
+        ("patient.delete_all_patients", "patients", {"supervisor": supervisor}, None),
+        ("auth.signup / auth.login", "users", {"email": "audit@example.com"}, None),
+        ("user.get_current_user", "users", {"_id": ObjectId(supervisor)}, None),
+        ("utils.get_cached_analysis", "analyses", {"_id": "0" * 64}, None),
+        ("patient.patient_history", "readings", {"patient": str(patient_id), "recorded_at": {"$gte": datetime.now(UTC)}}, [("recorded_at", 1)]),
+    ]
+
+
+def plan_stages(plan):
+    """Yield every stage name of an explain() plan tree"""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from plan_stages(item)
+
+
+def winning_plans(explain):
+    """Yield every winning plan of an explain() document, wherever it's nested (aggregation
+    stages wrap them, e.g. a time-series collection's under stages[0].$cursor.queryPlanner)"""
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == "winningPlan":
+                yield value
+            elif key != "rejectedPlans":
+                yield from winning_plans(value)
+    elif isinstance(explain, list):
+        for item in explain:
+            yield from winning_plans(item)
+
+
+def audit_queries(db):
+    """Explain every route query
+
+    Returns:
+    list: (route, collection, winning plan stages, problem): problem is "COLLSCAN" when the query
+    scans a whole collection, "no plan" when no stage could be read from the explain output, else None
+    """
+    results = []
+    for route, collection, query, sort in route_queries():
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        stages = [stage for plan in winning_plans(cursor.explain()) for stage in plan_stages(plan)]
+        if not stages:
+            problem = "no plan"
+        elif "COLLSCAN" in stages:
+            problem = "COLLSCAN"
+        else:
+            problem = None
+        results.append((route, collection, stages, problem))
+    return results
@@ -0,0 +1,210 @@
+from datetime import datetime, timedelta, UTC
+from utils.utils import HEALTH_DATA_FIELDS
+import atexit
+import math
+import os
+import threading
+import numpy as np
+
+# Readings are written in batches of READINGS_BATCH_SIZE, or every READINGS_FLUSH_INTERVAL seconds
+READINGS_BATCH_SIZE = int(os.environ.get("READINGS_BATCH_SIZE", 500))
+READINGS_FLUSH_INTERVAL = float(os.environ.get("READINGS_FLUSH_INTERVAL", 1))
+
+# Seconds readings are kept, forever if unset
+READINGS_TTL = int(os.environ["READINGS_TTL"]) if os.environ.get("READINGS_TTL") else None
+
+# Numeric series stored with every reading and available from /patient/history
+SERIES_FIELDS = HEALTH_DATA_FIELDS[1:] + ["Infection Probability"]
+
+# History query bounds
+DEFAULT_HISTORY_RANGE = timedelta(days=7)
+DEFAULT_HISTORY_POINTS = 200
+MAX_HISTORY_POINTS = 2000
+
+# Raw readings LTTB reads at most, use buckets for longer ranges
+MAX_LTTB_SCAN = 200_000
+
+
+def reading_document(patient_id, reading, probability, source, recorded_at=None):
+    """Document of one reading for the readings time-series collection, scored unless it has an error"""
+    document = {
+        "recorded_at": recorded_at or datetime.now(UTC),
+        "patient": patient_id,
+        "source": source,
+        "Infection": reading["Infection"],
+        "Infection Probability": probability,
+    }
+    document.update({field: reading[field] for field in HEALTH_DATA_FIELDS})
+    if "error" in reading:
+        document["error"] = reading["error"] # not scored, Infection and its probability are None
+    return document
+
+
+# Buffers reading documents and inserts them in batches on a background thread
+class ReadingWriter:
+    def __init__(self, collection, batch_size=None, flush_interval=None):
+        self.collection = collection
+        self.batch_size = batch_size or READINGS_BATCH_SIZE
+        self.flush_interval = flush_interval or READINGS_FLUSH_INTERVAL
+        self.pending = []
+        self.changed = threading.Condition()
+        self.thread = None
+
+    def add(self, documents):
+        with self.changed:
+            self.pending.extend(documents)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="reading-writer", daemon=True)
+                self.thread.start()
+            if len(self.pending) >= self.batch_size:
+                self.changed.notify_all()
+
+    def run(self):
+        while True:
+            with self.changed:
+                self.changed.wait_for(lambda: len(self.pending) >= self.batch_size, timeout=self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self.changed:
+            documents, self.pending = self.pending, []
+        if not documents:
+            return
+
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except Exception as e:
+            print(f"Error writing {len(documents)} readings: {str(e)}")
+
+
+reading_writer = None
+reading_writer_lock = threading.Lock()
+
+
+def get_reading_writer(db):
+    global reading_writer
+
+    with reading_writer_lock:
+        if reading_writer is None:
+            reading_writer = ReadingWriter(db.readings)
+            # Don't lose the last batch on a clean shutdown
+            atexit.register(reading_writer.flush)
+        return reading_writer
+
+
+def parse_history_range(start, end):
+    """(from, to) datetimes from ISO 8601 query values, the last DEFAULT_HISTORY_RANGE by default
+
+    Raises:
+    ValueError: If a value isn't a valid date or the range is empty
+    """
+    def parse(value):
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=UTC)
+
+    end = parse(end) if end else datetime.now(UTC)
+    start = parse(start) if start else end - DEFAULT_HISTORY_RANGE
+    if start >= end:
+        raise ValueError("'from' must be before 'to'")
+    return start, end
+
+
+def history_buckets(db, patient_id, start, end, points):
+    """Min, max and mean of every series over `points` equal time buckets, aggregated by MongoDB
+
+    Returns:
+    dict: bucket_seconds and a list of non-empty buckets, oldest first
+    """
+    bucket_ms = max(1, math.ceil((end - start).total_seconds() * 1000 / points))
+
+    # Group keys can't hold every character of the field names, use their positions
+    group = {
+        "_id": {"$floor": {"$divide": [{"$subtract": ["$recorded_at", start]}, bucket_ms]}},
+        "count": {"$sum": 1},
+    }
+    for i, field in enumerate(SERIES_FIELDS):
+        group[f"min_{i}"] = {"$min": f"${field}"}
+        group[f"max_{i}"] = {"$max": f"${field}"}
+        group[f"mean_{i}"] = {"$avg": f"${field}"}
+
+    pipeline = [
+        {"$match": {"patient": patient_id, "recorded_at": {"$gte": start, "$lt": end}}},
+        {"$group": group},
+        {"$sort": {"_id": 1}},
+    ]
+
+    buckets = []
+    for row in db.readings.aggregate(pipeline):
+        bucket = {
+            "start": (start + timedelta(milliseconds=int(row["_id"]) * bucket_ms)).isoformat(),
+            "count": row["count"],
+        }
+        for i, field in enumerate(SERIES_FIELDS):
+            bucket[field] = {"min": row[f"min_{i}"], "max": row[f"max_{i}"], "mean": row[f"mean_{i}"]}
+        buckets.append(bucket)
+
+    return {"bucket_seconds": bucket_ms / 1000, "buckets": buckets}
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets downsampling
+
+    Parameters:
+    x (numpy.ndarray): Increasing x values
+    y (numpy.ndarray): y values
+    threshold (int): Number of points to keep
+
+    Returns:
+    numpy.ndarray: Indices of the kept points, first and last always included
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    bucket_size = (n - 2) / (threshold - 2)
+
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+
+        # Third vertex: average of the next bucket (the last point for the last bucket)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+
+def history_lttb(db, patient_id, start, end, points, field):
+    """One series downsampled to `points` visually representative readings
+
+    Returns:
+    dict: the points as [timestamp, value] pairs and whether MAX_LTTB_SCAN cut the range short
+    """
+    cursor = db.readings.find(
+        {"patient": patient_id, "recorded_at": {"$gte": start, "$lt": end}, field: {"$ne": None}},
+        {"_id": 0, "recorded_at": 1, field: 1},
+    ).sort("recorded_at", 1).limit(MAX_LTTB_SCAN + 1)
+
+    times, values = [], []
+    for document in cursor:
+        times.append(document["recorded_at"].replace(tzinfo=UTC).timestamp())
+        values.append(document[field])
+
+    truncated = len(times) > MAX_LTTB_SCAN
+    x = np.array(times[:MAX_LTTB_SCAN])
+    y = np.array(values[:MAX_LTTB_SCAN], dtype=np.float64)
+    keep = lttb(x, y, points)
+
+    return {
+        "field": field,
+        "points": [[datetime.fromtimestamp(x[i], UTC).isoformat(), float(y[i])] for i in keep],
+        "truncated": truncated,
+    }
@@ -1,33 +1,360 @@
 from predictors.wound_monitoring import get_wound_monitoring_predictor
 from predictors.wound_healing_prediction import get_wound_healing_predictor
+from predictors.model_registry import RegistryError, list_versions, read_manifest, read_active, write_active, load_version, warm_up
+from collections import OrderedDict
+import os
+import sys
+import threading
+import time
+
+class PredictionCache:
+    """
+    Bounded LRU cache for predictions, with optional TTL and input quantization.
+    
+    Keys are canonicalized feature tuples: numerical values become floats (rounded to
+    `quantize` decimals when set) and categorical values strings, in model feature order.
+    """
+    
+    def __init__(self, maxsize=4096, ttl=None, quantize=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.quantize = quantize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.memory = 0
+    
+    def canonicalize(self, data, numerical_features, categorical_features):
+        """
+        Build the cache key for an input, and the (possibly quantized) features to predict on.
+        
+        Returns:
+            tuple: (key, features), key is None if the input can't be canonicalized
+        """
+        try:
+            numerical = [float(data[feature]) for feature in numerical_features]
+        except (TypeError, ValueError):
+            return None, data
+        
+        if self.quantize is not None:
+            numerical = [round(value, self.quantize) for value in numerical]
+        
+        categorical = [str(data[feature]) for feature in categorical_features]
+        
+        features = dict(zip(numerical_features, numerical))
+        features.update(zip(categorical_features, categorical))
+        
+        return tuple(numerical + categorical), features
+    
+    def get(self, key):
+        """
+        Look up a key, refreshing its LRU position.
+        
+        Returns:
+            tuple: (hit, value)
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl and time.monotonic() - entry[1] > self.ttl:
+                self.remove(key)
+                entry = None
+            
+            if entry is None:
+                self.misses += 1
+                return False, None
+            
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0]
+    
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries beyond maxsize"""
+        if self.maxsize <= 0:
+            return
+        
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            
+            self.entries[key] = (value, time.monotonic())
+            self.memory += self.entry_size(key, value)
+            
+            while len(self.entries) > self.maxsize:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+    
+    def remove(self, key):
+        # Caller holds the lock
+        value, _ = self.entries.pop(key)
+        self.memory -= self.entry_size(key, value)
+    
+    def clear(self):
+        """Drop every entry, e.g. after the models are reloaded"""
+        with self.lock:
+            self.entries.clear()
+            self.memory = 0
+    
+    @staticmethod
+    def entry_size(key, value):
+        # Approximate bytes held by one entry
+        size = sys.getsizeof(key) + sum(sys.getsizeof(item) for item in key)
+        if isinstance(value, tuple):
+            return size + sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value)
+        return size + sys.getsizeof(value)
+    
+    def stats(self):
+        """Hit/miss statistics to size the cache"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'quantize': self.quantize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'memory_bytes': self.memory
+            }
+
+def create_prediction_cache():
+    """
+    Create a prediction cache configured from the environment.
+    
+    PREDICTION_CACHE_SIZE: maximum number of entries (0 disables caching), default 4096
+    PREDICTION_CACHE_TTL: seconds before an entry expires, unset for no expiry
+    PREDICTION_CACHE_QUANTIZE: decimals numerical inputs are rounded to, unset for exact keys
+    """
+    ttl = os.environ.get('PREDICTION_CACHE_TTL')
+    quantize = os.environ.get('PREDICTION_CACHE_QUANTIZE')
+    
+    return PredictionCache(
+        maxsize=int(os.environ.get('PREDICTION_CACHE_SIZE', 4096)),
+        ttl=float(ttl) if ttl else None,
+        quantize=int(quantize) if quantize else None
+    )
+
+# Registry names of the served models
+INFECTION_MODEL = 'wound_monitoring'
+HEALING_MODEL = 'wound_healing'
+MODEL_NAMES = (INFECTION_MODEL, HEALING_MODEL)
+
+# Seconds between checks of the registry for versions activated by another worker, 0 disables them
+MODEL_REGISTRY_POLL_INTERVAL = float(os.environ.get('MODEL_REGISTRY_POLL_INTERVAL', 5))
 
 # Initialize model variables
 infection_predictor = None
 healing_predictor = None
 
-def initialize_models():
-    global infection_predictor, healing_predictor
+# Prediction caches, cleared whenever the models are (re)loaded
+infection_cache = create_prediction_cache()
+healing_cache = create_prediction_cache()
+
+# Guards swapping a predictor together with its cache, requests read both under it
+models_lock = threading.Lock()
+
+# Registry state of each model: the served version (None for the files in models/),
+# the version loading in the background and the last failed activation
+model_versions = {}
+model_loads = {}
+model_errors = {}
+registry_lock = threading.Lock()
+registry_watcher = None
+
+# Set once both models are loaded and warmed up, /health reports ready from then on
+models_ready = threading.Event()
+
+def install_predictor(name, predictor, version=None):
+    """Swap in a loaded predictor with a fresh cache, requests in flight finish on the previous one"""
+    global infection_predictor, healing_predictor, infection_cache, healing_cache
     
-    try:
-        # Initialize infection model using getter function
-        infection_predictor = get_wound_monitoring_predictor()
-        if infection_predictor and infection_predictor.model:
-            print("Infection model loaded successfully.")
+    cache = create_prediction_cache()
+    with models_lock:
+        if name == INFECTION_MODEL:
+            infection_predictor, infection_cache = predictor, cache
         else:
-            print("Error initializing infection model.")
+            healing_predictor, healing_cache = predictor, cache
+        model_versions[name] = version
         
-        # Initialize wound healing predictor using getter function
-        healing_predictor = get_wound_healing_predictor()
-        if healing_predictor and healing_predictor.model:
-            print("Wound healing model loaded successfully.")
-        else:
-            print("Error initializing wound healing model.")
+        if all(predictor is not None and predictor.model is not None for predictor in (infection_predictor, healing_predictor)):
+            models_ready.set()
+
+def run_blocking(function, *args):
+    """
+    Run CPU-bound work (unpickling, checksums, warm-up predictions) without stalling requests.
     
-    except Exception as e:
-        print(f"Error initializing models: {str(e)}")
-        
+    Under the gevent worker (see wsgi.py) background threads are greenlets sharing the hub, so the
+    work goes to gevent's pool of native threads and the calling greenlet waits on it, otherwise
+    it runs on the calling thread.
+    """
+    gevent = sys.modules.get('gevent')
+    if gevent is not None:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            return gevent.get_hub().threadpool.apply(function, args)
+    return function(*args)
+
+def load_active_predictor(name, getter):
+    """Load and warm up the registry's active version of a model, or the files in models/ when there is none"""
+    active = read_active(name)
+    if active:
+        try:
+            predictor, _ = load_version(name, active['version'])
+            return predictor, active['version']
+        except RegistryError as e:
+            print(f"Error loading {name} version {active['version']}, using the files in models/ instead: {str(e)}")
+    
+    predictor = getter()
+    if predictor.model is not None:
+        warm_up(predictor)
+    return predictor, None
+
+def initialize_models(background=False):
+    """
+    Load the served models from their prebuilt files, models are never trained here.
+    
+    Args:
+        background (bool): Load on a background thread and return right away,
+                           /health answers 503 until the models are ready
+    """
+    if background:
+        threading.Thread(target=initialize_models, name="model-loader", daemon=True).start()
+        return True
+    
+    # Every installed predictor gets a fresh cache, which also picks up the env config. Each model
+    # is loaded from the registry, or using its getter function, a failure leaves only that one out
+    for name, getter, label in ((INFECTION_MODEL, get_wound_monitoring_predictor, "Infection model"),
+                                (HEALING_MODEL, get_wound_healing_predictor, "Wound healing model")):
+        try:
+            predictor, version = run_blocking(load_active_predictor, name, getter)
+            install_predictor(name, predictor, version)
+            if predictor and predictor.model:
+                print(f"{label} loaded successfully.")
+            else:
+                print(f"Error initializing {label.lower()}.")
+        except Exception as e:
+            model_errors[name] = {'version': None, 'error': str(e)}
+            print(f"Error initializing {label.lower()}: {str(e)}")
+    
+    start_registry_watcher()
     return True
 
+def activate_model(name, version=None, rollback=False):
+    """
+    Load a registry version in the background, warm it up and swap it in.
+    
+    The active pointer is only moved once the version serves in this worker,
+    the registry watcher of every other worker then loads it too.
+    
+    Args:
+        name (str): INFECTION_MODEL or HEALING_MODEL
+        version (str): Version to activate, the latest published one by default
+        rollback (bool): Go back to the version served before the active one instead
+        
+    Returns:
+        str: The version being loaded
+    """
+    if name not in MODEL_NAMES:
+        raise RegistryError(f"Unknown model: {name}", status_code=404)
+    
+    active = read_active(name) or {'version': None, 'history': []}
+    if rollback:
+        if not active['history']:
+            raise RegistryError(f"Model {name} has no previous version to roll back to", status_code=409)
+        version = active['history'][-1]
+        history = active['history'][:-1]
+    else:
+        if version is None:
+            versions = list_versions(name)
+            if not versions:
+                raise RegistryError(f"Model {name} has no published versions", status_code=404)
+            version = versions[-1]['version']
+        history = active['history'] + ([active['version']] if active['version'] and active['version'] != version else [])
+    
+    # Fail fast on an unknown version
+    read_manifest(name, version)
+    
+    with registry_lock:
+        if name in model_loads:
+            raise RegistryError(f"Model {name} is already loading version {model_loads[name]['version']}", status_code=409)
+        model_loads[name] = {'version': version, 'started_at': time.time()}
+    
+    def load():
+        try:
+            # Loaded off the hub, only the swap happens on it
+            predictor, _ = run_blocking(load_version, name, version)
+            install_predictor(name, predictor, version)
+            write_active(name, version, history)
+            model_errors.pop(name, None)
+            print(f"Model {name} version {version} activated")
+        except Exception as e:
+            model_errors[name] = {'version': version, 'error': str(e)}
+            print(f"Error activating {name} version {version}: {str(e)}")
+        finally:
+            with registry_lock:
+                model_loads.pop(name, None)
+    
+    threading.Thread(target=load, name=f"model-load-{name}", daemon=True).start()
+    return version
+
+def sync_registry():
+    """Load the versions other workers activated, skipping one that already failed here"""
+    for name in MODEL_NAMES:
+        active = read_active(name)
+        if not active or active['version'] == model_versions.get(name):
+            continue
+        if name in model_loads or model_errors.get(name, {}).get('version') == active['version']:
+            continue
+        
+        try:
+            predictor, _ = run_blocking(load_version, name, active['version'])
+            install_predictor(name, predictor, active['version'])
+            print(f"Model {name} version {active['version']} loaded from the registry")
+        except Exception as e:
+            model_errors[name] = {'version': active['version'], 'error': str(e)}
+            print(f"Error loading {name} version {active['version']}: {str(e)}")
+
+def start_registry_watcher():
+    global registry_watcher
+    
+    if MODEL_REGISTRY_POLL_INTERVAL <= 0 or registry_watcher is not None:
+        return
+    
+    def watch():
+        while True:
+            time.sleep(MODEL_REGISTRY_POLL_INTERVAL)
+            try:
+                sync_registry()
+            except Exception as e:
+                print(f"Error checking the model registry: {str(e)}")
+    
+    registry_watcher = threading.Thread(target=watch, name="model-registry-watcher", daemon=True)
+    registry_watcher.start()
+
+def get_model_status():
+    """
+    Get the registry state of the served models.
+    
+    Returns:
+        dict: Whether the models are ready, then per model the served and active versions, rollback
+              history, background load, last error and the manifests of the published versions
+    """
+    status = {'ready': models_ready.is_set()}
+    for name in MODEL_NAMES:
+        active = read_active(name) or {}
+        status[name] = {
+            'serving': model_versions.get(name),
+            'active': active.get('version'),
+            'history': active.get('history', []),
+            'loading': model_loads.get(name),
+            'error': model_errors.get(name),
+            'versions': list_versions(name)
+        }
+    return status
+
 def predict_infection(data):
     """
     Predict infection probability for given wound data.
@@ -38,27 +365,55 @@ def predict_infection(data):
     Returns:
         tuple: (prediction, probability) where prediction is 'Yes' or 'No' and probability is float
     """
-    global infection_predictor
+    with models_lock:
+        predictor, cache = infection_predictor, infection_cache
     
     # Check if the model is initialized
-    if infection_predictor is None or infection_predictor.model is None:
+    if predictor is None or predictor.model is None:
         raise Exception('Infection model not initialized')
     
     # Get feature columns from infection_predictor
-    prediction_features = infection_predictor.get_prediction_features()
+    prediction_features = predictor.get_prediction_features()
     
     # Ensure all required features are provided
     for feature in prediction_features:
         if feature not in data:
             raise ValueError(f'Missing feature: {feature}')
     
+    # Serve repeated inputs from the cache
+    key, features = cache.canonicalize(data, predictor.numerical_features, predictor.categorical_features)
+    if key is not None:
+        hit, result = cache.get(key)
+        if hit:
+            return result
+    
     # Make prediction
-    prediction, probability = infection_predictor.predict(data)
+    prediction, probability = predictor.predict(features)
     
     if prediction is None:
         raise Exception('Error making prediction')
+    
+    # Estimators without predict_proba give no probability
+    result = ('Yes' if prediction == 1 else 'No', float(probability) if probability is not None else None)
+    if key is not None:
+        cache.put(key, result)
         
-    return ('Yes' if prediction == 1 else 'No', float(probability))
+    return result
+
+def get_healing_model_version():
+    """
+    Get the version of the loaded wound healing model artifact.
+    
+    Returns:
+        str: Short checksum of the model file, None if the model is not initialized
+    """
+    with models_lock:
+        predictor = healing_predictor
+    
+    if predictor is None or predictor.model is None or not predictor.model_checksum:
+        return None
+    
+    return predictor.model_checksum[:16]
 
 def predict_healing(data):
     """
@@ -70,24 +425,109 @@ def predict_healing(data):
     Returns:
         float: Predicted healing time in days
     """
-    global healing_predictor
+    with models_lock:
+        predictor, cache = healing_predictor, healing_cache
     
     # Check if the model is initialized
-    if healing_predictor is None or healing_predictor.model is None:
+    if predictor is None or predictor.model is None:
         raise Exception('Wound healing model not initialized')
     
     # Get feature columns from healing_predictor
-    prediction_features = healing_predictor.get_prediction_features()
+    prediction_features = predictor.get_prediction_features()
     
     # Ensure all required features are provided
     for feature in prediction_features:
         if feature not in data:
             raise ValueError(f'Missing feature: {feature}')
     
+    # Serve repeated inputs from the cache
+    key, features = cache.canonicalize(data, predictor.numerical_features, predictor.categorical_features)
+    if key is not None:
+        hit, result = cache.get(key)
+        if hit:
+            return result
+    
     # Make prediction
-    predicted_days = healing_predictor.predict(data)
+    predicted_days = predictor.predict(features)
     
     if predicted_days is None:
         raise Exception('Error making prediction')
     
-    return float(predicted_days)
\ No newline at end of file
+    result = float(predicted_days)
+    if key is not None:
+        cache.put(key, result)
+    
+    return result
+
+def predict_infection_batch(rows):
+    """
+    Predict infection probability for a batch of wound readings in one model pass.
+    
+    Args:
+        rows (list | dict): List of feature dicts, or a dict of feature columns
+        
+    Returns:
+        list: One dict per row, either {'prediction', 'probability'} or {'error'}
+    """
+    with models_lock:
+        predictor = infection_predictor
+    
+    # Check if the model is initialized
+    if predictor is None or predictor.model is None:
+        raise Exception('Infection model not initialized')
+    
+    # Make predictions
+    predictions, errors = predictor.predict_batch(rows)
+    
+    results = []
+    for i, (prediction, probability) in enumerate(predictions):
+        if i in errors:
+            results.append({'error': errors[i]})
+        else:
+            results.append({
+                'prediction': 'Yes' if prediction == 1 else 'No',
+                'probability': float(probability) if probability is not None else None
+            })
+    
+    return results
+
+def predict_healing_batch(rows):
+    """
+    Predict healing time for a batch of wounds in one model pass.
+    
+    Args:
+        rows (list | dict): List of feature dicts, or a dict of feature columns
+        
+    Returns:
+        list: One dict per row, either {'days'} or {'error'}
+    """
+    with models_lock:
+        predictor = healing_predictor
+    
+    # Check if the model is initialized
+    if predictor is None or predictor.model is None:
+        raise Exception('Wound healing model not initialized')
+    
+    # Make predictions
+    predictions, errors = predictor.predict_batch(rows)
+    
+    results = []
+    for i, predicted_days in enumerate(predictions):
+        if i in errors:
+            results.append({'error': errors[i]})
+        else:
+            results.append({'days': float(predicted_days)})
+    
+    return results
+
+def get_cache_stats():
+    """
+    Get prediction cache statistics.
+    
+    Returns:
+        dict: Stats of the infection and healing caches
+    """
+    return {
+        'infection': infection_cache.stats(),
+        'healing': healing_cache.stats()
+    }
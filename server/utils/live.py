@@ -0,0 +1,349 @@
+from flask import current_app as app
+from collections import deque
+from datetime import datetime, timedelta, UTC
+from pymongo import CursorType, ReturnDocument
+from pymongo.errors import CollectionInvalid
+from utils.init_models import predict_infection_batch
+from utils.utils import HEALTH_DATA_FIELDS, calculate_healing_time, get_total_healing_time
+from utils.monitor import get_monitor_hub, MONITOR_LOG_TTL
+from utils.history import get_reading_writer, reading_document
+import json
+import os
+import threading
+import time
+import numpy as np
+
+# Readings from all patients are scored together once this many are waiting, or after
+# LIVE_BATCH_WAIT seconds, whichever comes first
+LIVE_BATCH_SIZE = int(os.environ.get("LIVE_BATCH_SIZE", 256))
+LIVE_BATCH_WAIT = float(os.environ.get("LIVE_BATCH_WAIT", 0.02))
+
+# How scored readings reach the monitor viewers: "mongo" relays them through a capped collection
+# every worker tails, "local" publishes them in the ingesting process only (single worker)
+LIVE_BUS = os.environ.get("LIVE_BUS", "mongo")
+LIVE_EVENTS_SIZE = int(os.environ.get("LIVE_EVENTS_SIZE", 16 * 1024 * 1024))
+
+# Readings of one patient waiting to be scored, batches that don't fit are refused with a 429
+LIVE_BUFFER_SIZE = int(os.environ.get("LIVE_BUFFER_SIZE", 4096))
+
+# Seconds before a patient that stopped ingesting is forgotten by the ingesting process
+LIVE_FEED_TTL = float(os.environ.get("LIVE_FEED_TTL", 600))
+
+# How long the healing time left is reused before it's recomputed from the patient
+HEALING_REFRESH_INTERVAL = 3600
+
+# Seconds between attempts to reopen a dead tailable cursor
+LIVE_BUS_RETRY_INTERVAL = 1
+
+
+def deliver(hub, patient_id, first_seq, events, published_at=None):
+    """Publish serialized readings to a patient's live channel, numbered from first_seq.
+    Readings published earlier (at published_at) count as that old for the quiet device timeout."""
+    channel = hub.live_channel(patient_id)
+    for i, data in enumerate(events):
+        channel.publish(data, seq=first_seq + i)
+
+    if published_at is not None:
+        age = max(0.0, (datetime.now(UTC) - published_at).total_seconds())
+        with channel.lock:
+            channel.published_at = time.monotonic() - age
+
+
+# Publishes scored readings straight to this process's monitor hub, only viewers connected
+# to the ingesting worker see them
+class LocalLiveBus:
+    def __init__(self, hub=None):
+        self.hub = hub or get_monitor_hub()
+        self.sequences = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        pass
+
+    def next_seq(self, patient_id, n):
+        """Sequence number of the first of n new readings of a patient"""
+        with self.lock:
+            first = self.sequences.get(patient_id, 0) + 1
+            self.sequences[patient_id] = first + n - 1
+        return first
+
+    def publish(self, patient_id, first_seq, events):
+        deliver(self.hub, patient_id, first_seq, events)
+
+
+# Relays scored readings between workers: the worker that scored them inserts them into the
+# live_events capped collection, and every worker with monitor viewers tails it into its own hub.
+# Sequence numbers come from a counter shared by the workers, so event ids (and Last-Event-ID
+# resumes) are the same whichever worker a viewer is connected to.
+class MongoLiveBus:
+    def __init__(self, db, hub=None, size=None):
+        self.db = db
+        self.hub = hub or get_monitor_hub()
+        self.size = size or LIVE_EVENTS_SIZE
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Deliver the readings published in the last MONITOR_LOG_TTL seconds, so channels that
+        are live on other workers exist here too, then tail new ones on a background thread"""
+        with self.lock:
+            if self.thread is not None:
+                return
+
+            try:
+                self.db.create_collection("live_events", capped=True, size=self.size)
+            except CollectionInvalid:
+                pass # already there
+
+            since = datetime.now(UTC) - timedelta(seconds=MONITOR_LOG_TTL)
+            seen = set()
+            for document in self.db.live_events.find({"published_at": {"$gte": since}}):
+                since, seen = self.receive(document, since, seen)
+
+            self.thread = threading.Thread(target=self.run, args=(since, seen), name="live-bus", daemon=True)
+            self.thread.start()
+
+    def receive(self, document, since, seen):
+        """Deliver a live_events document unless it was already, returns the new (since, seen)
+        position: the latest publish time and the documents delivered at that time"""
+        if document["_id"] in seen:
+            return since, seen
+
+        published_at = document["published_at"].replace(tzinfo=UTC)
+        if published_at > since:
+            since, seen = published_at, set()
+        seen.add(document["_id"])
+
+        deliver(self.hub, document["patient"], document["first_seq"], document["events"], published_at)
+        return since, seen
+
+    def run(self, since, seen):
+        while True:
+            try:
+                # Tailable cursors die when the collection is empty or wraps past them, reopen them
+                # where the last one stopped
+                cursor = self.db.live_events.find({"published_at": {"$gte": since}},
+                                                  cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    for document in cursor:
+                        since, seen = self.receive(document, since, seen)
+            except Exception as e:
+                print(f"Error tailing live readings: {str(e)}")
+            time.sleep(LIVE_BUS_RETRY_INTERVAL)
+
+    def next_seq(self, patient_id, n):
+        """Sequence number of the first of n new readings of a patient, unique across workers"""
+        counter = self.db.live_sequences.find_one_and_update(
+            {"_id": patient_id}, {"$inc": {"seq": n}}, upsert=True, return_document=ReturnDocument.AFTER)
+        return counter["seq"] - n + 1
+
+    def publish(self, patient_id, first_seq, events):
+        self.db.live_events.insert_one({
+            "patient": patient_id,
+            "first_seq": first_seq,
+            "events": events,
+            "published_at": datetime.now(UTC),
+        })
+
+
+live_bus = None
+live_bus_lock = threading.Lock()
+
+
+def get_live_bus(db):
+    """The process's live bus, started: ingest publishes to it and /patient/monitor needs it running
+    to see the live channels fed by other workers"""
+    global live_bus
+
+    with live_bus_lock:
+        if live_bus is None:
+            live_bus = LocalLiveBus() if LIVE_BUS == "local" else MongoLiveBus(db)
+    live_bus.start()
+    return live_bus
+
+
+class LiveBufferFull(Exception):
+    """A patient's readings are arriving faster than they're scored"""
+
+
+class LiveFeed:
+    def __init__(self, patient_id, buffer_size=None):
+        self.patient_id = patient_id
+        self.healing_time_left = None
+        self.healing_computed_at = 0.0
+        self.used_at = time.monotonic()
+        self.writer = None
+        self.bus = None
+
+        # Readings waiting for the scorer, one row of HEALTH_DATA_FIELDS values each. Guarded by
+        # the scorer's lock
+        self.buffer = np.empty((buffer_size or LIVE_BUFFER_SIZE, len(HEALTH_DATA_FIELDS)))
+        self.buffered = 0
+
+    def refresh_healing(self, patient):
+        """Healing time left only depends on the patient, recompute it once in a while"""
+        if time.monotonic() - self.healing_computed_at > HEALING_REFRESH_INTERVAL:
+            total_healing_time = get_total_healing_time(patient) # in days
+            self.healing_time_left = calculate_healing_time(total_healing_time, patient["created_at"])
+            self.healing_computed_at = time.monotonic()
+
+
+# Scores ingested readings in micro-batches on one background thread and publishes them
+class LiveScorer:
+    def __init__(self, batch_size=None, batch_wait=None):
+        self.batch_size = batch_size or LIVE_BATCH_SIZE
+        self.batch_wait = batch_wait or LIVE_BATCH_WAIT
+        self.ready = deque() # feeds with buffered readings, each once
+        self.pending_readings = 0
+        self.changed = threading.Condition()
+        self.thread = None
+
+    def submit(self, feed, values):
+        """Buffer a patient's readings (one row per reading) for the next micro-batch
+
+        Raises:
+        LiveBufferFull: When they don't fit in what's left of the feed's buffer, none are buffered
+        """
+        n = len(values)
+        with self.changed:
+            if feed.buffered + n > len(feed.buffer):
+                raise LiveBufferFull(f"{feed.buffered} readings already waiting to be scored")
+
+            if not feed.buffered:
+                self.ready.append(feed)
+            feed.buffer[feed.buffered:feed.buffered + n] = values
+            feed.buffered += n
+            self.pending_readings += n
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="live-scorer", daemon=True)
+                self.thread.start()
+            self.changed.notify_all()
+
+    def next_batch(self):
+        """Wait for readings, then up to batch_wait more for the batch to fill up
+
+        Returns:
+        list: (feed, values) of every feed with buffered readings, which are taken out of it
+        """
+        with self.changed:
+            while not self.ready:
+                self.changed.wait()
+
+            deadline = time.monotonic() + self.batch_wait
+            while self.pending_readings < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.changed.wait(remaining)
+
+            batch = []
+            while self.ready:
+                feed = self.ready.popleft()
+                batch.append((feed, feed.buffer[:feed.buffered].copy()))
+                feed.buffered = 0
+            self.pending_readings = 0
+            return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                self.score(batch)
+            except Exception as e:
+                print(f"Error scoring live readings: {str(e)}")
+
+    def predict(self, batch):
+        """Infection results of every reading in the batch, in order. Readings of a patient that
+        couldn't be scored get an {'error'} result each"""
+        def columns(values):
+            return {field: values[:, j].tolist() for j, field in enumerate(HEALTH_DATA_FIELDS)}
+
+        # One model pass for every waiting reading of every patient
+        try:
+            return predict_infection_batch(columns(np.concatenate([values for _, values in batch])))
+        except Exception:
+            if len(batch) == 1:
+                raise
+
+        # Then patient by patient, so one failing batch doesn't take the others with it
+        results = []
+        for feed, values in batch:
+            try:
+                results.extend(predict_infection_batch(columns(values)))
+            except Exception as e:
+                results.extend([{'error': str(e)}] * len(values))
+        return results
+
+    def score(self, batch):
+        try:
+            results = self.predict(batch)
+        except Exception as e:
+            results = [{'error': str(e)}] * sum(len(values) for _, values in batch)
+
+        offset = 0
+        for feed, values in batch:
+            feed_results = results[offset:offset + len(values)]
+            offset += len(values)
+
+            # Readings that couldn't be scored are still published and kept, without a prediction
+            events, documents = [], []
+            for row, result in zip(values, feed_results):
+                health_data = dict(zip(HEALTH_DATA_FIELDS, row.tolist()))
+                health_data['Infection'] = result.get('prediction')
+                health_data['Healing Time'] = feed.healing_time_left
+                if 'error' in result:
+                    health_data['error'] = result['error']
+                events.append(json.dumps(health_data))
+                documents.append(reading_document(feed.patient_id, health_data, result.get('probability'), "live"))
+
+            try:
+                feed.bus.publish(feed.patient_id, feed.bus.next_seq(feed.patient_id, len(events)), events)
+            except Exception as e:
+                print(f"Error publishing live readings of {feed.patient_id}: {str(e)}")
+
+            # Persisted in batches for /patient/history
+            feed.writer.add(documents)
+
+
+live_feeds = {}
+live_feeds_lock = threading.Lock()
+live_feeds_swept_at = time.monotonic()
+live_scorer = LiveScorer()
+
+
+def get_live_feed(patient_id):
+    global live_feeds_swept_at
+
+    with live_feeds_lock:
+        # Forget patients whose device went quiet, once in a while
+        now = time.monotonic()
+        if now - live_feeds_swept_at > LIVE_FEED_TTL / 10:
+            for idle_id in [key for key, feed in live_feeds.items() if now - feed.used_at > LIVE_FEED_TTL]:
+                del live_feeds[idle_id]
+            live_feeds_swept_at = now
+
+        feed = live_feeds.get(patient_id)
+        if feed is None:
+            feed = live_feeds[patient_id] = LiveFeed(patient_id)
+        feed.used_at = now
+        return feed
+
+
+def ingest_readings(patient, columns):
+    """Queue validated readings of a patient for scoring and publishing
+
+    Returns:
+    int: Number of queued readings
+
+    Raises:
+    LiveBufferFull: When the patient's earlier readings haven't been scored yet
+    """
+    feed = get_live_feed(str(patient["_id"]))
+    feed.refresh_healing(patient)
+    feed.writer = get_reading_writer(app.db)
+    feed.bus = get_live_bus(app.db)
+
+    values = np.column_stack([columns[field] for field in HEALTH_DATA_FIELDS])
+    live_scorer.submit(feed, values)
+    return len(values)
@@ -0,0 +1,107 @@
+import os
+import sys
+import threading
+import time
+
+ANALYSIS_MODEL = 'gemini-2.0-flash'
+
+grpc_gevent_lock = threading.Lock()
+grpc_gevent_ready = False
+
+
+def init_grpc_gevent():
+    """The Gemini client talks gRPC, which needs its own gevent integration under the gevent
+    worker (see wsgi.py), set up before the first gRPC object is created"""
+    global grpc_gevent_ready
+
+    monkey = sys.modules.get('gevent.monkey')
+    if monkey is None or not monkey.is_module_patched('socket'):
+        return
+
+    with grpc_gevent_lock:
+        if not grpc_gevent_ready:
+            import grpc.experimental.gevent as grpc_gevent
+            grpc_gevent.init_gevent()
+            grpc_gevent_ready = True
+
+
+# Google Gemini, the production backend
+class GeminiBackend:
+    def __init__(self, model_name=ANALYSIS_MODEL):
+        # The SDK takes about half a second to import, only pay for it once an analysis is requested
+        init_grpc_gevent()
+        import google.generativeai as genai
+        genai.configure(api_key=os.environ.get('GENAI_API_KEY'))
+
+        self.genai = genai
+        self.model_name = model_name
+
+    def generate(self, prompt):
+        model = self.genai.GenerativeModel(self.model_name)
+        response = model.generate_content(prompt)
+
+        if not response or not response.text:
+            raise Exception("Failed to generate analysis")
+
+        return response.text
+
+    # Yield text chunks as the model produces them
+    def generate_stream(self, prompt):
+        model = self.genai.GenerativeModel(self.model_name)
+
+        for chunk in model.generate_content(prompt, stream=True):
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. safety metadata only)
+                continue
+            if text:
+                yield text
+
+
+# Offline backend returning a canned analysis, for development and tests
+class FakeBackend:
+    def __init__(self, delay=0.0, text=None):
+        self.model_name = "fake"
+        self.delay = delay
+        self.text = text or (
+            "* **Summary:** Offline analysis, no language model was called.\n"
+            "* **Treatment:** Follow the current treatment plan.\n"
+            "* **Expectations:** Generated by the fake analysis backend."
+        )
+        self.prompts = []
+
+    def generate(self, prompt):
+        self.prompts.append(prompt)
+        time.sleep(self.delay)
+        return self.text
+
+    # Yield the canned text word by word, spreading the delay over the chunks
+    def generate_stream(self, prompt):
+        self.prompts.append(prompt)
+        words = self.text.split(" ")
+        for i, word in enumerate(words):
+            time.sleep(self.delay / len(words))
+            yield word if i == 0 else " " + word
+
+
+backend = None
+
+
+# Backend selected by ANALYSIS_BACKEND ("gemini" or "fake")
+def get_backend():
+    global backend
+
+    if backend is None:
+        if os.environ.get('ANALYSIS_BACKEND', 'gemini') == 'fake':
+            backend = FakeBackend(delay=float(os.environ.get('ANALYSIS_FAKE_DELAY', 0)))
+        else:
+            backend = GeminiBackend()
+
+    return backend
+
+
+# Swap the backend, e.g. a FakeBackend in tests
+def set_backend(new_backend):
+    global backend
+    backend = new_backend
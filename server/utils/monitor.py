@@ -0,0 +1,500 @@
+from collections import deque
+from utils.init_models import predict_infection_batch
+from utils.utils import HEALTH_DATA_FIELDS, calculate_healing_time, get_total_healing_time
+from utils.recordings import load_recording_columns
+from utils.history import get_reading_writer, reading_document
+from datetime import datetime, timedelta, UTC
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+import json
+import os
+import threading
+import time
+import uuid
+import pandas as pd
+
+# Wall-clock seconds per unit of the CSV Time column at speed 1 (uploads sample every
+# 2 units, so rows keep arriving every 1.5 s)
+MONITOR_SECONDS_PER_TIME_UNIT = float(os.environ.get("MONITOR_SECONDS_PER_TIME_UNIT", 0.75))
+MONITOR_SPEED = float(os.environ.get("MONITOR_SPEED", 1))
+MONITOR_MAX_SPEED = 100
+
+# Idle proxies close connections that send nothing for ~30-60 s
+MONITOR_HEARTBEAT_INTERVAL = float(os.environ.get("MONITOR_HEARTBEAT_INTERVAL", 15))
+
+
+def parse_speed(value):
+    """Replay speed from a ?speed= query value, clamped to (0, MONITOR_MAX_SPEED]
+
+    Raises:
+    ValueError: If the value is not a positive number
+    """
+    if value is None:
+        return MONITOR_SPEED
+
+    speed = float(value)
+    if not speed > 0:
+        raise ValueError("Speed must be a positive number")
+    return min(speed, MONITOR_MAX_SPEED)
+
+
+def paced(rows, speed=None, heartbeat_interval=None, time_key="Time"):
+    """Replay rows at the wall-clock pace given by their Time column
+
+    Rows are due at start + (Time - first Time) * MONITOR_SECONDS_PER_TIME_UNIT / speed,
+    rows that are late (or whose Time goes backwards) are yielded right away. The waits use
+    time.sleep, which yields to other connections under the gevent worker (see wsgi.py).
+
+    Parameters:
+    rows (iterable): dicts with a numeric time_key
+    speed (float): Replay speed factor, MONITOR_SPEED by default
+    heartbeat_interval (float): Longest silence, MONITOR_HEARTBEAT_INTERVAL by default
+
+    Yields:
+    dict: The next row when it is due, or None when a heartbeat should be sent instead
+    """
+    speed = speed or MONITOR_SPEED
+    heartbeat_interval = heartbeat_interval or MONITOR_HEARTBEAT_INTERVAL
+
+    start = last_sent = time.monotonic()
+    first_time = None
+
+    for row in rows:
+        row_time = row[time_key]
+        if first_time is None:
+            first_time = row_time
+        due = start + max(0.0, row_time - first_time) * MONITOR_SECONDS_PER_TIME_UNIT / speed
+
+        while True:
+            now = time.monotonic()
+            if now >= due:
+                break
+            if now - last_sent >= heartbeat_interval:
+                yield None
+                last_sent = now
+                continue
+            time.sleep(min(due - now, heartbeat_interval - (now - last_sent)))
+
+        yield row
+        last_sent = time.monotonic()
+
+
+def sse_event(data=None, event=None, event_id=None):
+    """Format one SSE message, a heartbeat comment when there is no data"""
+    if data is None:
+        return ": heartbeat\n\n"
+
+    message = f"id: {event_id}\n" if event_id else ""
+    if event:
+        message += f"event: {event}\n"
+    return f"{message}data: {data}\n\n"
+
+
+# Events buffered per subscriber before the drop policy kicks in
+MONITOR_QUEUE_SIZE = int(os.environ.get("MONITOR_QUEUE_SIZE", 256))
+
+# "oldest" drops the oldest buffered event, "disconnect" ends the slow subscriber's stream
+MONITOR_DROP_POLICY = os.environ.get("MONITOR_DROP_POLICY", "oldest")
+
+# Seconds a replay keeps running without any subscriber before it stops
+MONITOR_IDLE_TIMEOUT = float(os.environ.get("MONITOR_IDLE_TIMEOUT", 30))
+
+# Events kept per patient for late joiners and Last-Event-ID resumes, and how long a
+# stopped replay's log (and unfinished recording) is kept around
+MONITOR_EVENT_LOG_SIZE = int(os.environ.get("MONITOR_EVENT_LOG_SIZE", 1000))
+MONITOR_LOG_TTL = float(os.environ.get("MONITOR_LOG_TTL", 600))
+
+
+def recording_id(filepath):
+    """Identifier of the uploaded recording at filepath, None if there is none.
+    Stable across restarts, changes with every upload."""
+    try:
+        return f"{os.stat(filepath).st_mtime_ns:x}"
+    except FileNotFoundError:
+        return None
+
+
+def parse_event_id(event_id):
+    """(recording, sequence number) from an event id, (None, 0) if it is malformed"""
+    recording, _, seq = str(event_id or "").partition(".")
+    try:
+        return recording, int(seq)
+    except ValueError:
+        return None, 0
+
+
+class MonitorSubscriber:
+    def __init__(self, channel, maxsize=None, drop_policy=None):
+        self.channel = channel
+        self.events = deque()
+        self.maxsize = maxsize or MONITOR_QUEUE_SIZE
+        self.drop_policy = drop_policy or MONITOR_DROP_POLICY
+        self.dropped = 0
+        self.overflowed = False
+        self.closed = False
+        self.changed = threading.Condition()
+
+    def put(self, event):
+        with self.changed:
+            if self.closed:
+                return
+
+            if len(self.events) >= self.maxsize:
+                if self.drop_policy == "disconnect":
+                    self.overflowed = self.closed = True
+                    self.changed.notify_all()
+                    return
+                self.events.popleft()
+                self.dropped += 1
+
+            self.events.append(event)
+            self.changed.notify_all()
+
+    def backfill(self, events):
+        """Queue logged events, the log is already bounded so they bypass the drop policy"""
+        with self.changed:
+            self.events.extend(events)
+            self.changed.notify_all()
+
+    def close(self):
+        with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+    def get(self, timeout):
+        """Buffered events, waiting up to `timeout` seconds for new ones.
+        Returns (events, closed)."""
+        with self.changed:
+            if not self.events and not self.closed:
+                self.changed.wait(timeout)
+            events = list(self.events)
+            self.events.clear()
+            return events, self.closed
+
+
+# One patient's feed: a single producer publishing to any number of subscribers. Event ids
+# are "<recording>.<seq>", where seq is the row number of a reading in the uploaded recording,
+# or its number among the patient's live readings for live channels fed by /patient/ingest.
+class MonitorChannel:
+    def __init__(self, patient_id, recording, filepath=None, live=False):
+        self.patient_id = patient_id
+        self.recording = recording
+        self.filepath = filepath
+        self.live = live
+        self.log = deque(maxlen=MONITOR_EVENT_LOG_SIZE)
+        self.last_seq = 0
+        self.subscribers = set()
+        self.running = False
+        self.ended = False # the whole recording was published, or it failed
+        self.cancelled = False
+        self.idle_since = time.monotonic()
+        self.published_at = time.monotonic()
+        self.stopped_at = None
+        self.lock = threading.Lock()
+
+    def publish(self, data, event=None, seq=None):
+        with self.lock:
+            self.published_at = time.monotonic()
+            self.last_seq = self.last_seq + 1 if seq is None else seq
+            message = {"id": f"{self.recording}.{self.last_seq}", "event": event, "data": data}
+            self.log.append(message)
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def events_after(self, event_id):
+        """Logged events following event_id, the whole log for another recording"""
+        recording, seq = parse_event_id(event_id)
+        if recording != self.recording:
+            return list(self.log)
+        return [message for message in self.log if parse_event_id(message["id"])[1] > seq]
+
+    def idle_for(self):
+        with self.lock:
+            return 0.0 if self.subscribers else time.monotonic() - self.idle_since
+
+
+# In-process pub/sub hub for patient monitor streams
+class MonitorHub:
+    def __init__(self):
+        self.channels = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, patient_id, filepath, start_producer, last_event_id=None):
+        """Subscribe to a patient's feed, resuming after last_event_id
+
+        Starts start_producer(channel, start_after) when the recording at filepath isn't
+        being replayed, start_after being the last row already published.
+
+        Returns:
+        MonitorSubscriber: The new subscriber, read it with get() and unsubscribe() when done,
+                           or None if there is neither a recording nor a log to stream
+        """
+        recording = recording_id(filepath)
+
+        with self.lock:
+            self.expire()
+
+            # A running live channel takes precedence over any uploaded recording
+            channel = self.channels.get(patient_id)
+            is_live = channel is not None and channel.live and channel.running
+            if recording is not None and not is_live and (channel is None or channel.recording != recording):
+                channel = self.channels[patient_id] = MonitorChannel(patient_id, recording, filepath)
+            if channel is None:
+                return None
+
+            # Restart a replay that stopped for lack of viewers where it left off
+            start_after = None
+            if recording is not None and not channel.live and not channel.running and not channel.ended:
+                last_recording, last_seq = parse_event_id(last_event_id)
+                start_after = max(channel.last_seq, last_seq if last_recording == recording else 0)
+                channel.last_seq = start_after
+                channel.running = True
+                channel.cancelled = False
+
+            with channel.lock:
+                subscriber = MonitorSubscriber(channel)
+                subscriber.backfill(channel.events_after(last_event_id))
+                if channel.running:
+                    channel.subscribers.add(subscriber)
+                else:
+                    subscriber.close()
+
+        if start_after is not None:
+            start_producer(channel, start_after)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        channel = subscriber.channel
+        with channel.lock:
+            channel.subscribers.discard(subscriber)
+            if not channel.subscribers:
+                channel.idle_since = time.monotonic()
+        subscriber.close()
+
+    def stop(self, channel, ended=False):
+        """Mark a channel's replay as stopped and end its subscribers' streams"""
+        with channel.lock:
+            channel.running = False
+            channel.ended = channel.ended or ended
+            channel.stopped_at = time.monotonic()
+            subscribers = list(channel.subscribers)
+            channel.subscribers.clear()
+        for subscriber in subscribers:
+            subscriber.close()
+
+    def live_channel(self, patient_id):
+        """The running live channel of a patient, replacing a recording replay if there is one"""
+        with self.lock:
+            replaced = self.channels.get(patient_id)
+            if replaced is not None and replaced.live and replaced.running:
+                return replaced
+
+            # Live sequence numbers never restart (see utils.live), every live channel shares the name
+            channel = MonitorChannel(patient_id, "live", live=True)
+            channel.running = True
+            self.channels[patient_id] = channel
+
+        if replaced is not None and replaced.running:
+            replaced.cancelled = True
+            self.stop(replaced)
+        return channel
+
+    def close(self, patient_id):
+        """Cancel a patient's replay, e.g. because a new recording was uploaded"""
+        with self.lock:
+            channel = self.channels.get(patient_id)
+        if channel:
+            channel.cancelled = True
+            self.stop(channel)
+
+    def expire(self):
+        """Forget logs of replays stopped more than MONITOR_LOG_TTL seconds ago, deleting
+        recordings nobody came back to finish. Called with self.lock held."""
+        now = time.monotonic()
+        for patient_id, channel in list(self.channels.items()):
+            if channel.live and channel.running and now - channel.published_at >= MONITOR_LOG_TTL:
+                # The device went quiet
+                self.stop(channel, ended=True)
+            if channel.running or now - channel.stopped_at < MONITOR_LOG_TTL:
+                continue
+            del self.channels[patient_id]
+            if channel.filepath and not channel.ended and recording_id(channel.filepath) == channel.recording:
+                remove_recording(channel.filepath)
+
+
+monitor_hub = MonitorHub()
+
+
+def get_monitor_hub():
+    return monitor_hub
+
+
+def remove_recording(filepath):
+    try:
+        os.remove(filepath)
+        print(f"Cleaned up file: {filepath}")
+    except Exception as e:
+        print(f"Error cleaning up file: {str(e)}")
+
+
+def start_replay(flask_app, channel, patient, speed=None, start_after=0):
+    """Replay an uploaded recording into the channel on a background thread (a greenlet under gevent)
+
+    The recording is parsed and scored up front, once, whatever the number of viewers. The
+    replay stops at the end of the file, when the channel is cancelled or after
+    MONITOR_IDLE_TIMEOUT seconds without subscribers. Finished recordings are deleted,
+    stopped ones are kept so the next viewer resumes after row start_after.
+    """
+    thread = threading.Thread(
+        target=run_replay, args=(flask_app, channel, patient, speed, start_after),
+        name=f"monitor-{channel.patient_id}", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def load_recording(filepath, start_after=0):
+    """Load a recording stored by /patient/connect as fixed float64 columns
+
+    Returns:
+    tuple: (pandas.DataFrame of the HEALTH_DATA_FIELDS columns of the rows after start_after,
+            Time of the recording's first row)
+    """
+    frame = pd.DataFrame(load_recording_columns(filepath), columns=HEALTH_DATA_FIELDS)
+    return frame.iloc[start_after:].reset_index(drop=True), float(frame["Time"].iloc[0])
+
+
+def recorded_at(recording, first_time, row_time):
+    """When a recording's row was recorded: its first row at upload time (the recording id), the
+    others MONITOR_SECONDS_PER_TIME_UNIT later per unit of Time, whoever replays it and how fast"""
+    uploaded_at = datetime.fromtimestamp(int(recording, 16) / 1e9, UTC)
+    return uploaded_at + timedelta(seconds=(row_time - first_time) * MONITOR_SECONDS_PER_TIME_UNIT)
+
+
+# Rows of a recording scored per model call, bounding the memory a long recording takes
+MONITOR_SCORE_CHUNK_SIZE = 8192
+
+
+# Seconds a worker's claim on persisting a replay's readings lasts, renewed three times as often
+REPLAY_LEASE_TTL = 30
+
+
+# Every worker with viewers replays the recording on its own, only the one holding the lease
+# in the replay_leases collection stores the readings. The lease remembers the last stored
+# row, so a worker taking over after the holder stopped (or died) carries on after it.
+class ReplayLease:
+    def __init__(self, db, patient_id, recording):
+        self.db = db
+        self.key = f"{patient_id}.{recording}"
+        self.patient_id = patient_id
+        self.owner = uuid.uuid4().hex
+        self.held = False
+        self.persisted_seq = 0
+        self.checked_at = None
+
+    def claim(self, seq):
+        """Whether this worker stores reading seq, (re)claiming the lease when it's due"""
+        if self.checked_at is None or time.monotonic() - self.checked_at >= REPLAY_LEASE_TTL / 3:
+            self.renew()
+        if self.held and seq > self.persisted_seq:
+            self.persisted_seq = seq
+            return True
+        return False
+
+    def renew(self):
+        now = datetime.now(UTC)
+        self.checked_at = time.monotonic()
+        try:
+            # Matches if the lease is ours or expired, otherwise the upsert collides with the holder's
+            lease = self.db.replay_leases.find_one_and_update(
+                {"_id": self.key, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "patient": self.patient_id,
+                          "expires_at": now + timedelta(seconds=REPLAY_LEASE_TTL)},
+                 "$max": {"seq": self.persisted_seq}},
+                upsert=True, return_document=ReturnDocument.AFTER)
+            self.held = True
+            self.persisted_seq = lease["seq"]
+        except DuplicateKeyError:
+            self.held = False
+        except PyMongoError as e:
+            print(f"Error claiming the replay of {self.key}: {str(e)}")
+            self.held = False
+
+    def release(self):
+        """Let another worker's replay take over at its next renewal"""
+        if not self.held:
+            return
+        try:
+            self.db.replay_leases.update_one(
+                {"_id": self.key, "owner": self.owner},
+                {"$set": {"expires_at": datetime.now(UTC)}, "$max": {"seq": self.persisted_seq}})
+        except PyMongoError as e:
+            print(f"Error releasing the replay of {self.key}: {str(e)}")
+        self.held = False
+
+
+def score_recording(frame, patient, start_after=0):
+    """Readings ready to publish: infection predicted in batch calls of MONITOR_SCORE_CHUNK_SIZE rows and
+    the healing time left, which only depends on the patient, computed once. `frame` holds
+    the rows after start_after, errors report their row number in the recording
+
+    Returns:
+    tuple: (readings, infection probability of each reading)
+    """
+    results = []
+    for start in range(0, len(frame), MONITOR_SCORE_CHUNK_SIZE):
+        chunk = frame.iloc[start:start + MONITOR_SCORE_CHUNK_SIZE]
+        results.extend(predict_infection_batch({field: chunk[field].tolist() for field in chunk.columns}))
+    for i, result in enumerate(results):
+        if 'error' in result:
+            raise ValueError(f"Row {start_after + i + 1}: {result['error']}")
+
+    total_healing_time = get_total_healing_time(patient) # in days
+    healing_time_left = calculate_healing_time(total_healing_time, patient["created_at"])
+
+    readings = frame.to_dict('records')
+    for reading, result in zip(readings, results):
+        reading['Infection'] = result['prediction']
+        reading['Healing Time'] = healing_time_left
+    return readings, [result['probability'] for result in results]
+
+
+def run_replay(flask_app, channel, patient, speed, start_after):
+    ended = False
+    lease = ReplayLease(flask_app.db, channel.patient_id, channel.recording)
+    with flask_app.app_context():
+        try:
+            # Rows already published are skipped without predicting them again
+            frame, first_time = load_recording(channel.filepath, start_after)
+            readings, probabilities = score_recording(frame, patient, start_after)
+            writer = get_reading_writer(flask_app.db)
+            seq = start_after
+
+            # The precomputed readings are released at the pace of their Time column
+            for health_data in paced(readings, speed=speed):
+                if channel.cancelled or channel.idle_for() > MONITOR_IDLE_TIMEOUT:
+                    break
+                if health_data is None:
+                    continue
+                channel.publish(json.dumps(health_data), seq=seq + 1)
+
+                # Keep the reading for /patient/history once it's been shown, by one worker only
+                if lease.claim(seq + 1):
+                    writer.add([reading_document(channel.patient_id, health_data, probabilities[seq - start_after], "recording",
+                                                 recorded_at(channel.recording, first_time, health_data["Time"]))])
+                seq += 1
+            else:
+                channel.publish(json.dumps({"status": "finished"}), event="end", seq=seq + 1)
+                ended = True
+
+            # delete the file after streaming is complete, unless it was replaced meanwhile
+            if ended and recording_id(channel.filepath) == channel.recording:
+                remove_recording(channel.filepath)
+        except Exception as e:
+            print(f"Error in health data replay for patient {channel.patient_id}: {str(e)}")
+            channel.publish(json.dumps({"error": str(e)}), event="error")
+            ended = True
+        finally:
+            lease.release()
+            get_monitor_hub().stop(channel, ended=ended)
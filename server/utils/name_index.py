@@ -0,0 +1,165 @@
+from collections import defaultdict
+import heapq
+import os
+import re
+import threading
+import time
+import unicodedata
+
+
+# Lower-cased, accent-free word tokens of a name, stored on patients as name_tokens
+def tokenize_name(name):
+    decomposed = unicodedata.normalize("NFKD", str(name))
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return list(dict.fromkeys(token for token in re.split(r"\W+", stripped.casefold()) if token))
+
+
+# Mongo filter matching every query token as a prefix of some name token (index-backed)
+def name_token_query(query):
+    tokens = tokenize_name(query)
+    if not tokens:
+        return {}
+    return {"$and": [{"name_tokens": {"$regex": f"^{re.escape(token)}"}} for token in tokens]}
+
+
+def bigrams(token):
+    padded = f" {token} "
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+# Edit distance between `query` and the closest prefix of `token` (typos, transpositions)
+def prefix_distance(query, token, limit):
+    previous = list(range(len(token) + 1))
+    before_previous = None
+
+    for i, q in enumerate(query, 1):
+        current = [i] + [0] * len(token)
+        for j, t in enumerate(token, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (q != t))
+            if before_previous and i > 1 and j > 1 and q == token[j - 2] and query[i - 2] == t:
+                current[j] = min(current[j], before_previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before_previous, previous = previous, current
+
+    return min(previous)
+
+
+# Typo-tolerant in-process name index for one supervisor
+class NameIndex:
+    def __init__(self):
+        self.names = {}
+        self.postings = defaultdict(set)
+        self.token_bigrams = defaultdict(set)
+        self.built_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, patient_id, name):
+        with self.lock:
+            self.names[patient_id] = name
+            for token in tokenize_name(name):
+                if token not in self.postings:
+                    for bigram in bigrams(token):
+                        self.token_bigrams[bigram].add(token)
+                self.postings[token].add(patient_id)
+
+    def remove(self, patient_id):
+        with self.lock:
+            name = self.names.pop(patient_id, None)
+            if name is None:
+                return
+            for token in tokenize_name(name):
+                self.postings[token].discard(patient_id)
+                if not self.postings[token]:
+                    del self.postings[token]
+                    for bigram in bigrams(token):
+                        self.token_bigrams[bigram].discard(token)
+
+    def matching_tokens(self, query_token):
+        """Vocabulary tokens within the typo budget of query_token, with their distance"""
+        allowed = 0 if len(query_token) < 4 else 1 if len(query_token) < 7 else 2
+
+        # Candidates share enough bigrams with the query to possibly be within budget: the
+        # query's trailing bigram is lost on prefix matches, each edit breaks up to 3 more
+        counts = defaultdict(int)
+        query_bigrams = bigrams(query_token)
+        for bigram in query_bigrams:
+            for token in self.token_bigrams.get(bigram, ()):
+                counts[token] += 1
+
+        needed = max(1, len(query_bigrams) - 1 - 3 * allowed)
+        matches = {}
+        for token, count in counts.items():
+            if count >= needed:
+                distance = 0 if token.startswith(query_token) else prefix_distance(query_token, token, allowed)
+                if distance <= allowed:
+                    matches[token] = distance
+        return matches
+
+    def search(self, query, limit=50):
+        """Patient ids whose names match every query token, best matches first"""
+        tokens = tokenize_name(query)
+        if not tokens:
+            return []
+
+        with self.lock:
+            scores = None
+            for query_token in tokens:
+                token_scores = {}
+                for token, distance in self.matching_tokens(query_token).items():
+                    for patient_id in self.postings[token]:
+                        if distance < token_scores.get(patient_id, distance + 1):
+                            token_scores[patient_id] = distance
+
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {patient_id: score + token_scores[patient_id] for patient_id, score in scores.items() if patient_id in token_scores}
+
+                if not scores:
+                    return []
+
+            return heapq.nsmallest(limit, scores, key=lambda patient_id: (scores[patient_id], self.names[patient_id]))
+
+
+# Per-supervisor indexes, rebuilt from the database after NAME_INDEX_TTL seconds so writes
+# made by other worker processes show up
+NAME_INDEX_TTL = int(os.environ.get("NAME_INDEX_TTL", 300))
+name_indexes = {}
+name_indexes_lock = threading.Lock()
+
+
+def get_name_index(db, supervisor):
+    with name_indexes_lock:
+        index = name_indexes.get(supervisor)
+        if index and time.monotonic() - index.built_at < NAME_INDEX_TTL:
+            return index
+
+    index = NameIndex()
+    for patient in db.patients.find({"supervisor": supervisor}, {"name": 1}):
+        index.add(patient["_id"], patient.get("name", ""))
+
+    with name_indexes_lock:
+        name_indexes[supervisor] = index
+    return index
+
+
+# Write hooks keeping already built indexes of this process current
+def index_patient_name(supervisor, patient_id, name):
+    index = name_indexes.get(supervisor)
+    if index:
+        index.add(patient_id, name)
+
+
+def unindex_patient_name(supervisor, patient_id):
+    index = name_indexes.get(supervisor)
+    if index:
+        index.remove(patient_id)
+
+
+def drop_name_index(supervisor=None):
+    with name_indexes_lock:
+        if supervisor is None:
+            name_indexes.clear()
+        else:
+            name_indexes.pop(supervisor, None)
@@ -0,0 +1,283 @@
+from array import array
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, File, Data, Epilogue
+from utils.utils import HEALTH_DATA_FIELDS
+import codecs
+import csv
+import json
+import math
+import os
+import tempfile
+import numpy as np
+
+# Upload limits for health-data recordings
+MAX_RECORDING_BYTES = int(os.environ.get("MAX_RECORDING_BYTES", 10 * 1024 * 1024))
+MAX_RECORDING_ROWS = int(os.environ.get("MAX_RECORDING_ROWS", 100_000))
+
+# Bytes read from the upload at a time
+INGEST_CHUNK_SIZE = 64 * 1024
+
+# Limits for one /patient/ingest request
+MAX_INGEST_READINGS = int(os.environ.get("MAX_INGEST_READINGS", 1000))
+MAX_INGEST_BYTES = 1024 * 1024
+
+# Binary ingest framing: one little-endian float64 per HEALTH_DATA_FIELDS column per reading
+READING_DTYPE = np.dtype("<f8")
+READING_SIZE = READING_DTYPE.itemsize * len(HEALTH_DATA_FIELDS)
+
+# Multipart boundaries and headers around the file in a form upload
+MAX_UPLOAD_OVERHEAD = 64 * 1024
+
+# Bump when the stored layout changes
+RECORDING_FORMAT_VERSION = 1
+
+
+class RecordingError(ValueError):
+    """Rejected upload, `row` is the 1-based data row at fault (0 for the header or the file)"""
+
+    def __init__(self, message, row=0, status_code=400):
+        super().__init__(f"Row {row}: {message}" if row else message)
+        self.row = row
+        self.status_code = status_code
+
+
+class MultipartFileReader:
+    """File-like reader of one file field of a multipart/form-data body, decoded as the body
+    arrives instead of spooled first like request.files"""
+
+    def __init__(self, stream, boundary, field="file"):
+        self.stream = stream
+        self.decoder = MultipartDecoder(boundary.encode())
+        self.field = field
+        self.filename = None
+        self.buffer = bytearray()
+        self.finished = False # the file's data has ended
+
+    def next_event(self):
+        """Next multipart event, reading more of the body whenever the decoder needs it
+
+        Raises:
+        RecordingError: If the body isn't valid multipart data
+        """
+        try:
+            while True:
+                event = self.decoder.next_event()
+                if not isinstance(event, NeedData):
+                    return event
+                self.decoder.receive_data(self.stream.read(INGEST_CHUNK_SIZE) or None)
+        except ValueError:
+            raise RecordingError("Invalid multipart upload")
+
+    def open(self):
+        """Skip the body up to the file field
+
+        Returns:
+        bool: True once the file's data comes next, False if the body has no such field
+        """
+        while True:
+            event = self.next_event()
+            if isinstance(event, File) and event.name == self.field:
+                self.filename = event.filename
+                return True
+            if isinstance(event, Epilogue):
+                return False
+
+    def read(self, size=-1):
+        while not self.finished and (size < 0 or len(self.buffer) < size):
+            event = self.next_event()
+            if isinstance(event, Data):
+                self.buffer += event.data
+                self.finished = not event.more_data
+
+        size = len(self.buffer) if size < 0 else size
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+def iter_lines(stream, max_bytes):
+    """Decode a binary stream chunk by chunk into lines, enforcing the byte limit as it's read"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    received = 0
+    pending = ""
+
+    while True:
+        chunk = stream.read(INGEST_CHUNK_SIZE)
+        if not chunk:
+            break
+        received += len(chunk)
+        if received > max_bytes:
+            raise RecordingError(f"Recording is larger than {max_bytes} bytes", status_code=413)
+
+        try:
+            pending += decoder.decode(chunk)
+        except UnicodeDecodeError:
+            raise RecordingError("Recording is not UTF-8 text")
+
+        lines = pending.splitlines(keepends=True)
+        # The last line may continue in the next chunk
+        pending = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+        yield from lines
+
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def parse_recording(stream, max_bytes=None, max_rows=None):
+    """Parse and validate an uploaded CSV recording while it is read
+
+    Parameters:
+    stream: Binary file-like object with the CSV upload
+    max_bytes (int): Largest accepted upload, MAX_RECORDING_BYTES by default
+    max_rows (int): Most accepted data rows, MAX_RECORDING_ROWS by default
+
+    Returns:
+    dict: One float64 array per HEALTH_DATA_FIELDS column
+
+    Raises:
+    RecordingError: On the first invalid header or row, or when a limit is exceeded
+    """
+    max_bytes = max_bytes or MAX_RECORDING_BYTES
+    max_rows = max_rows or MAX_RECORDING_ROWS
+
+    reader = csv.reader(iter_lines(stream, max_bytes))
+    header = next(reader, None)
+    if header is None:
+        raise RecordingError("Recording is empty")
+
+    header = [name.strip() for name in header]
+    missing = [field for field in HEALTH_DATA_FIELDS if field not in header]
+    if missing:
+        raise RecordingError(f"Missing columns: {', '.join(missing)}")
+    positions = [header.index(field) for field in HEALTH_DATA_FIELDS]
+
+    columns = [array("d") for _ in HEALTH_DATA_FIELDS]
+    rows = 0
+    for values in reader:
+        if not any(value.strip() for value in values):
+            continue # blank line
+
+        rows += 1
+        if rows > max_rows:
+            raise RecordingError(f"Recording has more than {max_rows} rows", rows)
+        if len(values) != len(header):
+            raise RecordingError(f"Expected {len(header)} values, got {len(values)}", rows)
+
+        for field, position, column in zip(HEALTH_DATA_FIELDS, positions, columns):
+            try:
+                value = float(values[position])
+            except ValueError:
+                raise RecordingError(f"Invalid numeric value for {field}: {values[position]!r}", rows)
+            if not math.isfinite(value):
+                raise RecordingError(f"Invalid numeric value for {field}: {values[position]!r}", rows)
+            column.append(value)
+
+    if rows == 0:
+        raise RecordingError("Recording has no rows")
+
+    return {field: np.frombuffer(column, dtype=np.float64) for field, column in zip(HEALTH_DATA_FIELDS, columns)}
+
+
+def parse_ndjson_readings(stream, max_bytes=None, max_readings=None):
+    """Parse newline-delimited JSON readings, one object with every HEALTH_DATA_FIELDS key per line
+
+    Returns:
+    dict: One float64 array per HEALTH_DATA_FIELDS column
+
+    Raises:
+    RecordingError: On the first invalid reading, or when a limit is exceeded
+    """
+    max_bytes = max_bytes or MAX_INGEST_BYTES
+    max_readings = max_readings or MAX_INGEST_READINGS
+
+    columns = [array("d") for _ in HEALTH_DATA_FIELDS]
+    rows = 0
+    for line in iter_lines(stream, max_bytes):
+        if not line.strip():
+            continue
+
+        rows += 1
+        if rows > max_readings:
+            raise RecordingError(f"Batch has more than {max_readings} readings", rows, status_code=413)
+
+        try:
+            reading = json.loads(line)
+        except ValueError:
+            raise RecordingError("Invalid JSON", rows)
+        if not isinstance(reading, dict):
+            raise RecordingError("Reading must be an object", rows)
+
+        for field, column in zip(HEALTH_DATA_FIELDS, columns):
+            value = reading.get(field)
+            if value is None:
+                raise RecordingError(f"Missing feature: {field}", rows)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise RecordingError(f"Invalid numeric value for {field}: {value!r}", rows)
+            column.append(value)
+
+    if rows == 0:
+        raise RecordingError("Batch has no readings")
+
+    return {field: np.frombuffer(column, dtype=np.float64) for field, column in zip(HEALTH_DATA_FIELDS, columns)}
+
+
+def parse_binary_readings(stream, max_readings=None):
+    """Parse readings framed as READING_SIZE-byte records of little-endian float64 values
+    in HEALTH_DATA_FIELDS order
+
+    Returns:
+    dict: One float64 array per HEALTH_DATA_FIELDS column
+
+    Raises:
+    RecordingError: On a truncated record or non-finite value, or when a limit is exceeded
+    """
+    max_readings = max_readings or MAX_INGEST_READINGS
+
+    # A read may return less than asked for, read until the end of the body or one byte more
+    # than allowed, which tells an oversized batch apart
+    limit = max_readings * READING_SIZE + 1
+    data = bytearray()
+    while len(data) < limit:
+        chunk = stream.read(min(INGEST_CHUNK_SIZE, limit - len(data)))
+        if not chunk:
+            break
+        data += chunk
+    if len(data) > max_readings * READING_SIZE:
+        raise RecordingError(f"Batch has more than {max_readings} readings", status_code=413)
+    if not data:
+        raise RecordingError("Batch has no readings")
+    if len(data) % READING_SIZE:
+        raise RecordingError(f"Body must be a whole number of {READING_SIZE}-byte readings")
+
+    matrix = np.frombuffer(data, dtype=READING_DTYPE).reshape(-1, len(HEALTH_DATA_FIELDS))
+    invalid = ~np.isfinite(matrix)
+    if invalid.any():
+        row, column = np.argwhere(invalid)[0]
+        raise RecordingError(f"Invalid numeric value for {HEALTH_DATA_FIELDS[column]}", int(row) + 1)
+
+    return {field: matrix[:, j].astype(np.float64) for j, field in enumerate(HEALTH_DATA_FIELDS)}
+
+
+def save_recording(columns, path):
+    """Store parsed columns as an .npz file, replacing any previous recording atomically"""
+    # A temporary file of its own, concurrent uploads for the same patient never share one
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".npz")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, format_version=np.array(RECORDING_FORMAT_VERSION), **columns)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def load_recording_columns(path):
+    """Columns saved by save_recording, in HEALTH_DATA_FIELDS order
+
+    Raises:
+    ValueError: If the file was written by an incompatible version
+    """
+    with np.load(path, allow_pickle=False) as data:
+        if int(data["format_version"]) != RECORDING_FORMAT_VERSION:
+            raise ValueError("Unsupported recording format, upload the data source again")
+        return {field: data[field] for field in HEALTH_DATA_FIELDS}
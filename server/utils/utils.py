@@ -1,6 +1,13 @@
-import google.generativeai as genai
 import os
+import hashlib
 from datetime import datetime, UTC
+from flask import current_app as app
+from utils.init_models import predict_healing, get_healing_model_version, PredictionCache
+from utils.llm_backends import get_backend
+
+
+# Columns of an uploaded health-data recording, all numeric
+HEALTH_DATA_FIELDS = ["Time", "Wound Temperature", "Wound pH", "Moisture Level", "Drug Release"]
 
 
 def format_data(data, data_type):
@@ -31,31 +38,110 @@ def calculate_healing_time(prediction, created_at):
 
     return healing_time_left
 
-# Configure Google Generative AI
-genai.configure(api_key=os.environ.get('GENAI_API_KEY'))
 
-def analyze_patient(patient):
-    try:
-        # Create the prompt
-        prompt = f"""Analyze the following wound data and provide concise summary and recommendations for treatment methods, medicine, and healthcare practices. Format your response as three bulleted paragraphs: Summary (summarize patient condition), 'Treatment' (medicine recommendations directed for the wound, each recommendation is made short in a bullet point), and 'Expectations' (what the patient should expect from the treatment). Make your response as concise as possible, maximum of 150 words, skip introductions and conclusions, let the output be only the paragraphs and nothing else.
+# Total healing time prediction stored on the patient document
+def build_healing_prediction(patient):
+    model_version = get_healing_model_version()
+    if model_version is None:
+        return None
+
+    return {
+        "days": predict_healing(format_data(patient, "patient_data")),
+        "model_version": model_version,
+        "predicted_at": datetime.now(UTC),
+    }
+
+
+# Stored total healing time, recomputed lazily when the model version changed
+def get_total_healing_time(patient):
+    stored = patient.get("healing_prediction")
+    if stored and stored.get("model_version") == get_healing_model_version():
+        return stored["days"]
+
+    prediction = build_healing_prediction(patient)
+    if prediction is None:
+        # Model version unknown, predict without persisting
+        return predict_healing(format_data(patient, "patient_data"))
+
+    app.db.patients.update_one({"_id": patient["_id"]}, {"$set": {"healing_prediction": prediction}})
+    patient["healing_prediction"] = prediction
+
+    return prediction["days"]
+
+# Seconds a stored analysis stays valid (Mongo TTL index and in-process front cache)
+ANALYSIS_CACHE_TTL = int(os.environ.get('ANALYSIS_CACHE_TTL', 7 * 24 * 3600))
+
+# In-process front cache in front of the analyses collection
+analysis_cache = PredictionCache(maxsize=512, ttl=ANALYSIS_CACHE_TTL)
+
+
+def build_analysis_prompt(patient):
+    return f"""Analyze the following wound data and provide concise summary and recommendations for treatment methods, medicine, and healthcare practices. Format your response as three bulleted paragraphs: Summary (summarize patient condition), 'Treatment' (medicine recommendations directed for the wound, each recommendation is made short in a bullet point), and 'Expectations' (what the patient should expect from the treatment). Make your response as concise as possible, maximum of 150 words, skip introductions and conclusions, let the output be only the paragraphs and nothing else.
 
 Here's the data:
 
 Wound Type,Location,Severity,Infected,Patient Age,Wound Size (cm),Treatment Given,Patient Gender,Healing Time Left (days)
 {patient['wound']['type']},{patient['wound']['location']},{patient['wound']['severity']},{patient['wound']['infected']},{patient['age']},{patient['wound']['size']},{patient['wound']['treatment']},{patient['gender']},{patient['healing_time_left']}"""
 
+
+# Cache key: hash of the model name and the exact prompt
+def analysis_key(prompt):
+    return hashlib.sha256(f"{get_backend().model_name}\n{prompt}".encode()).hexdigest()
+
+
+# Look up a stored analysis, front cache first then the analyses collection
+def get_cached_analysis(key):
+    hit, entry = analysis_cache.get((key,))
+    if hit and (datetime.now(UTC) - entry["created_at"]).total_seconds() <= ANALYSIS_CACHE_TTL:
+        return entry
+
+    doc = app.db.analyses.find_one({"_id": key})
+    if not doc:
+        return None
+
+    # The TTL monitor only runs periodically, skip documents that already expired
+    created_at = doc["created_at"].replace(tzinfo=UTC)
+    if (datetime.now(UTC) - created_at).total_seconds() > ANALYSIS_CACHE_TTL:
+        return None
+
+    entry = {"analysis": doc["analysis"], "created_at": created_at}
+    analysis_cache.put((key,), entry)
+    return entry
+
+
+def store_analysis(key, analysis):
+    entry = {"analysis": analysis, "created_at": datetime.now(UTC)}
+    app.db.analyses.update_one(
+        {"_id": key},
+        {"$set": {"analysis": analysis, "model": get_backend().model_name, "created_at": entry["created_at"]}},
+        upsert=True
+    )
+    analysis_cache.put((key,), entry)
+    return entry
+
+
+def analysis_response(entry, cached):
+    return {
+        "analysis": entry["analysis"],
+        "cached": cached,
+        "age": (datetime.now(UTC) - entry["created_at"]).total_seconds(),
+    }
+
+
+def analyze_patient(patient):
+    try:
+        # Create the prompt
+        prompt = build_analysis_prompt(patient)
+        key = analysis_key(prompt)
+
+        # Serve repeat views of an unchanged patient from the cache
+        entry = get_cached_analysis(key)
+        if entry:
+            return analysis_response(entry, cached=True)
+
         # generate patient data analysis
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        response = model.generate_content(prompt)
-        
-        print(response.text)
-
-        if not response or not response.text:
-            return {"error": "Failed to generate analysis"}
-            
-        return {
-            "analysis": response.text,
-        }
+        entry = store_analysis(key, get_backend().generate(prompt))
+        return analysis_response(entry, cached=False)
     
     except Exception as e:
         print(f"Error in AI analysis: {str(e)}")
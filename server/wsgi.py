@@ -0,0 +1,18 @@
+# Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+# Long-lived SSE streams (patient monitor, analysis progress) only wait on sleeps and sockets,
+# so they run as greenlets on a few gevent workers instead of holding one thread each
+
+# Patch the standard library before anything imports socket, ssl or threading
+from gevent import monkey
+monkey.patch_all()
+
+# gRPC's gevent integration is set up with the Gemini client, see utils/llm_backends.py
+from app import app
+from utils.db import ensure_indexes
+from utils.init_models import initialize_models
+from utils.utils import ANALYSIS_CACHE_TTL
+from utils.history import READINGS_TTL
+
+ensure_indexes(app.db, analysis_ttl=ANALYSIS_CACHE_TTL, readings_ttl=READINGS_TTL)
+# Answer /health (not ready) while the models load
+initialize_models(background=True)